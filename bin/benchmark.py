@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+"""Micro-benchmarks for the hot paths in squeeze-alexa.
+No network or LMS needed: everything is replayed from memory"""
+
+import argparse
+import json
+import sys
+from os.path import dirname, realpath
+from timeit import repeat
+from urllib.parse import quote, unquote as unquote_token
+
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from squeezealexa.squeezebox.server import favorites_from, players_from, \
+    split_response, structured, groups_from, unquote
+from squeezealexa.squeezebox.schema import FAVORITES, SERVERSTATUS
+from squeezealexa.transport.ssl_wrap import SslSocketTransport
+from squeezealexa.utils import stronger
+
+TLS_RECORD_SIZE = 16 * 1024
+"""The most a single TLS read will ever return"""
+
+
+class ReplayingSocket:
+    """Quacks enough like an `SSLSocket` to replay a canned reply"""
+    _closed = True
+
+    def __init__(self, reply: bytes):
+        self.reply = reply
+        self.pos = 0
+
+    def sendall(self, data):
+        self.pos = 0
+
+    def recv(self, size=TLS_RECORD_SIZE):
+        data = self.reply[self.pos:self.pos + min(size, TLS_RECORD_SIZE)]
+        self.pos += len(data)
+        return data
+
+    def recv_into(self, buffer, nbytes=0):
+        data = self.recv(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def legacy_communicate(sock, raw: str) -> str:
+    """How `SslSocketTransport.communicate` used to read replies"""
+    eof = False
+    response = ''
+    data = raw.strip() + '\n'
+    num_lines = data.count('\n')
+    sock.sendall(data.encode('utf-8'))
+    while not eof:
+        response += sock.recv().decode('utf-8')
+        eof = response.count("\n") == num_lines or not response
+    return response
+
+
+def fake_genres_reply(size: int) -> bytes:
+    line = "genres 0 255"
+    i = 0
+    while len(line) < size:
+        line += " id%3A{i} genre%3ASome%20Genre%20{i}".format(i=i)
+        i += 1
+    return (line + "\n").encode('utf-8')
+
+
+def report(name: str, size: int, times):
+    best = min(times)
+    print("  {name:>8s}: {ms:8.2f} ms  ({rate:7.1f} MB/s)".format(
+        name=name, ms=best * 1000, rate=size / best / 1e6))
+
+
+def bench_ssl_read(args):
+    transport = SslSocketTransport('localhost', port=0)
+    for kb in args.sizes:
+        reply = fake_genres_reply(kb * 1024)
+        sock = transport._ssl_sock = ReplayingSocket(reply)
+        assert transport.communicate("genres 0 255").encode() == reply
+        assert legacy_communicate(sock, "genres 0 255").encode() == reply
+        print("{kb} KB reply:".format(kb=kb))
+        report("legacy", len(reply),
+               repeat(lambda: legacy_communicate(sock, "genres 0 255"),
+                      number=1, repeat=args.repeat))
+        report("buffered", len(reply),
+               repeat(lambda: transport.communicate("genres 0 255"),
+                      number=1, repeat=args.repeat))
+
+
+def fake_favorite(i: int):
+    return {"id": "8f7e3a2b.%d" % i, "name": "Favourite %d" % i,
+            "type": "audio", "isaudio": 1, "hasitems": 0,
+            "url": "file:///music/playlists/Fave%%20%d.m3u" % i}
+
+
+def fake_player(i: int):
+    return {"playerid": "00:04:20:00:%02x:%02x" % divmod(i, 256),
+            "uuid": None, "ip": "192.168.1.%d:3483" % (i % 256),
+            "name": "Player %d" % i, "seq_no": 0,
+            "model": "squeezelite", "modelname": "SqueezeLite",
+            "power": 1, "isplaying": 0, "displaytype": "none",
+            "isplayer": 1, "canpoweroff": 1, "connected": 1,
+            "firmware": "v1.9"}
+
+
+def fake_favorites(size: int):
+    """A `favorites items` reply as CLI text and JSON, of about `size`"""
+    items = []
+    while len(json.dumps(items)) < size:
+        items.append(fake_favorite(len(items)))
+    return items, {"count": len(items), "title": "Favorites",
+                   "loop_loop": items}
+
+
+def fake_players(size: int):
+    """A `serverstatus` reply as CLI text and JSON, of about `size`"""
+    players = []
+    while len(json.dumps(players)) < size:
+        players.append(fake_player(len(players)))
+    return players, {"player count": len(players), "players_loop": players}
+
+
+def as_cli(request: str, items) -> str:
+    """How the CLI would reply to `request` with these `items`"""
+    words = [quote(w) for w in request.split()]
+    words.append("count%%3A%d" % len(items))
+    for item in items:
+        words += ["%s%%3A%s" % (quote(k), quote(str(v)))
+                  for k, v in item.items() if v is not None]
+    return " ".join(words) + "\n"
+
+
+def bench_jsonrpc_parse(args):
+    cases = [("favorites items 0 255 want_url:1", fake_favorites,
+              favorites_from,
+              lambda r: {i['name']: i for i in
+                         (structured(f, FAVORITES) for f in r['loop_loop'])
+                         if i['isaudio']}),
+             ("serverstatus 0 99", fake_players, players_from,
+              lambda r: [structured(p, SERVERSTATUS)
+                         for p in r['players_loop']])]
+    for request, fake, from_cli, from_json in cases:
+        for kb in args.sizes:
+            items, result = fake(kb * 1024)
+            cli = as_cli(request, items)
+            body = json.dumps({"id": 1, "method": "slim.request",
+                               "result": result})
+            print("{cmd} ({num} items, {kb} KB):".format(
+                cmd=request.split()[0], num=len(items), kb=kb))
+            report("cli", len(cli),
+                   repeat(lambda: from_cli(split_response(
+                       [request], cli, raw=True)[0]),
+                       number=1, repeat=args.repeat))
+            report("json", len(body),
+                   repeat(lambda: from_json(json.loads(body)["result"]),
+                          number=1, repeat=args.repeat))
+
+
+def legacy_split_response(lines, raw_response: str):
+    """How `split_response` used to find replies (in raw mode)"""
+    raw_response = raw_response.rstrip("\n")
+
+    def start_point(text):
+        delta = -1 if text.endswith('?') else 1
+        return len(unquote(text)) + delta
+
+    return [resp_line[start_point(line):]
+            for line, resp_line in zip(lines, raw_response.splitlines())]
+
+
+def legacy_groups_from(response: str, start_key: str, extra_bools=None):
+    """How `groups_from` used to split and unquote everything up front"""
+    demunged = (tuple(unquote_token(t).split(':', 1))
+                for t in response.split(' '))
+    groups = []
+    started = False
+    for k, v in [d for d in demunged if len(d) == 2]:
+        if k == start_key or " count" in k:
+            if groups:
+                yield dict(groups)
+                groups = []
+            started = True
+            if " count" not in k:
+                groups = [(k, stronger(k, v, extra_bools))]
+        elif started:
+            groups.append((k, stronger(k, v, extra_bools)))
+    if groups:
+        yield dict(groups)
+
+
+def bench_cli_parse(args):
+    cases = [("favorites items 0 255 want_url:1",
+              [fake_favorite(i) for i in range(255)], 'name', None,
+              FAVORITES),
+             ("serverstatus 0 99",
+              [fake_player(i) for i in range(50)], 'playerid',
+              ['power', 'connected'], SERVERSTATUS)]
+    for request, items, start_key, bools, schema in cases:
+        cli = as_cli(request, items)
+
+        def legacy():
+            reply = legacy_split_response([request], cli)[0]
+            return list(legacy_groups_from(reply, start_key, bools))
+
+        def streaming():
+            reply = split_response([request], cli, raw=True)[0]
+            return list(groups_from(reply, start_key, bools))
+
+        def with_schema():
+            reply = split_response([request], cli, raw=True)[0]
+            return list(groups_from(reply, start_key, schema=schema))
+
+        assert legacy() == streaming()
+        print("{cmd} ({num} items):".format(
+            cmd=request.split()[0], num=len(items)))
+        for name, parse in [("legacy", legacy), ("stream", streaming),
+                            ("schema", with_schema)]:
+            report(name, len(cli),
+                   repeat(parse, number=1, repeat=args.repeat))
+
+
+BENCHMARKS = {
+    'cli-parse': bench_cli_parse,
+    'ssl-read': bench_ssl_read,
+    'jsonrpc-parse': bench_jsonrpc_parse,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    names = ", ".join(sorted(BENCHMARKS))
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help="Which benchmarks to run, from: %s "
+                             "(default: all)" % names)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[64, 256, 512, 1024],
+                        help="Reply sizes to try, in KB")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Timings to take (best is reported)")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("Unknown benchmark(s): %s" % ", ".join(sorted(unknown)))
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print("=== {name} ===".format(name=name))
+        BENCHMARKS[name](args)
@@ -18,21 +18,23 @@ sys.path.append(dirname(dirname(realpath(__file__))))
 
 from squeezealexa.settings import *
 from squeezealexa.transport.factory import TransportFactory
-from squeezealexa.squeezebox.server import Server, people_from
+from squeezealexa.squeezebox.server import people_from, server_class_for
 from squeezealexa.transport.base import Transport
 
 TEST_GENRES = ["Rock", "Latin", "Blues"]
 
 
 def run_diagnostics(transport: Transport):
-    server = Server(transport=transport,
-                    debug=LMS_SETTINGS.DEBUG,
-                    cur_player_id=LMS_SETTINGS.DEFAULT_PLAYER,
-                    user=LMS_SETTINGS.USERNAME,
-                    password=LMS_SETTINGS.PASSWORD)
+    server = server_class_for(transport)(
+        transport=transport,
+        debug=LMS_SETTINGS.DEBUG,
+        cur_player_id=LMS_SETTINGS.DEFAULT_PLAYER,
+        user=LMS_SETTINGS.USERNAME,
+        password=LMS_SETTINGS.PASSWORD)
     assert server.genres
     assert server.playlists
-    cur_play_details = server.get_track_details()
+    queue = server.get_queue(0, 2)
+    cur_play_details = queue[0] if queue else {}
     if cur_play_details:
         print("Currently playing: \n >> %s" %
               "\n >> ".join("%s: %s" % (k, ", ".join(v))
@@ -40,7 +42,7 @@ def run_diagnostics(transport: Transport):
     else:
         print("Nothing currently in playlist")
 
-    d = server.get_track_details(offset=+1)
+    d = queue[1] if len(queue) > 1 else {}
     print("Up next: %s >> %s >> %s" % (d.get('genre', ["Unknown genre"])[0],
                                        people_from(d, ["Unknown people"])[0],
                                        d.get('title', ['Unknown track'])[0]))
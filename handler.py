@@ -13,8 +13,9 @@
 from traceback import format_exc
 
 from squeezealexa.alexa.response import speech_response
-from squeezealexa.main import SqueezeAlexa
+from squeezealexa.main import SqueezeAlexa, needs_of
 from squeezealexa.settings import SKILL_SETTINGS, LMS_SETTINGS
+from squeezealexa.squeezebox.library_cache import LibraryCache
 from squeezealexa.squeezebox.server import ServerFactory
 from squeezealexa.transport.factory import TransportFactory
 
@@ -27,14 +28,17 @@ except ImportError:
 ERROR_SPEECH = _("<speak><say-as interpret-as='interjection'>d'oh</say-as>: "
                  "{type} - {message}.</speak>")
 
-factory = ServerFactory(TransportFactory())
+factory = ServerFactory(TransportFactory(), LibraryCache(
+    snapshot_path=LMS_SETTINGS.library_snapshot_path))
 
 
-def get_server():
+def get_server(needs=()):
     return factory.create(user=LMS_SETTINGS.username,
                           password=LMS_SETTINGS.password,
                           cur_player_id=LMS_SETTINGS.default_player,
-                          debug=LMS_SETTINGS.debug)
+                          page_size=LMS_SETTINGS.page_size,
+                          debug=LMS_SETTINGS.debug,
+                          prefetch=needs)
 
 
 def lambda_handler(event, context, server=None):
@@ -42,7 +46,7 @@ def lambda_handler(event, context, server=None):
     etc.) The JSON body of the request is provided in the event parameter.
     """
     try:
-        sqa = SqueezeAlexa(server=server or get_server(),
+        sqa = SqueezeAlexa(server=server or get_server(needs_of(event)),
                            app_id=SKILL_SETTINGS.application_id)
         return sqa.handle(event, context)
     except Exception as e:
@@ -12,9 +12,7 @@
 #   See LICENSE for full license
 
 
-import socket
 import sys
-import telnetlib
 from logging import getLogger, basicConfig, DEBUG, INFO
 from os.path import dirname, abspath
 import paho
@@ -29,46 +27,58 @@ logger = getLogger(__name__)
 logger.setLevel(DEBUG)
 
 from squeezealexa.settings import MQTT_SETTINGS, LMS_SETTINGS
-from squeezealexa.transport.mqtt import CustomClient
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.bridge import Bridge
+from squeezealexa.transport.cli import LmsCliConnection
+from squeezealexa.transport.player_state import PlayerStateMirror
+from squeezealexa.transport.reply_cache import ReplyCache, CacheInvalidator
+from squeezealexa.transport.mqtt import CustomClient, correlation_of, \
+    publish_reply
 
-telnet = None
+bridge = None
 
 
-def on_connect(client, data, flags, rc):
+def on_connect(client, data, flags, rc, properties=None):
     logger.info("Connection status: %s", mqtt.error_string(rc))
     client.subscribe(MQTT_SETTINGS.topic_req, qos=1)
 
 
-def on_subscribe(client, data, mid, granted_qos):
+def on_subscribe(client, data, mid, granted_qos, properties=None):
     logger.info("Subscribed to %s @ QOS %s. Ready to go!",
                 MQTT_SETTINGS.topic_req, granted_qos[0])
 
 
 def on_message(client, userdata, message):
-    num_lines = message.payload.count(b'\n')
-    msg = message.payload.decode('utf-8')
+    """Runs in Paho's network loop, so just hands the request on"""
     if MQTT_SETTINGS.debug:
-        logger.debug(">>> %s (@QoS %s)", msg.strip(), message.qos)
-    telnet.write(message.payload.strip() + b'\n')
-    resp_lines = []
-    while len(resp_lines) < num_lines:
-        resp_lines.append(telnet.read_until(b'\n').strip())
-
-    rsp = b'\n'.join(resp_lines)
-    if rsp:
+        cid, payload = correlation_of(message)
+        logger.debug(">>> %s (@QoS %s, ID: %s)",
+                     payload.decode('utf-8').strip(), message.qos, cid)
+    bridge.submit(message)
+
+
+def reply_with(client):
+    def reply(message, rsp):
         if MQTT_SETTINGS.debug:
             logger.debug("<<< %s", rsp.decode('utf-8'))
-        client.publish(MQTT_SETTINGS.topic_resp, rsp, qos=1)
-    else:
-        logger.warning("No reply")
+        publish_reply(client, message, rsp, MQTT_SETTINGS.topic_resp)
+
+    return reply
+
+
+def publish_retained(client):
+    def publish(topic, payload):
+        client.publish(topic, payload, qos=1, retain=True)
+
+    return publish
 
 
 def connect_cli():
-    global telnet
-    telnet = telnetlib.Telnet(host=MQTT_SETTINGS.internal_server_hostname,
-                              port=LMS_SETTINGS.cli_port, timeout=5)
-    logger.info("Connected to the LMS CLI.")
-    return telnet
+    cli = LmsCliConnection(MQTT_SETTINGS.internal_server_hostname,
+                           port=LMS_SETTINGS.cli_port,
+                           user=LMS_SETTINGS.username,
+                           password=LMS_SETTINGS.password)
+    return cli.connect()
 
 
 if __name__ == "__main__":
@@ -77,24 +87,42 @@ if __name__ == "__main__":
     if not MQTT_SETTINGS.configured:
         logger.error("MQTT transport not configured. Check your settings")
         exit(1)
+    client = CustomClient(MQTT_SETTINGS)
+    cache = invalidator = mirror = None
+    if MQTT_SETTINGS.cache_size:
+        cache = ReplyCache(max_size=MQTT_SETTINGS.cache_size)
+        invalidator = CacheInvalidator(cache, connect_cli)
+    bridge = Bridge(connect_cli, reply_with(client),
+                    workers=MQTT_SETTINGS.cli_connections, cache=cache)
+    if MQTT_SETTINGS.topic_state:
+        mirror = PlayerStateMirror(connect_cli, publish_retained(client),
+                                   MQTT_SETTINGS.topic_state)
+        # Withdraw the (soon stale) states if we die
+        client.will_set(MQTT_SETTINGS.topic_state, b'', qos=1, retain=True)
     try:
-        telnet = connect_cli()
-    except socket.timeout as e:
+        bridge.start()
+        if invalidator:
+            invalidator.start()
+    except Error as e:
         logger.error("Couldn't connect to LMS CLI using %s (%s)",
                      MQTT_SETTINGS, e)
         exit(3)
     else:
-        client = CustomClient(MQTT_SETTINGS)
         client.enable_logger()
         client.on_connect = on_connect
         client.on_subscribe = on_subscribe
         client.on_message = on_message
         logger.debug("Connecting to MQTT endpoint")
         client.connect()
+        if mirror:
+            mirror.start()
         logger.debug("Starting MQTT client loop")
         # Continue the network loop
         client.loop_forever(retry_first_connection=False)
     finally:
-        if telnet:
-            telnet.close()
+        if mirror:
+            mirror.stop()
+        if invalidator:
+            invalidator.stop()
+        bridge.stop()
         logger.info("Exiting")
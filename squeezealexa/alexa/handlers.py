@@ -66,6 +66,17 @@ class AlexaHandler(object):
         return session
 
 
+def needs(*what):
+    """Declares the data (see `Needs`) that an intent handler needs,
+    so that it can all be fetched up front, together"""
+
+    def _needs(func):
+        func.needs = set(what)
+        return func
+
+    return _needs
+
+
 class IntentHandler(object):
 
     def __init__(self):
@@ -18,13 +18,15 @@ import time
 import warnings
 from typing import Iterable
 
-from squeezealexa.alexa.handlers import AlexaHandler, IntentHandler
+from squeezealexa.alexa.handlers import AlexaHandler, IntentHandler, needs
 from squeezealexa.alexa.intents import *
+from squeezealexa.alexa.requests import Request
 from squeezealexa.alexa.response import audio_response, speech_response, \
     _build_response
 from squeezealexa.alexa.utterances import Utterances
 from squeezealexa.i18n import _
-from squeezealexa.squeezebox.server import Server, print_d, people_from
+from squeezealexa.squeezebox.server import Server, print_d, people_from, \
+    Needs
 from squeezealexa.utils import human_join, sanitise_text
 
 with warnings.catch_warnings():
@@ -43,13 +45,32 @@ class MinConfidences(object):
 
 MAX_GUESSES_PER_SLOT = 2
 AUDIO_TIMEOUT_SECS = 60 * 15
+NOW_PLAYING_TTL_SECS = 30
+"""How long the now-playing text for a track is reused for, at most"""
 
 handler = IntentHandler()
 
 
+def needs_of(event) -> Iterable[str]:
+    """What the intent in `event` (if any) will need from the server,
+    so that a new server can fetch it along with its players"""
+    try:
+        request = event['request']
+        if request['type'] == Request.INTENT:
+            func = handler.for_name(request['intent']['name'])
+            return getattr(func, 'needs', set())
+    except (KeyError, TypeError):
+        pass
+    return set()
+
+
 class SqueezeAlexa(AlexaHandler):
     _audio_touched = 0
 
+    _NOW_PLAYING = {}
+    """The now-playing text for each player's track details.
+    Shared by successive instances (there's a new one per event)"""
+
     def __init__(self, server: Server, app_id=None):
         super(SqueezeAlexa, self).__init__(app_id)
         self._server = server
@@ -87,6 +108,9 @@ class SqueezeAlexa(AlexaHandler):
 
         intent_handler = handler.for_name(intent_name)
         if intent_handler:
+            wanted = getattr(intent_handler, 'needs', None)
+            if wanted:
+                self._server.prefetch(wanted, player_id=pid)
             return intent_handler(self, intent, session, pid=pid)
         speech = _("Sorry, I don't know how to process a \"{intent}\"").format(
             intent=intent_name)
@@ -114,8 +138,19 @@ class SqueezeAlexa(AlexaHandler):
         return self.smart_response(speech=_("Yep, pretty lame."))
 
     @handler.handle(Custom.NOW_PLAYING)
+    @needs(Needs.STATUS)
     def now_playing(self, intent, session, pid=None):
         details = self._server.get_track_details(player_id=pid)
+        heading, desc = self._now_playing_text(details, pid)
+        return self.smart_response(text=heading, speech=desc)
+
+    def _now_playing_text(self, details, pid=None):
+        """The heading and description for the track `details`.
+        The server returns the same details object until the player's
+        queue changes, so the text is reused for that (up to a TTL)"""
+        cached = self._NOW_PLAYING.get(pid)
+        if cached and cached[0] is details and time.monotonic() < cached[1]:
+            return cached[2]
         title = details.get('title', [None])[0]
         artists = people_from(details)
         if title:
@@ -127,7 +162,10 @@ class SqueezeAlexa(AlexaHandler):
         else:
             desc = _("Nothing playing.")
             heading = None
-        return self.smart_response(text=heading, speech=desc)
+        text = heading, desc
+        self._NOW_PLAYING[pid] = (details, time.monotonic() +
+                                  NOW_PLAYING_TTL_SECS, text)
+        return text
 
     @handler.handle(Custom.SET_VOL)
     def on_set_vol(self, intent, session, pid=None):
@@ -185,9 +223,9 @@ class SqueezeAlexa(AlexaHandler):
                                    speech=_("OK, quieter now."))
 
     @handler.handle(Custom.SELECT_PLAYER)
+    @needs(Needs.PLAYERS)
     def on_select_player(self, intent, session, pid=None):
         srv = self._server
-        srv.refresh_status()
 
         # Do it again, yes, but not defaulting this time.
         pid = self.player_id_from(intent, defaulting=False)
@@ -278,6 +316,7 @@ class SqueezeAlexa(AlexaHandler):
                                    speech=_("Ready to rock"))
 
     @handler.handle(Play.PLAYLIST)
+    @needs(Needs.PLAYLISTS)
     def on_play_playlist(self, intent, session, pid=None):
         server = self._server
         try:
@@ -314,6 +353,7 @@ class SqueezeAlexa(AlexaHandler):
                                    speech=title + extra)
 
     @handler.handle(Play.RANDOM_MIX)
+    @needs(Needs.GENRES)
     def on_play_random_mix(self, intent, session, pid=None):
         server = self._server
         try:
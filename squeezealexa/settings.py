@@ -10,7 +10,10 @@
 #
 #   See LICENSE for full license
 
+import os
+from os import environ
 from os.path import join
+from tempfile import gettempdir
 
 from squeezealexa import ROOT_DIR, Settings
 
@@ -50,6 +53,19 @@ class LmsSettings(Settings):
     CLI_PORT = 9090
     """The LAN-side port for your Squeezeserver CLI, defaults to 9090"""
 
+    DIRECT_HOSTNAME = None
+    """The LAN-side hostname of your Squeezeserver, if squeeze-alexa runs on
+    the same network (e.g. self-hosted, or bin/local_test.py).
+    If set (and MQTT isn't), the CLI is used directly over plain TCP,
+    with no SSL tunnel needed"""
+
+    JSON_RPC_URL = None
+    """The URL of the LMS web server, e.g. http://my-nas:9000 (or an HTTPS
+    reverse proxy in front of it, with any path it's under, e.g.
+    https://example.com/lms). If set (and MQTT isn't), LMS commands are
+    sent as JSON-RPC, whose structured replies are cheaper to handle.
+    USERNAME and PASSWORD are used for this too"""
+
     USERNAME = None
     """A string containing the CLI username, or None if not required."""
 
@@ -59,6 +75,18 @@ class LmsSettings(Settings):
     DEFAULT_PLAYER = None
     """The default player ID (long MAC-like string) to use"""
 
+    PAGE_SIZE = 255
+    """How many genres, playlists or favorites to fetch per request.
+    Bigger libraries are fetched in several (pipelined) pages"""
+
+    LIBRARY_SNAPSHOT_PATH = join(
+        gettempdir(), "squeeze-alexa-%s" % getattr(os, 'getuid', os.getpid)(),
+        "library.bin")
+    """Where to keep a snapshot of the LMS library (genres, playlists etc),
+    so new processes (e.g. cold Lambda containers) can start without
+    fetching it. Its directory is created private to this user.
+    /tmp is fine for Lambda. None to disable"""
+
     DEBUG = False
     """Dump LMS CLI communication to log if True"""
 
@@ -86,11 +114,26 @@ class SslSettings(Settings):
     """The certificate authority file, in .pem.
     This can be the same as the CERT_FILE_PATH if you're self-certifying."""
 
+    CERT_DATA = environ.get('SQUEEZE_ALEXA_CERT_PEM')
+    """PEM-format certificate and private key, as an alternative to
+    CERT_FILE_PATH. Defaults to the SQUEEZE_ALEXA_CERT_PEM environment
+    variable (e.g. as set in the Lambda console)"""
+
+    CA_DATA = environ.get('SQUEEZE_ALEXA_CA_PEM', CERT_DATA)
+    """PEM-format certificate authority, as an alternative to CA_FILE_PATH.
+    Defaults to the SQUEEZE_ALEXA_CA_PEM environment variable,
+    or CERT_DATA if that's not set"""
+
     VERIFY_SERVER_HOSTNAME = bool(CERT_FILE_PATH)
     """Whether to verify the server's TLS certificate hostname.
     Override to False if your certificate is for a different domain from your
     SERVER_HOSTNAME."""
 
+    MAX_CONNECTIONS = 1
+    """How many connections to the proxy can be open at once.
+    More than one lets independent requests run in parallel,
+    which is only useful on a long-lived (multi-threaded) host."""
+
 
 # -------------------------- MQTT Transport Settings --------------------------
 
@@ -107,6 +150,14 @@ class MqttSettings(Settings):
     CERT_DIR = SkillSettings.CERT_DIR
     """Where the AWS IoT certificate / key files are kept"""
 
+    CERT_DATA = environ.get('SQUEEZE_ALEXA_MQTT_CERT_PEM')
+    """The AWS IoT certificate in PEM format, instead of from CERT_DIR.
+    Defaults to the SQUEEZE_ALEXA_MQTT_CERT_PEM environment variable"""
+
+    KEY_DATA = environ.get('SQUEEZE_ALEXA_MQTT_KEY_PEM')
+    """The AWS IoT private key in PEM format, instead of from CERT_DIR.
+    Defaults to the SQUEEZE_ALEXA_MQTT_KEY_PEM environment variable"""
+
     INTERNAL_SERVER_HOSTNAME = '192.168.1.9'
     """The LAN-side hostname for your Squeezeserver
     e.g. my-nas or 192.168.1.100"""
@@ -117,20 +168,56 @@ class MqttSettings(Settings):
     TOPIC_RESP = 'squeeze-resp'
     """The MQTT topic for outgoing messages (back to squeeze-alexa Lambda)"""
 
+    TOPIC_STATE = ''
+    """The MQTT topic under which mqtt-squeeze keeps (retained) player states,
+    saving a round trip on startup, e.g. 'squeeze-state'. Set it for both
+    mqtt-squeeze and the skill, as the skill otherwise waits (briefly) for
+    states on connecting. Blank (the default) disables this"""
+
     DEBUG = False
     """Whether to log all MQTT traffic (warning: will contain passwords etc)"""
 
+    CLI_CONNECTIONS = 4
+    """How many connections mqtt-squeeze makes to the LMS CLI, each served by
+    its own thread. Commands for any one player are still kept in order"""
+
+    CACHE_SIZE = 100
+    """How many replies to read-only queries (genres, favorites etc)
+    mqtt-squeeze keeps, kept fresh by listening for LMS changes.
+    0 disables this cache"""
+
+    USE_MQTT5 = False
+    """Whether to use MQTT v5 (if the broker and Paho support it),
+    which carries request correlation IDs as message properties.
+    Otherwise they're sent as an extra line in the message"""
+
+    CORRELATION_HEADERS = True
+    """Whether to send correlation IDs as that extra line (without MQTT v5).
+    Set False for an older mqtt-squeeze, which would pass the line on to LMS
+    as a command. Replies are then matched to requests in order"""
+
     def __init__(self, hostname=HOSTNAME, port=PORT, cert_dir=CERT_DIR,
                  internal_server_hostname=INTERNAL_SERVER_HOSTNAME,
-                 topic_req=TOPIC_REQ, topic_resp=TOPIC_RESP, debug=DEBUG):
+                 topic_req=TOPIC_REQ, topic_resp=TOPIC_RESP,
+                 topic_state=TOPIC_STATE, debug=DEBUG,
+                 cert_data=CERT_DATA, key_data=KEY_DATA, use_mqtt5=USE_MQTT5,
+                 cli_connections=CLI_CONNECTIONS, cache_size=CACHE_SIZE,
+                 correlation_headers=CORRELATION_HEADERS):
         # Do these explicitly to allow us to override by name
         self.hostname = hostname
         self.cert_dir = cert_dir
+        self.cert_data = cert_data
+        self.key_data = key_data
+        self.use_mqtt5 = use_mqtt5
+        self.correlation_headers = correlation_headers
         self.port = port
         self.internal_server_hostname = internal_server_hostname
         self.topic_req = topic_req
         self.topic_resp = topic_resp
+        self.topic_state = topic_state
         self.debug = debug
+        self.cli_connections = cli_connections
+        self.cache_size = cache_size
 
     @property
     def configured(self):
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+from typing import List, Dict, Optional
+
+from squeezealexa.i18n import _
+from squeezealexa.squeezebox.library_cache import LibraryCache
+from squeezealexa.squeezebox.server import SqueezeboxException, \
+    LIBRARY_QUERIES, PLAYERS_REQUEST, TIME_REQUEST, Needs, Track, \
+    command_of, split_response, players_from, library_state_of, \
+    page_request, page_requests, \
+    count_of, status_request, track_from, no_reply_error, \
+    play_genres_requests, jump_request, playlist_play_request, \
+    playlist_resume_request, volume_request, pause_request, \
+    shuffle_request, repeat_request, power_request
+from squeezealexa.transport.base import AsyncTransport
+from squeezealexa.utils import print_d, print_w
+
+
+class AsyncServer(object):
+    """Asyncio version of `Server`, for driving lots of players
+    (or households) concurrently from one process.
+    Use `AsyncServer.create()` to connect and load players.
+    The requests (and parsing of their replies) are those of `Server`"""
+
+    page_size = 255
+
+    _LIBRARY = LibraryCache()
+    """Shared by successive instances (see `ServerFactory`)"""
+
+    def __init__(self, transport: AsyncTransport, user=None, password=None,
+                 cur_player_id=None, debug=False, page_size=None,
+                 library: LibraryCache = None):
+        self.transport = transport
+        self._debug = debug
+        self.page_size = page_size or self.page_size
+        self.library = library or self._LIBRARY
+        self.user = user
+        self.password = password
+        self.players = {}
+        self.cur_player_id = cur_player_id
+
+    @classmethod
+    async def create(cls, transport: AsyncTransport, user=None, password=None,
+                     cur_player_id=None, debug=False, page_size=None,
+                     library: LibraryCache = None) -> 'AsyncServer':
+        server = cls(transport, user, password, cur_player_id, debug,
+                     page_size, library)
+        if not transport.is_connected:
+            await transport.start()
+        if user and password:
+            await server.log_in()
+            print_d("Authenticated with {server}!", server=server)
+        await server.refresh_status()
+        players = list(server.players.values())
+        if not players:
+            raise SqueezeboxException(_("Uh-oh. No connected players found."))
+        if cur_player_id not in server.players:
+            if cur_player_id:
+                print_w("Couldn't find player {id} (found: {all}). "
+                        "Check your DEFAULT_PLAYER config.",
+                        id=cur_player_id, all=", ".join(server.players))
+            server.cur_player_id = players[0].id
+        return server
+
+    @property
+    def connected(self):
+        return self.transport.is_connected
+
+    async def disconnect(self):
+        print_d("Goodbye from {what!r}", what=self)
+        await self.transport.stop()
+
+    @property
+    def player_names(self):
+        return {p.get("name", "unknown") for p in self.players.values()}
+
+    async def log_in(self):
+        result = await self.__a_request("login %s %s"
+                                        % (self.user, self.password))
+        if result != "%s ******" % self.user:
+            raise SqueezeboxException(
+                "Couldn't log in to squeezebox: response was '%s'" % result)
+
+    async def __a_request(self, line, raw=False, wait=True):
+        reply = await self._request([line], raw=raw, wait=wait)
+        if reply:
+            return reply[0]
+        if self.user and self.password:
+            print_d("Command failed. Trying to re-log in.")
+            await self.log_in()
+            reply = await self._request([line], raw=raw, wait=wait)
+            if reply:
+                return reply[0]
+        raise no_reply_error(line)
+
+    async def _request(self, lines, raw=False, wait=True) -> List[str]:
+        """Send multiple pipelined requests to the server
+        and return their responses"""
+        if not lines:
+            return []
+        lines = [line.rstrip() for line in lines]
+        first_word = command_of(lines[0])
+        if not (self.transport.is_connected or first_word == 'login'):
+            print_w("Transport wasn't connected - trying to restart")
+            await self.transport.start()
+        if self._debug:
+            print_d("<<<< " + "\n..<< ".join(lines))
+        raw_response = await self.transport.communicate("\n".join(lines),
+                                                        wait=wait)
+        if not wait:
+            return []
+        if not raw_response:
+            raise SqueezeboxException(
+                "No further response from %s. Login problem?" % self)
+        return split_response(lines, raw_response, raw=raw)
+
+    async def refresh_status(self):
+        """Updates the list of the Squeezebox players available"""
+        response = await self.__a_request(PLAYERS_REQUEST, raw=True)
+        self.library.saw_server(*library_state_of(response))
+        self.players = players_from(response)
+        print_d("Found {total} connected player(s)", total=len(self.players))
+
+    async def player_request(self, line, player_id=None, raw=False,
+                             wait=True) -> Optional[str]:
+        """Makes a single request to a particular player (or the current)"""
+        player_id = player_id or self.cur_player_id
+        replies = await self._request(["%s %s" % (player_id, line)],
+                                      raw=raw, wait=wait)
+        return replies[0] if replies else None
+
+    async def play_genres(self, genre_list, player_id=None):
+        """Adds then plays a random mix of albums of specified genres"""
+        pid = player_id or self.cur_player_id
+        commands = play_genres_requests(genre_list)
+        return await self._request(["%s %s" % (pid, com) for com in commands])
+
+    async def get_track_details(self, offset=0,
+                                player_id=None) -> Track:
+        """Returns a dict of details,
+        for current (offset=0) or future (offset>0) playlist tracks"""
+        response = await self.player_request(status_request(offset + 1),
+                                             player_id, raw=True)
+        return track_from(response or "", offset)
+
+    async def genres(self) -> List[str]:
+        return await self._library(Needs.GENRES)
+
+    async def playlists(self) -> List[str]:
+        return await self._library(Needs.PLAYLISTS)
+
+    async def favorites(self) -> Dict[str, Dict]:
+        return await self._library(Needs.FAVORITES)
+
+    async def _library(self, name: str):
+        """All of a library collection (see `LIBRARY_QUERIES`),
+        from the `library` cache, else fetched (a page at a time)"""
+        if self.library.cached(name):
+            return self.library.get(name, None)
+        command, params, parse, collect = LIBRARY_QUERIES[name]
+        pages = await self.paged(command, params)
+        return self.library.put(name, collect(item for page in pages
+                                              for item in parse(page)))
+
+    async def paged(self, command: str, params: str = "") -> List[str]:
+        """The raw replies to a (library) query `command`,
+        a page of `page_size` results each, as for `Server.paged`"""
+        size = self.page_size
+        page = await self.__a_request(page_request(command, 0, size, params),
+                                      raw=True)
+        pages = [page]
+        for lines in page_requests(command, size, count_of(page), params):
+            print_d("Fetching {num} more page(s) of {cmd}",
+                    num=len(lines), cmd=command)
+            pages += await self._request(lines, raw=True)
+        return pages
+
+    async def next(self, player_id=None):
+        await self.player_request(jump_request(+1), player_id=player_id)
+
+    async def previous(self, player_id=None):
+        await self.player_request(jump_request(-1), player_id=player_id)
+
+    async def playlist_play(self, path, player_id=None):
+        """Play song / playlist immediately"""
+        await self.player_request(playlist_play_request(path),
+                                  player_id=player_id)
+
+    async def playlist_resume(self, name, resume=True, wipe=False,
+                              player_id=None):
+        await self.player_request(playlist_resume_request(name, resume, wipe),
+                                  wait=False, player_id=player_id)
+
+    async def change_volume(self, delta, player_id=None):
+        if not delta:
+            return
+        await self.player_request(volume_request(delta, relative=True),
+                                  player_id=player_id)
+
+    async def set_volume(self, value, player_id=None):
+        if not value:
+            return
+        await self.player_request(volume_request(value), player_id=player_id)
+
+    async def get_milliseconds(self, player_id=None):
+        secs = await self.player_request(TIME_REQUEST,
+                                         player_id=player_id) or 0
+        return float(secs) * 1000.0
+
+    async def pause(self, player_id=None):
+        await self.player_request(pause_request(), player_id=player_id)
+
+    async def resume(self, player_id=None, fade_in_secs=1):
+        await self.player_request(pause_request(False, fade_in_secs),
+                                  player_id=player_id)
+
+    async def set_shuffle(self, on=True, player_id=None):
+        await self.player_request(shuffle_request(on), player_id=player_id)
+
+    async def set_repeat(self, on=True, player_id=None):
+        await self.player_request(repeat_request(on), player_id=player_id)
+
+    async def set_power(self, on=True, player_id=None):
+        await self.player_request(power_request(on), player_id=player_id)
+
+    async def set_all_power(self, on=True):
+        await self._request(["%s %s" % (pid, power_request(on))
+                             for pid in self.players])
+
+    def __str__(self):
+        return "Squeezebox server over {transport}".format(
+            transport=self.transport)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import marshal
+import os
+import stat
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional
+
+from squeezealexa.utils import print_d, print_w, with_example
+
+TTLS = {'genres': 24 * 3600, 'playlists': 3600, 'favorites': 3600}
+"""How long each collection is cached for, at most, in seconds.
+Genres only change with a rescan (which `lastscan` catches anyway),
+but playlists and favorites can be edited at any time"""
+
+DEFAULT_TTL = 600
+
+NEGATIVE_TTL_SECS = 60
+"""How long to cache an empty collection, which may well be a fluke"""
+
+SNAPSHOT_VERSION = 1
+"""Bump this if what's in the snapshot changes"""
+
+
+class LibraryCache:
+    """Caches the LMS library collections (genres, playlists etc),
+    each for up to its TTL, and only as long as LMS's `lastscan` stays the
+    same (and the player count, if known).
+    Outlives any one `Server`, so survives them being recreated.
+
+    Given a `snapshot_path`, it's also saved there (with `marshal`)
+    whenever something's fetched, and loaded from there on creation,
+    so a new process (e.g. a cold Lambda) can start with a warm cache.
+    As `marshal` isn't safe with untrusted data, snapshots are only
+    loaded if they (and their directory) are private to this user"""
+
+    def __init__(self, ttls: Dict[str, float] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 snapshot_path: str = None):
+        self.ttls = dict(TTLS, **(ttls or {}))
+        self.clock = clock
+        self.snapshot_path = snapshot_path
+        self.lastscan = None
+        self.player_count = None
+        self._entries = {}
+        if snapshot_path:
+            self.load()
+
+    def get(self, name: str, fetch: Callable[[], Any]):
+        """The cached collection `name`, (re)fetched if need be"""
+        if self.cached(name):
+            return self._entries[name][0]
+        return self.put(name, fetch())
+
+    def cached(self, name: str) -> bool:
+        """Whether collection `name` is cached (and still fresh)"""
+        entry = self._entries.get(name)
+        return bool(entry) and self.clock() < entry[1]
+
+    def put(self, name: str, value):
+        """Caches `value` as collection `name`, returning it"""
+        ttl = (self.ttls.get(name, DEFAULT_TTL) if value
+               else min(NEGATIVE_TTL_SECS, self.ttls.get(name, DEFAULT_TTL)))
+        self._entries[name] = (value, self.clock() + ttl)
+        print_d(with_example("Loaded {num} LMS %s" % name, value))
+        if self.snapshot_path:
+            self.save()
+        return value
+
+    def saw_server(self, lastscan: Optional[int],
+                   player_count: Optional[int] = None):
+        """Notes the library's `lastscan` and the player count
+        (e.g. from `serverstatus`), dropping everything if either has
+        changed, e.g. the library was rescanned"""
+        if lastscan is not None:
+            if self.lastscan is not None and lastscan != self.lastscan:
+                print_d("LMS library rescanned ({old} -> {new}), "
+                        "dropping cached library", old=self.lastscan,
+                        new=lastscan)
+                self.invalidate()
+            self.lastscan = lastscan
+        if player_count is not None:
+            if (self.player_count is not None and
+                    player_count != self.player_count):
+                print_d("LMS now has {new} player(s), not {old}. "
+                        "Dropping cached library",
+                        old=self.player_count, new=player_count)
+                self.invalidate()
+            self.player_count = player_count
+
+    def invalidate(self, name: str = None):
+        """Drops collection `name` (or all, if None)"""
+        if name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(name, None)
+
+    def save(self):
+        """Writes a snapshot of the cache, atomically"""
+        now, wall_time = self.clock(), time.time()
+        data = {'version': SNAPSHOT_VERSION, 'lastscan': self.lastscan,
+                'player_count': self.player_count,
+                'entries': {name: (value, wall_time + expiry - now)
+                            for name, (value, expiry)
+                            in self._entries.items()}}
+        directory, name = os.path.split(os.path.abspath(self.snapshot_path))
+        tmp_path = None
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            if not private(directory):
+                raise OSError("%s isn't private" % directory)
+            fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp",
+                                            dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(data, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except (OSError, ValueError) as e:
+            print_w("Couldn't save library snapshot to {path} ({err})",
+                    path=self.snapshot_path, err=e)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load(self):
+        """Loads a snapshot, keeping whatever in it hasn't expired"""
+        try:
+            directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+            if not (private(directory) and private(self.snapshot_path)):
+                print_w("Not loading library snapshot {path}, "
+                        "as others could have written it",
+                        path=self.snapshot_path)
+                return
+            with open(self.snapshot_path, 'rb') as f:
+                data = marshal.load(f)
+            if data.get('version') != SNAPSHOT_VERSION:
+                return
+            now, wall_time = self.clock(), time.time()
+            self._entries = {name: (value, now + expires_at - wall_time)
+                             for name, (value, expires_at)
+                             in data['entries'].items()
+                             if expires_at > wall_time}
+            self.lastscan = data['lastscan']
+            self.player_count = data['player_count']
+        except FileNotFoundError:
+            return
+        except (OSError, EOFError, ValueError, TypeError, KeyError,
+                AttributeError) as e:
+            print_w("Ignoring bad library snapshot {path} ({err!r})",
+                    path=self.snapshot_path, err=e)
+            return
+        print_d("Loaded library snapshot of {names} from {path}",
+                names=", ".join(sorted(self._entries)) or "nothing",
+                path=self.snapshot_path)
+
+
+def private(path: str) -> bool:
+    """Whether `path` is this user's own, and not a symlink
+    nor writable by anyone else"""
+    st = os.lstat(path)
+    owned = not hasattr(os, 'getuid') or st.st_uid == os.getuid()
+    return (owned and not stat.S_ISLNK(st.st_mode) and
+            not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+from typing import Callable, Dict
+
+
+class PlayerRegistry:
+    """All the players LMS knows about (connected or not), by ID.
+    Updates only touch the players that changed, and bump `version`,
+    so anything derived from them need only be rebuilt when that changes.
+    `wrap` turns each player's data into whatever type is wanted"""
+
+    def __init__(self, wrap: Callable[[Dict], Dict] = dict):
+        self.wrap = wrap
+        self.version = 0
+        """Bumped whenever any player changes. Zero means none loaded yet"""
+        self.all = {}
+        self._connected = {}
+
+    @property
+    def connected(self) -> Dict[str, Dict]:
+        """The connected players, by ID"""
+        return self._connected
+
+    def update(self, players: Dict[str, Dict]) -> bool:
+        """Applies the latest data for all the `players`,
+        returning whether any had changed"""
+        gone = [pid for pid in self.all if pid not in players]
+        changed = {pid: data for pid, data in players.items()
+                   if self.all.get(pid) != data}
+        if not (gone or changed):
+            return False
+        for pid in gone:
+            del self.all[pid]
+        for pid, data in changed.items():
+            self.all[pid] = self.wrap(data)
+        self._changed()
+        return True
+
+    def set_connected(self, player_id: str, connected: bool) -> bool:
+        """Applies a change to just whether one player is connected"""
+        player = self.all.get(player_id)
+        if player is None or bool(player.get('connected')) == connected:
+            return False
+        data = dict(player, connected=connected)
+        self.all[player_id] = self.wrap(data)
+        self._changed()
+        return True
+
+    def _changed(self):
+        self._connected = {pid: p for pid, p in self.all.items()
+                           if p.get('connected')}
+        self.version += 1
+
+    def __str__(self):
+        return "{num} player(s), {conn} connected (version {version})".format(
+            num=len(self.all), conn=len(self._connected),
+            version=self.version)
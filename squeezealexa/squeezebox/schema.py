@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+"""The types of values in LMS CLI responses, by command.
+Keys not in a schema are left as strings. Empty values are always None.
+Any value that doesn't convert is left as its string, rather than failing"""
+
+from typing import Any, Callable, Dict, Optional
+
+Converter = Callable[[str], Any]
+Schema = Dict[str, Converter]
+
+
+def as_str(v: str) -> Optional[str]:
+    return v or None
+
+
+def as_bool(v: str):
+    try:
+        return bool(int(v))
+    except ValueError:
+        return v or None
+
+
+def as_int(v: str):
+    try:
+        return int(v)
+    except ValueError:
+        return v or None
+
+
+def as_float(v: str):
+    try:
+        return float(v)
+    except ValueError:
+        return v or None
+
+
+def as_number(v: str):
+    """An int, if it looks like one, else a float"""
+    try:
+        return int(v)
+    except ValueError:
+        return as_float(v)
+
+
+COUNTS = {'count': as_int}
+
+SERVERSTATUS = dict(COUNTS, **{
+    'lastscan': as_int, 'player count': as_int,
+    'sn player count': as_int, 'other player count': as_int,
+    'info total albums': as_int, 'info total artists': as_int,
+    'info total genres': as_int, 'info total songs': as_int,
+    'info total duration': as_float,
+    'playerindex': as_int, 'seq_no': as_int, 'power': as_bool,
+    'isplaying': as_bool, 'isplayer': as_bool, 'canpoweroff': as_bool,
+    'connected': as_bool,
+})
+"""`serverstatus`, including each player"""
+
+STATUS = dict(COUNTS, **{
+    'player_connected': as_bool, 'power': as_bool, 'signalstrength': as_int,
+    'time': as_float, 'rate': as_number, 'duration': as_float,
+    'can_seek': as_bool, 'remote': as_bool, 'mixer volume': as_number,
+    'playlist repeat': as_int, 'playlist shuffle': as_int, 'seq_no': as_int,
+    'playlist_cur_index': as_int, 'playlist_timestamp': as_float,
+    'playlist_tracks': as_int, 'digital_volume_control': as_bool,
+    'playlist index': as_int, 'id': as_int,
+})
+"""A player's `status`, including its playlist tracks.
+Track details (titles, artists etc) are always strings, even `1999`"""
+
+FAVORITES = dict(COUNTS, **{'isaudio': as_bool, 'hasitems': as_bool})
+"""`favorites items`. IDs look like `8f7e3a2b.1`, so are strings"""
@@ -11,13 +11,22 @@
 #   See LICENSE for full license
 
 import re
+import sys
 import time
+from collections.abc import Mapping
+from functools import lru_cache
 
-from typing import List, Dict, Union
+from functools import partial
+from typing import List, Dict, Union, Tuple, Iterable, Any, Iterator, \
+    Optional
 
+from squeezealexa.squeezebox.library_cache import LibraryCache
+from squeezealexa.squeezebox.player_registry import PlayerRegistry
+from squeezealexa.squeezebox.schema import Schema, SERVERSTATUS, STATUS, \
+    FAVORITES, as_str
 from squeezealexa.transport.base import Error
-from squeezealexa.utils import with_example, print_d, stronger, print_w, \
-    first_of
+from squeezealexa.transport.jsonrpc import JsonRpcTransport
+from squeezealexa.utils import print_d, stronger, print_w, first_of
 from squeezealexa.i18n import _
 import urllib.request as urllib
 
@@ -27,38 +36,151 @@ DETAILS_TAGS = "aAgGl"
 RESPONSE_CMD_REGEX = re.compile(r'(?:(..:)+..\s+)?(\w+)')
 """Grab the first word (command) of a response"""
 
+PLAYER_ID_REGEX = re.compile(r'((?:..:)+..)\s+')
+"""Grab the player ID (if any) starting a request"""
+
+COUNT_REGEX = re.compile(r'(?:^|\s)count(?:%3A|:)(\d+)')
+"""Grab the total count of results of a (paged) query"""
+
+PLAYERS_REQUEST = "serverstatus 0 99"
+"""Gets the server's status, including (up to 99 of) its players"""
+
+PIPELINED_PAGES = 4
+"""How many further pages of a paged query to request at once"""
+
+LIBRARY_QUERIES = {
+    'genres': ("genres", "", lambda page: values_from(page, 'genre'), list),
+    'playlists': ("playlists", "",
+                  lambda page: values_from(page, 'playlist'), list),
+    'favorites': ("favorites items", "want_url:1",
+                  lambda page: favorites_from(page).items(), dict),
+}
+"""For each library collection: its (paged) query command and parameters,
+how to get its items from a page, and what to collect them in"""
+
+QUEUE_WINDOW = 3
+"""How many of a player's tracks (from the current one) to fetch at once"""
+
+QUEUE_FRESH_SECS = 2
+"""How long a fetched queue is trusted, without checking it's unchanged"""
+
+PLAYERS_FRESH_SECS = 2
+"""How long the players are trusted, without checking they're unchanged"""
+
+DETAILS = {'title', 'genre', 'genres', 'album', 'trackartist', 'artist',
+           'albumartist', 'composer'}
+"""The track details tags that are kept"""
+
+
+class Needs:
+    """Data that intent handlers can declare they need,
+    so `Server.prefetch` can get it all at once"""
+    PLAYERS = 'players'
+    GENRES = 'genres'
+    PLAYLISTS = 'playlists'
+    FAVORITES = 'favorites'
+    STATUS = 'status'
+    """The current track details, for the player"""
+
 
 class SqueezeboxException(Exception):
     """Errors communicating with the Squeezebox"""
 
 
-class SqueezeboxPlayerSettings(dict):
-    """Encapsulates player settings"""
+class Record(Mapping):
+    """A compact, read-only mapping of just its `FIELDS`,
+    which are attributes too. Fields that are None aren't in the mapping.
+    It's equal to any mapping with the same values for these fields,
+    whatever else that has"""
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, key):
+        value = getattr(self, key) if key in self.FIELDS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (k for k in self.FIELDS if getattr(self, k) is not None)
+
+    def __len__(self):
+        return sum(1 for k in self)
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return all(getattr(self, k) == other.get(k) for k in self.FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, dict(self))
+
 
-    def __init__(self, data: dict):
-        super().__init__(data)
+class Player(Record):
+    """A player, keeping just what's used of its (`serverstatus`) data"""
+
+    FIELDS = ('playerid', 'name', 'connected', 'power', 'isplaying', 'model')
+    __slots__ = FIELDS
+
+    def __init__(self, data: Mapping):
         if 'playerid' not in data:
             raise SqueezeboxException(
                 "Couldn't find a playerid in {data}".format(data=data))
+        for k in self.FIELDS:
+            setattr(self, k, interned(data.get(k)))
 
     @property
     def id(self) -> str:
-        return self['playerid']
-
-    def __getattr__(self, key):
-        return self.get(key, None)
+        return self.playerid
 
     def __str__(self):
-        return "{name} [{short}]".format(short=self['playerid'][-5:], **self)
+        return "{name} [{short}]".format(name=self.name,
+                                         short=self.playerid[-5:])
+
+
+SqueezeboxPlayerSettings = Player
+"""The old name for `Player`"""
+
+
+class Track(Record):
+    """A track's details (title, artists etc), each a list of strings"""
+
+    FIELDS = ('title', 'album', 'genre', 'artist', 'trackartist',
+              'albumartist', 'composer')
+    __slots__ = FIELDS
+
+    def __init__(self, items: Iterable[Tuple[str, Any]] = ()):
+        for k in self.FIELDS:
+            setattr(self, k, None)
+        genres = None
+        for k, v in items:
+            if not v or k not in DETAILS:
+                continue
+            v = str(v)
+            if k in ('title', 'album'):
+                setattr(self, k, [v])
+            elif k == 'genres':
+                genres = names_in(v)
+            else:
+                setattr(self, k, names_in(v))
+        if genres:
+            # Multi-valued genres, if the server supports them
+            self.genre = genres
 
 
 class ServerFactory:
     _MAX_CACHE_SECS = 600
     _INSTANCE = None
     _CREATION_TIME = None
+    _LIBRARY = LibraryCache()
+    """Shared by successive instances, so the library isn't refetched"""
 
-    def __init__(self, transport_factory):
+    def __init__(self, transport_factory, library: LibraryCache = None):
         self.transport_factory = transport_factory
+        self.library = library or self._LIBRARY
 
     @classmethod
     def _too_old(cls):
@@ -79,31 +201,148 @@ class ServerFactory:
             print_d("Creating new server instance")
             transport = self.transport_factory.create()
             transport.start()
-            inst = type(self)._INSTANCE = Server(transport, *args, **kwargs)
+            cls = server_class_for(transport)
+            kwargs.setdefault('library', self.library)
+            inst = type(self)._INSTANCE = cls(transport, *args, **kwargs)
             type(self)._CREATION_TIME = time.time()
             return inst
         print_d("Reusing cached instance {object}", object=instance)
         return instance
 
 
+class CommandResult:
+    """The outcome of one command in a `CommandBatch`"""
+
+    def __init__(self, player_id: str, line: str, reply: str = None,
+                 error: Exception = None):
+        self.player_id = player_id
+        self.line = line
+        self.reply = reply
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return "<{line!r} for {pid}: {outcome!r}>".format(
+            line=self.line, pid=self.player_id,
+            outcome=self.reply if self.ok else self.error)
+
+
+class CommandBatch:
+    """Collects commands for any players, to send as one pipelined request,
+    so e.g. pausing every player costs one round trip, not one each.
+    While open (as a context manager), any `Server` method that makes a
+    player request adds it to the batch instead, e.g.::
+
+        with server.batch() as batch:
+            for pid in server.players:
+                server.change_volume(-10, player_id=pid)
+        failed = [r for r in batch.results if not r.ok]
+    """
+
+    def __init__(self, server: 'Server'):
+        self.server = server
+        self.commands = []
+        self.results = None
+
+    def add(self, line: str, player_id: str = None) -> 'CommandBatch':
+        """Adds a command (but not a query, as its reply would come too late)
+        for a player (or the current)"""
+        if is_query(line):
+            raise SqueezeboxException(
+                "Can't query '%s' while batching commands" % line)
+        player_id = player_id or self.server.cur_player_id
+        self.server._forget_queue(player_id)
+        self.commands.append((player_id, line))
+        return self
+
+    def send(self) -> List[CommandResult]:
+        """Sends all the commands, returning a result for each, in order"""
+        commands, self.commands = self.commands, []
+        lines = ["%s %s" % (pid, line) for pid, line in commands]
+        try:
+            replies = self.server._request(lines) if lines else []
+        except (Error, SqueezeboxException) as e:
+            print_w("Batch of {num} command(s) failed ({err})",
+                    num=len(lines), err=e)
+            replies, error = [], e
+        else:
+            error = SqueezeboxException("No reply")
+        self.results = [CommandResult(pid, line, reply, None)
+                        for (pid, line), reply in zip(commands, replies)]
+        self.results += [CommandResult(pid, line, None, error)
+                         for pid, line in commands[len(replies):]]
+        return self.results
+
+    def __enter__(self) -> 'CommandBatch':
+        if self.server._batch is not None:
+            raise SqueezeboxException("Already batching commands")
+        self.server._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server._batch = None
+        if exc_type is None:
+            self.send()
+
+
+class QueueWindow:
+    """Details of (some of) a player's tracks, from the current one,
+    as of its queue's `version` (last known current `fetched_at`)"""
+
+    def __init__(self, version: Tuple, tracks: List['Track'],
+                 size: int, fetched_at: float):
+        self.version = version
+        self.tracks = tracks
+        self.size = size
+        self.fetched_at = fetched_at
+
+    def covers(self, end: int) -> bool:
+        """Whether this has all the tracks before `end` (that exist)"""
+        return end <= self.size or len(self.tracks) < self.size
+
+
 class Server(object):
     """Encapsulates access to a Squeezebox player via a Squeezecenter server"""
 
     _TIMEOUT = 10
     _MAX_FAILURES = 3
 
+    page_size = 255
+
+    _batch = None
+    """The `CommandBatch` collecting player requests, if any"""
+
+    _queues = None
+    """The `QueueWindow` of each player fetched recently"""
+
+    _players_checked_at = None
+    """When the players were last known to be current"""
+
+    cur_player_id = None
+
     def __init__(self, transport, user=None, password=None,
-                 cur_player_id=None, debug=False):
+                 cur_player_id=None, debug=False, page_size=None,
+                 library: LibraryCache = None, prefetch: Iterable[str] = ()):
 
         self.transport = transport
         self._debug = debug
+        self.page_size = page_size or self.page_size
+        self.library = library or LibraryCache()
+        self.registry = PlayerRegistry(Player)
+        self._queues = {}
         self.user = user
         self.password = password
         if user and password:
             self.log_in()
             print_d("Authenticated with %s!" % self)
         self.players = {}
-        self.refresh_status()
+        # Loading the players goes in the same request as anything else
+        # wanted up front (e.g. for the first intent), see `prefetch`
+        self.prefetch(set(prefetch) | {Needs.PLAYERS},
+                      player_id=cur_player_id)
         players = list(self.players.values())
         if not players:
             raise SqueezeboxException(_("Uh-oh. No connected players found."))
@@ -118,9 +357,6 @@ class Server(object):
             self.cur_player_id = cur_player_id
         print_d("Current player is now: {player}",
                 player=self.players[self.cur_player_id])
-        self.__genres = []
-        self.__playlists = []
-        self.__favorites = []
 
     @property
     def connected(self):
@@ -150,10 +386,7 @@ class Server(object):
             reply = self._request([line], raw=raw, wait=wait)
             if reply and len(reply):
                 return reply[0]
-        raise SqueezeboxException("Unprocessable command or login error")
-
-    def _unquote(self, response):
-        return ' '.join(urllib.unquote(s) for s in response.split(' '))
+        raise no_reply_error(line)
 
     def _request(self, lines, raw=False, wait=True) -> List[str]:
         """
@@ -163,12 +396,9 @@ class Server(object):
         """
         if not (lines and len(lines)):
             return []
-        lines = [l.rstrip() for l in lines]
+        lines = [line.rstrip() for line in lines]
 
-        match = RESPONSE_CMD_REGEX.match(lines[0])
-        # If we can't match, then take the first two words (for debugging)
-        first_word = (match.group(2) if match
-                      else ' '.join(lines[0].split()[:2]))
+        first_word = command_of(lines[0])
         if not (self.transport.is_connected or first_word == 'login'):
             try:
                 print_w("Transport wasn't connected - trying to restart")
@@ -187,68 +417,45 @@ class Server(object):
         if not raw_response:
             raise SqueezeboxException(
                 "No further response from %s. Login problem?" % self)
-        raw_response = raw_response.rstrip("\n")
-        response = raw_response if raw else self._unquote(raw_response)
         if self._debug:
+            response = raw_response if raw else unquote(raw_response)
             print_d(">>>> " + "\n..>> ".join(response.splitlines()))
+        return split_response(lines, raw_response, raw=raw)
 
-        def start_point(text):
-            if first_word == 'login':
-                return 6
-            delta = -1 if text.endswith('?') else 1
-            return len(self._unquote(text) if raw else text) + delta
-
-        resp_lines = response.splitlines()
-        if len(lines) != len(resp_lines):
-            print_d("Got mismatched response: {lines} vs {resp_lines}",
-                    lines=lines, resp_lines=resp_lines)
-            raise Error("Transport response problem: got %d lines, not %d"
-                        % (len(resp_lines), len(lines)))
-        return [resp_line[start_point(line):]
-                for line, resp_line in zip(lines, resp_lines)]
-
-    def __pairs_from(self, response):
-        """Split and unescape a response"""
-
-        def demunge(string):
-            s = urllib.unquote(string)
-            return tuple(s.split(':', 1))
-
-        demunged = map(demunge, response.split(' '))
-        return [d for d in demunged if len(d) == 2]
-
-    def _groups(self, response: str, start_key: str =None, extra_bools=None):
+    def _groups(self, response: str, start_key: str =None, extra_bools=None,
+                schema: Schema = None):
         """Generator to yield a series of dicts from `response`.
-        If `start` is specified, items prior to this will be discarded,
-        and each dict will be grouped starting with this key.
-        `extra_bools` allows custom keys to be booleaned"""
-        groups = []
-        started = False
-        for k, v in self.__pairs_from(response):
-            if k == start_key or " count" in k:
-                if groups:
-                    yield dict(groups)
-                    groups = []
-                started = True
-                # New group starts here
-                if " count" not in k:
-                    groups = [(k, stronger(k, v, extra_bools))]
-            else:
-                if started or not start_key:
-                    groups.append((k, stronger(k, v, extra_bools)))
-        if groups:
-            yield dict(groups)
+        See `groups_from`"""
+        return groups_from(response, start_key, extra_bools, schema)
 
-    def refresh_status(self):
+    def refresh_status(self, force=False):
         """ Updates the list of the Squeezebox players available and other
-        server metadata."""
-        print_d("Refreshing server and player statuses.")
-        response = self.__a_request("serverstatus 0 99", raw=True)
-        self.players = {}
-        for data in self._groups(response, 'playerid',
-                                 extra_bools=['power', 'connected']):
-            if data.get('connected', False):
-                self.players[data['playerid']] = SqueezeboxPlayerSettings(data)
+        server metadata.
+        Unless `force`d, this first checks cheaply for any changes,
+        and only fetches the full `serverstatus` if players have come or gone
+        (just applying any players (dis)connecting)"""
+        states = self.transport.player_states
+        if states:
+            print_d("Using mirrored player states")
+            # The mirror includes the library's lastscan in each state
+            self.library.saw_server(next(
+                (state['lastscan'] for state in states.values()
+                 if state.get('lastscan') is not None), None))
+            changed = self.registry.update(states)
+        else:
+            changed = (None if force or not self.registry.version
+                       else self._players_changed())
+            if changed is None:
+                print_d("Refreshing server and player statuses.")
+                changed = self.registry.update(self._fetch_players())
+        self._players_updated(changed)
+
+    def _players_updated(self, changed: bool):
+        self.players = self.registry.connected
+        self._players_checked_at = time.monotonic()
+        if not changed:
+            print_d("Players unchanged: {registry}", registry=self.registry)
+            return
         print_d("Found {total} connected player(s): {players}",
                 total=len(self.players),
                 players=[p.get('name', _("Unknown player"))
@@ -256,13 +463,121 @@ class Server(object):
         if self._debug:
             print_d("Player(s): {players}", players=self.players.values())
 
+    def _players_changed(self) -> Optional[bool]:
+        """Probes whether LMS's players have changed since last fetched,
+        with a single request that's much cheaper than a full `serverstatus`.
+        This checks the library's `lastscan` too.
+        :return: None if a full `serverstatus` is needed,
+                 else whether any players (dis)connected (now applied)"""
+        try:
+            replies = self._request(self._probe_lines(), raw=True)
+        except Error as e:
+            print_d("Couldn't probe players ({err!r})", err=e)
+            return None
+        return self._apply_probe(replies)
+
+    def _probe_lines(self) -> List[str]:
+        # Just the server's status (e.g. `lastscan`), without its players
+        return (["serverstatus 0 0"] +
+                ["%s connected ?" % pid for pid in self.registry.all])
+
+    def _apply_probe(self, replies: List[str]) -> Optional[bool]:
+        try:
+            lastscan, count = library_state_of(replies[0])
+            self.library.saw_server(lastscan, count)
+            connected = {pid: bool(int(reply))
+                         for pid, reply in zip(self.registry.all, replies[1:])}
+        except (ValueError, IndexError) as e:
+            print_d("Couldn't probe players ({err!r})", err=e)
+            return None
+        if count != len(self.registry.all) or len(connected) != count:
+            print_d("Player count is now {count}", count=count)
+            return None
+        changes = [self.registry.set_connected(pid, conn)
+                   for pid, conn in connected.items()]
+        return any(changes)
+
+    def prefetch(self, needs: Iterable[str], player_id=None):
+        """Gets whatever of the data `needs` (see `Needs`) isn't cached,
+        all in one pipelined request. Only the unusual cases (e.g. players
+        having changed, or a library too big for one page) cost more"""
+        needs = set(needs)
+        plan = []
+        if Needs.PLAYERS in needs and not self._players_fresh():
+            if self.transport.player_states:
+                self.refresh_status()
+            elif self.registry.version:
+                plan.append((self._probe_lines(), self._after_probe))
+            else:
+                plan.append(([PLAYERS_REQUEST], self._after_serverstatus))
+        for name, (command, params, _parse, _collect) in (
+                LIBRARY_QUERIES.items()):
+            if name in needs and not self.library.cached(name):
+                line = page_request(command, 0, self.page_size, params)
+                plan.append(([line], partial(self._after_first_page, name)))
+        pid = player_id or self.cur_player_id
+        if Needs.STATUS in needs and pid:
+            window = (self._queues or {}).get(pid)
+            if not window:
+                plan.append((["%s %s" % (pid, status_request(QUEUE_WINDOW))],
+                             partial(self._after_status, pid)))
+            elif not self._queue_known_current(pid, window):
+                # Just its version, as the tracks have probably not changed
+                plan.append((["%s %s" % (pid, status_request(0))],
+                             partial(self._after_status_check, pid, window)))
+        if not plan:
+            return
+        lines = [line for lines, _handle in plan for line in lines]
+        print_d("Prefetching {needs} in one request", needs=sorted(needs))
+        replies = self._request(lines, raw=True)
+        for lines, handle in plan:
+            handle(replies[:len(lines)])
+            replies = replies[len(lines):]
+
+    def _players_fresh(self) -> bool:
+        checked = self._players_checked_at
+        return (checked is not None and
+                time.monotonic() - checked < PLAYERS_FRESH_SECS)
+
+    def _after_probe(self, replies: List[str]):
+        changed = self._apply_probe(replies)
+        if changed is None:
+            self.refresh_status(force=True)
+        else:
+            self._players_updated(changed)
+
+    def _after_serverstatus(self, replies: List[str]):
+        changed = self.registry.update(self._players_from(replies[0]))
+        self._players_updated(changed)
+
+    def _after_first_page(self, name: str, replies: List[str]):
+        command, params, parse, collect = LIBRARY_QUERIES[name]
+        pages = self.paged(command, params, first_page=replies[0])
+        self.library.put(name, collect(item for page in pages
+                                       for item in parse(page)))
+
+    def _after_status(self, player_id: str, replies: List[str]):
+        self._remember_queue(player_id, status_from(replies[0]), QUEUE_WINDOW)
+
+    def _after_status_check(self, player_id: str, window: QueueWindow,
+                            replies: List[str]):
+        status, _tracks = status_from(replies[0])
+        self._check_queue(player_id, window, status)
+
     def player_request(self, line, player_id=None,
                        raw=False, wait=True) -> Union[str, None]:
-        """Makes a single request to a particular player (or the current)"""
+        """Makes a single request to a particular player (or the current).
+        If batching commands, it's just added to the batch (returning None),
+        so queries (with replies needed now) aren't allowed"""
         try:
             player_id = (player_id or
                          self.cur_player_id or
                          list(self.players.values())[0]["playerid"])
+            if self._batch is not None:
+                self._batch.add(line, player_id)
+                return None
+            if not is_query(line):
+                self._forget_queue(player_id)
             return self._request(["%s %s" % (player_id, line)],
                                  raw=raw, wait=wait)[0]
         except IndexError:
@@ -270,121 +585,211 @@ class Server(object):
 
     def play_genres(self, genre_list, player_id=None):
         """Adds then plays a random mix of albums of specified genres"""
-        gs = genre_list or []
-        commands = (["playlist clear", "playlist shuffle 1"] +
-                    ["playlist addalbum %s * *" % urllib.quote(genre)
-                     for genre in gs if genre] +
-                    ["play 2"])
         pid = player_id or self.cur_player_id
-        return self._request(["%s %s" % (pid, com) for com in commands])
+        self._forget_queue(pid)
+        return self._request(["%s %s" % (pid, com)
+                              for com in play_genres_requests(genre_list)])
 
-    def get_track_details(self, offset=0, player_id=None) -> Dict[str, List]:
+    def get_track_details(self, offset=0, player_id=None) -> 'Track':
         """Returns a dict of details,
         for current (offset=0) or future (offset>0) playlist tracks"""
-        pid = player_id or self.cur_player_id
-        index = offset + 1
-        cmd = "status - %d tags:%s" % (index, DETAILS_TAGS)
-        responses = self.player_request(cmd, pid, raw=True)
-        items = next(self._groups(responses)).items()
-
-        def values_for(tag: str, value: str) -> List[str]:
-            return ([value] if tag in ('title', 'album')
-                    else [v.strip() for v in value.split(',')])
-
-        TAGS = {'title', 'genre', 'genres', 'album', 'trackartist', 'artist',
-                'albumartist', 'composer'}
-        details = {k: values_for(k, v)
-                   for k, v in items
-                   if v and k in TAGS}
-        if 'genres' in details:
-            details['genre'] = details['genres']
-            del details['genres']
+        tracks = self.get_queue(offset, 1, player_id=player_id)
+        details = tracks[0] if tracks else Track()
         print_d("Processed details: {d}", d=details)
         return details
 
+    def get_queue(self, start=0, count=QUEUE_WINDOW,
+                  player_id=None) -> List['Track']:
+        """Details of up to `count` of the player's tracks, from `start`
+        after the current one, all fetched with one `status` request.
+        These are cached until the player's queue (or current track) changes,
+        going by its `playlist_timestamp` and `playlist_cur_index`"""
+        pid = player_id or self.cur_player_id
+        end = start + count
+        window = (self._queues or {}).get(pid)
+        fresh = (window and window.covers(end) and
+                 self._queue_unchanged(pid, window))
+        if not fresh:
+            size = max(end, QUEUE_WINDOW)
+            window = self._remember_queue(pid, self._fetch_status(pid, size),
+                                          size)
+        return window.tracks[start:end]
+
+    def _queue_unchanged(self, player_id: str, window: QueueWindow) -> bool:
+        current = self._queue_known_current(player_id, window)
+        if current is not None:
+            return current
+        status = self._fetch_status(player_id, 0)[0]
+        return self._check_queue(player_id, window, status)
+
+    def _check_queue(self, player_id: str, window: QueueWindow,
+                     status: Dict) -> bool:
+        """Whether `window` is still current, given the player's `status`.
+        If so it's trusted afresh, else forgotten"""
+        if queue_version_of(status) != window.version:
+            self._forget_queue(player_id)
+            return False
+        window.fetched_at = time.monotonic()
+        return True
+
+    def _queue_known_current(self, player_id: str,
+                             window: QueueWindow) -> Optional[bool]:
+        """Whether `window` is still current, if known without asking LMS"""
+        states = self.transport.player_states or {}
+        state = states.get(player_id) or {}
+        if 'playlist_timestamp' in state:
+            # Mirrored, so free to check
+            return queue_version_of(state) == window.version
+        if time.monotonic() - window.fetched_at < QUEUE_FRESH_SECS:
+            return True
+        return None
+
+    def _fetch_status(self, player_id: str,
+                      count: int) -> Tuple[Dict, List[Dict]]:
+        """The player's status, and the first `count` of its tracks
+        from the current one"""
+        response = self.player_request(status_request(count), player_id,
+                                       raw=True)
+        return status_from(response or "")
+
+    def _remember_queue(self, player_id: str,
+                        status_tracks: Tuple[Dict, List[Dict]],
+                        size: int) -> QueueWindow:
+        status, tracks = status_tracks
+        window = QueueWindow(queue_version_of(status),
+                             [details_from(t.items()) for t in tracks],
+                             size, time.monotonic())
+        if self._queues is None:
+            self._queues = {}
+        old = self._queues.get(player_id)
+        if old and old.version == window.version:
+            # Same queue, so keep the same details (see `SqueezeAlexa`)
+            window.tracks[:len(old.tracks)] = old.tracks
+        self._queues[player_id] = window
+        return window
+
+    def _forget_queue(self, player_id: str):
+        if self._queues:
+            self._queues.pop(player_id, None)
+
     @property
-    def genres(self):
-        if not self.__genres:
-            resp = self.__a_request("genres 0 255", raw=True)
-            self.__genres = [v for k, v in self.__pairs_from(resp)
-                             if k == 'genre']
-            print_d(with_example("Loaded {num} LMS genres", self.__genres))
-        return self.__genres
+    def genres(self) -> List[str]:
+        return self.library.get('genres', self._fetch_genres)
 
     @property
-    def playlists(self):
-        if not self.__playlists:
-            resp = self.__a_request("playlists 0 255", raw=True)
-            self.__playlists = [v for k, v in self.__pairs_from(resp)
-                                if k == 'playlist']
-            print_d(with_example("Loaded {num} LMS playlists",
-                                 self.__playlists))
-        return self.__playlists
+    def playlists(self) -> List[str]:
+        return self.library.get('playlists', self._fetch_playlists)
 
     @property
-    def favorites(self):
-        if not self.__favorites:
-            resp = self.__a_request("favorites items 0 255 want_url:1",
-                                    raw=True)
-            self.__favorites = {d['name']: d
-                                for d in self._groups(resp, 'name')
-                                if d['isaudio']}
-            print_d(with_example("Loaded {num} LMS faves", self.__favorites))
-        return self.__favorites
+    def favorites(self) -> Dict[str, Dict]:
+        return self.library.get('favorites', self._fetch_favorites)
+
+    def _fetch_players(self) -> Dict[str, Dict]:
+        """All the players LMS knows about, connected or not"""
+        return self._players_from(
+            self.__a_request(PLAYERS_REQUEST, raw=True))
+
+    def _players_from(self, response: str) -> Dict[str, Dict]:
+        self.library.saw_server(*library_state_of(response))
+        return all_players_from(response)
+
+    def _fetch_genres(self) -> List[str]:
+        return list(self.iter_genres())
+
+    def _fetch_playlists(self) -> List[str]:
+        return list(self.iter_playlists())
+
+    def _fetch_favorites(self) -> Dict[str, Dict]:
+        return dict(self.iter_favorites())
+
+    def iter_genres(self) -> Iterator[str]:
+        """All the genres, fetched lazily (so uncached)"""
+        return self._iter_library(Needs.GENRES)
+
+    def iter_playlists(self) -> Iterator[str]:
+        """All the playlists, fetched lazily (so uncached)"""
+        return self._iter_library(Needs.PLAYLISTS)
+
+    def iter_favorites(self) -> Iterator[Tuple[str, Dict]]:
+        """All the playable favorites (by name), fetched lazily"""
+        return self._iter_library(Needs.FAVORITES)
+
+    def _iter_library(self, name: str) -> Iterator:
+        command, params, parse, _collect = LIBRARY_QUERIES[name]
+        for page in self.paged(command, params):
+            yield from parse(page)
+
+    def paged(self, command: str, params: str = "",
+              first_page: str = None) -> Iterator[str]:
+        """Yields the raw replies to a (library) query `command`,
+        a page of `page_size` results at a time, until all are fetched.
+        The first page (unless already fetched) says how many there are,
+        then the rest are requested `PIPELINED_PAGES` at a time,
+        so memory use stays bounded however big the library,
+        and consumers can stop early"""
+        size = self.page_size
+        page = (first_page if first_page is not None else
+                self.__a_request(page_request(command, 0, size, params),
+                                 raw=True))
+        yield page
+        for lines in page_requests(command, size, count_of(page), params):
+            print_d("Fetching {num} more page(s) of {cmd}",
+                    num=len(lines), cmd=command)
+            yield from self._request(lines, raw=True)
 
     def next(self, player_id=None):
-        self.player_request("playlist jump +1", player_id=player_id)
+        self.player_request(jump_request(+1), player_id=player_id)
 
     def previous(self, player_id=None):
-        self.player_request("playlist jump -1", player_id=player_id)
+        self.player_request(jump_request(-1), player_id=player_id)
 
     def playlist_play(self, path, player_id=None):
         """Play song / playlist immediately"""
-        self.player_request("playlist play %s" % (urllib.quote(path)),
-                            player_id=player_id)
+        self.player_request(playlist_play_request(path), player_id=player_id)
 
     def playlist_resume(self, name, resume=True, wipe=False, player_id=None):
-        cmd = ("playlist resume %s noplay:%d wipePlaylist:%d"
-               % (urllib.quote(name), int(not resume), int(wipe)))
-        self.player_request(cmd, wait=False, player_id=player_id)
+        self.player_request(playlist_resume_request(name, resume, wipe),
+                            wait=False, player_id=player_id)
 
     def change_volume(self, delta, player_id=None):
         if not delta:
             return
-        cmd = "mixer volume %s%.1f" % ('+' if delta > 0 else '', float(delta))
-        self.player_request(cmd, player_id=player_id)
+        self.player_request(volume_request(delta, relative=True),
+                            player_id=player_id)
 
     def set_volume(self, value, player_id=None):
         if not value:
             return
-        cmd = "mixer volume %.1f" % float(value)
-        self.player_request(cmd, player_id=player_id)
+        self.player_request(volume_request(value), player_id=player_id)
 
-    def get_milliseconds(self):
-        secs = self.player_request("time ?") or 0
+    def get_milliseconds(self, player_id=None):
+        secs = self.player_request(TIME_REQUEST, player_id=player_id) or 0
         return float(secs) * 1000.0
 
     def pause(self, player_id=None):
-        self.player_request("pause 1", player_id=player_id)
+        self.player_request(pause_request(), player_id=player_id)
 
     def resume(self, player_id=None, fade_in_secs=1):
-        self.player_request("pause 0 %d" % fade_in_secs, player_id=player_id)
+        self.player_request(pause_request(False, fade_in_secs),
+                            player_id=player_id)
 
     def set_shuffle(self, on=True, player_id=None):
-        self.player_request("playlist shuffle %d" % int(bool(on) * 2),
-                            player_id=player_id)
+        self.player_request(shuffle_request(on), player_id=player_id)
 
     def set_repeat(self, on=True, player_id=None):
-        self.player_request("playlist repeat %d" % int(bool(on)),
-                            player_id=player_id)
+        self.player_request(repeat_request(on), player_id=player_id)
 
     def set_power(self, on=True, player_id=None):
-        self.player_request("power %d" % int(bool(on)), player_id=player_id)
+        self.player_request(power_request(on), player_id=player_id)
 
     def set_all_power(self, on=True):
-        value = int(bool(on))
-        self._request(["%s power %d" % (p, value)
-                       for p in self.players.keys()])
+        with self.batch():
+            for pid in self.players:
+                self.set_power(on, player_id=pid)
+
+    def batch(self) -> CommandBatch:
+        """A new `CommandBatch`, for sending lots of commands at once"""
+        return CommandBatch(self)
 
     def __str__(self):
         return "Squeezebox server over {transport}".format(**self.__dict__)
@@ -393,6 +798,382 @@ class Server(object):
         self.disconnect()
 
 
+class JsonRpcServer(Server):
+    """A `Server` over a `JsonRpcTransport`.
+    Results come back already structured (as JSON),
+    so none of the CLI text needs splitting or unquoting"""
+
+    def log_in(self):
+        # Credentials go with every HTTP request instead
+        pass
+
+    def prefetch(self, needs: Iterable[str], player_id=None):
+        # There's no pipelining here, but the connections are kept alive
+        needs = set(needs)
+        if Needs.PLAYERS in needs and not self._players_fresh():
+            self.refresh_status()
+        for name in (Needs.GENRES, Needs.PLAYLISTS, Needs.FAVORITES):
+            if name in needs:
+                getattr(self, name)
+
+    def _players_changed(self) -> Optional[bool]:
+        # Without pipelining, probing each player costs more than one
+        # (structured) `serverstatus`, which checks `lastscan` too
+        return None
+
+    def _request(self, lines, raw=False, wait=True) -> List[str]:
+        if not self.transport.is_connected:
+            print_w("Transport wasn't connected - trying to restart")
+            self.transport.start()
+        if self._debug:
+            print_d("<<<< " + "\n..<< ".join(lines))
+        results = [self.transport.request(*command_from(line))
+                   for line in lines]
+        return [text_of(result) for result in results] if wait else []
+
+    def _fetch_players(self) -> Dict[str, Dict]:
+        result = self.transport.request(["serverstatus", 0, 99])
+        lastscan, count = result.get('lastscan'), result.get('player count')
+        self.library.saw_server(int(lastscan) if lastscan else None,
+                                None if count is None else int(count))
+        players = (structured(p, SERVERSTATUS)
+                   for p in result.get('players_loop', []))
+        return {p['playerid']: p for p in players}
+
+    def iter_genres(self) -> Iterator[str]:
+        for genre in self.paged_results(["genres"], 'genres_loop'):
+            yield genre['genre']
+
+    def iter_playlists(self) -> Iterator[str]:
+        for playlist in self.paged_results(["playlists"], 'playlists_loop'):
+            yield playlist['playlist']
+
+    def iter_favorites(self) -> Iterator[Tuple[str, Dict]]:
+        for item in self.paged_results(["favorites", "items"], 'loop_loop',
+                                       ["want_url:1"]):
+            item = structured(item, FAVORITES)
+            if item.get('isaudio'):
+                yield item['name'], item
+
+    def paged_results(self, command: List, loop: str,
+                      params: List = ()) -> Iterator[Dict]:
+        """Yields each result in the `loop` of a query `command`,
+        fetching a page at a time (over a kept-alive connection)"""
+        start = 0
+        while True:
+            result = self.transport.request(
+                command + [start, self.page_size] + list(params))
+            items = result.get(loop, [])
+            yield from items
+            start += self.page_size
+            if not items or start >= int(result.get('count', 0)):
+                return
+
+    def _fetch_status(self, player_id: str,
+                      count: int) -> Tuple[Dict, List[Dict]]:
+        result = self.transport.request(
+            ["status", "-", count, "tags:%s" % DETAILS_TAGS], player_id)
+        tracks = [structured(t, STATUS)
+                  for t in result.pop('playlist_loop', [])]
+        return structured(result, STATUS), tracks
+
+
+def is_query(line: str) -> bool:
+    """Whether a (player) request `line` only asks for something"""
+    return line.startswith("status ") or line.endswith("?")
+
+
+def server_class_for(transport) -> type:
+    """The kind of `Server` that can use `transport`"""
+    return JsonRpcServer if isinstance(transport, JsonRpcTransport) else Server
+
+
+def page_request(command: str, start: int, size: int, params="") -> str:
+    return ("%s %d %d %s" % (command, start, size, params)).rstrip()
+
+
+def page_requests(command: str, size: int, total: Optional[int],
+                  params="") -> Iterator[List[str]]:
+    """The requests for the rest of a paged query's `total` results,
+    after its first page, in batches of `PIPELINED_PAGES` to pipeline"""
+    starts = list(range(size, total or 0, size))
+    for i in range(0, len(starts), PIPELINED_PAGES):
+        yield [page_request(command, start, size, params)
+               for start in starts[i:i + PIPELINED_PAGES]]
+
+
+def status_request(count=1) -> str:
+    """The `status` request (for a player) for the details of `count`
+    tracks, from the current one"""
+    return "status - %d tags:%s" % (count, DETAILS_TAGS)
+
+
+TIME_REQUEST = "time ?"
+"""Gets how far (in seconds) a player is into its current track"""
+
+
+def play_genres_requests(genre_list: Iterable[str]) -> List[str]:
+    """The (player) requests to play a random mix of albums of genres"""
+    return (["playlist clear", "playlist shuffle 1"] +
+            ["playlist addalbum %s * *" % urllib.quote(genre)
+             for genre in genre_list or [] if genre] +
+            ["play 2"])
+
+
+def jump_request(delta: int) -> str:
+    return "playlist jump %+d" % delta
+
+
+def playlist_play_request(path: str) -> str:
+    return "playlist play %s" % urllib.quote(path)
+
+
+def playlist_resume_request(name: str, resume=True, wipe=False) -> str:
+    return ("playlist resume %s noplay:%d wipePlaylist:%d"
+            % (urllib.quote(name), int(not resume), int(wipe)))
+
+
+def volume_request(value, relative=False) -> str:
+    """Sets the volume to `value`, or changes it by that if `relative`"""
+    sign = '+' if relative and value > 0 else ''
+    return "mixer volume %s%.1f" % (sign, float(value))
+
+
+def pause_request(pause=True, fade_in_secs=1) -> str:
+    return "pause 1" if pause else "pause 0 %d" % fade_in_secs
+
+
+def shuffle_request(on=True) -> str:
+    return "playlist shuffle %d" % int(bool(on) * 2)
+
+
+def repeat_request(on=True) -> str:
+    return "playlist repeat %d" % int(bool(on))
+
+
+def power_request(on=True) -> str:
+    return "power %d" % int(bool(on))
+
+
+def no_reply_error(line: str) -> SqueezeboxException:
+    """The error for when a request `line` gets no reply at all"""
+    return SqueezeboxException(
+        "No reply to '%s' command. Unprocessable, or a login error?"
+        % command_of(line))
+
+
+def command_from(line: str) -> Tuple[List[str], str]:
+    """The (unquoted) words of a CLI request line, and its player ID"""
+    match = PLAYER_ID_REGEX.match(line)
+    player_id = match.group(1) if match else None
+    if match:
+        line = line[match.end():]
+    return [urllib.unquote(w) for w in line.split()], player_id
+
+
+def text_of(result: Dict) -> str:
+    """The value of a query's JSON result (e.g. `{"_time": 12.3}`),
+    as the CLI would have replied"""
+    values = [v for k, v in result.items() if k.startswith('_')]
+    return str(values[0]) if len(values) == 1 else ""
+
+
+def structured(item: Dict, schema: Schema) -> Dict:
+    """Types the values of a JSON result `item`
+    just as `schema` would have for the CLI"""
+    return {k: (schema.get(k, as_str)(str(v))
+                if isinstance(v, (str, int, float)) else v)
+            for k, v in item.items()}
+
+
+def unquote(response: str) -> str:
+    return ' '.join(urllib.unquote(s) for s in response.split(' '))
+
+
+def command_of(line: str) -> str:
+    """The command (e.g. `status`) of a request line"""
+    match = RESPONSE_CMD_REGEX.match(line)
+    # If we can't match, then take the first two words (for debugging)
+    return match.group(2) if match else ' '.join(line.split()[:2])
+
+
+def split_response(lines: List[str], raw_response: str,
+                   raw=False) -> List[str]:
+    """Splits a response to the pipelined request `lines` into
+    the reply to each, without the echoed request"""
+    resp_lines = raw_response.rstrip("\n").splitlines()
+    if len(lines) != len(resp_lines):
+        print_d("Got mismatched response: {lines} vs {resp_lines}",
+                lines=lines, resp_lines=resp_lines)
+        raise Error("Transport response problem: got %d lines, not %d"
+                    % (len(resp_lines), len(lines)))
+    replies = (after_echo_of(line, resp_line)
+               for line, resp_line in zip(lines, resp_lines))
+    return list(replies) if raw else [unquote(r) for r in replies]
+
+
+def after_echo_of(line: str, resp_line: str) -> str:
+    """The reply in `resp_line`, skipping the echo of request `line`.
+    This counts words, as the echo is quoted differently to the request"""
+    words = line.split()
+    if words and words[0] == 'login':
+        # ...except for the password, which is obscured
+        num = 1
+    else:
+        # Queries (`?`) have their answer in place of the `?`
+        num = len(words) - (1 if line.endswith('?') else 0)
+    pos = 0
+    while num > 0:
+        pos = resp_line.find(' ', pos) + 1
+        if not pos:
+            return ""
+        num -= 1
+    return resp_line[pos:]
+
+
+PAIR_REGEX = re.compile(r'(\S+?)(?:%3A|:)(\S*)')
+"""A `key:value` pair in a (quoted) response, without unquoting either"""
+
+
+@lru_cache(maxsize=256)
+def _key_from(raw_key: str) -> str:
+    return urllib.unquote(raw_key)
+
+
+def quoted_pairs(response: str) -> Iterator[Tuple[str, str]]:
+    """Lazily scans `response` for its pairs, unquoting only the keys
+    (which repeat, so are cached). Values are left quoted, for callers
+    to unquote only the ones they need"""
+    for match in PAIR_REGEX.finditer(response):
+        yield _key_from(match.group(1)), match.group(2)
+
+
+def pairs_from(response: str) -> Iterator[Tuple[str, str]]:
+    """Split and unescape a response"""
+    return ((k, urllib.unquote(v)) for k, v in quoted_pairs(response))
+
+
+def groups_from(response: str, start_key: str = None, extra_bools=None,
+                schema: Schema = None):
+    """Generator to yield a series of dicts from `response`.
+    If `start` is specified, items prior to this will be discarded,
+    and each dict will be grouped starting with this key.
+    Values are typed by `schema` if given (see `schema`), or guessed.
+    `extra_bools` allows custom keys to be booleaned, when guessing"""
+    if schema is None:
+        def typed(k, v):
+            return stronger(k, urllib.unquote(v), extra_bools)
+    else:
+        def typed(k, v):
+            return schema.get(k, as_str)(urllib.unquote(v))
+
+    group = {}
+    started = not start_key
+    for match in PAIR_REGEX.finditer(response):
+        k, v = _key_from(match.group(1)), match.group(2)
+        if k == start_key or " count" in k:
+            if group:
+                yield group
+                group = {}
+            started = True
+            # New group starts here
+            if " count" not in k:
+                group[k] = typed(k, v)
+        elif started:
+            group[k] = typed(k, v)
+    if group:
+        yield group
+
+
+def count_of(response: str) -> Optional[int]:
+    """The total number of results for a query, if in its `response`"""
+    match = COUNT_REGEX.search(response)
+    return int(match.group(1)) if match else None
+
+
+def values_from(response: str, key: str) -> List[str]:
+    """All the values for `key` in `response`"""
+    return [urllib.unquote(v) for k, v in quoted_pairs(response) if k == key]
+
+
+def all_players_from(response: str) -> Dict[str, Dict]:
+    """All this server's players from a `serverstatus` response,
+    connected or not (but not those on other servers)"""
+    return {data['playerid']: data
+            for data in groups_from(response, 'playerid',
+                                    schema=SERVERSTATUS)
+            if 'connected' in data}
+
+
+def library_state_of(response: str) -> Tuple[Optional[int], Optional[int]]:
+    """The library's `lastscan` and the player count (if there),
+    from a `serverstatus` response, for `LibraryCache.saw_server`"""
+    lastscan = values_from(response, 'lastscan')
+    count = values_from(response, 'player count')
+    return (int(lastscan[0]) if lastscan else None,
+            int(count[0]) if count else None)
+
+
+def players_from(response: str) -> Dict[str, Player]:
+    """The connected players from a `serverstatus` response"""
+    return {pid: Player(data)
+            for pid, data in all_players_from(response).items()
+            if data['connected']}
+
+
+def favorites_from(response: str) -> Dict[str, Dict]:
+    """The playable favourites from a `favorites items` response"""
+    return {d['name']: d for d in groups_from(response, 'name',
+                                              schema=FAVORITES)
+            if d['isaudio']}
+
+
+def status_from(response: str) -> Tuple[Dict, List[Dict]]:
+    """The player's status, and each of its tracks, from a `status` response"""
+    status, tracks = {}, []
+    group = status
+    for k, v in quoted_pairs(response):
+        # Tracks start with their index, if there is one
+        if k == 'playlist index' or (group is status and k in DETAILS):
+            group = {}
+            tracks.append(group)
+        group[k] = STATUS.get(k, as_str)(urllib.unquote(v))
+    return status, tracks
+
+
+def queue_version_of(status: Dict) -> Tuple:
+    """What changes whenever a player's queue (or current track) does"""
+    return status.get('playlist_timestamp'), status.get('playlist_cur_index')
+
+
+def track_from(response: str, offset=0) -> Track:
+    """Details of the track `offset` on from the current one,
+    from a `status` response for (at least) that many"""
+    _status, tracks = status_from(response)
+    return (details_from(tracks[offset].items()) if offset < len(tracks)
+            else Track())
+
+
+def track_details_from(response: str) -> Track:
+    """Track details (title, artists etc) from a `status` response"""
+    return details_from(next(groups_from(response, schema=STATUS)).items())
+
+
+def details_from(items: Iterable[Tuple[str, Any]]) -> Track:
+    """Track details from (tag, value) pairs, however they were parsed"""
+    return Track(items)
+
+
+def names_in(value: str) -> List[str]:
+    """The (interned) names in a comma-separated tag value,
+    e.g. genres or artists, which repeat across tracks"""
+    return [sys.intern(v.strip()) for v in value.split(',')]
+
+
+def interned(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 def people_from(details: Dict, default=None) -> Union[str, None]:
     genres = {g.lower() for g in details.get('genre', [])}
     tags = ['trackartist', 'artist', 'albumartist', 'composer']
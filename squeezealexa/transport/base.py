@@ -12,7 +12,7 @@
 
 import socket
 from socket import SHUT_RDWR
-from typing import List
+from typing import List, Optional, Dict
 
 MAX_CONNECT_SECS = 3
 """Various connection timeouts"""
@@ -46,6 +46,12 @@ class Transport:
         """Property for connection details"""
         raise NotImplementedError()
 
+    @property
+    def player_states(self) -> Optional[Dict[str, Dict]]:
+        """Current states of all the players by their ID,
+        if this transport is kept up to date with them"""
+        return None
+
     def start(self) -> 'Transport':
         self.is_connected = True
         return self
@@ -61,6 +67,38 @@ class Transport:
         self.is_connected = False
 
 
+class AsyncTransport:
+    """Asyncio equivalent of `Transport`.
+    Many of these can be in flight concurrently on a single event loop"""
+
+    def __init__(self) -> None:
+        self.is_connected = False
+
+    async def communicate(self, data: str, wait=True) -> Optional[str]:
+        """Send `data`, waiting if `wait` is True
+        :param data: String to send.
+                     A final newlines will be added if not present
+        :param wait: Wait for the response if True
+        :return: the response, if any"""
+        raise NotImplementedError()
+
+    @property
+    def details(self):
+        """Property for connection details"""
+        raise NotImplementedError()
+
+    async def start(self) -> 'AsyncTransport':
+        self.is_connected = True
+        return self
+
+    async def stop(self) -> 'AsyncTransport':
+        self.is_connected = False
+        return self
+
+    def __str__(self) -> str:
+        return self.details
+
+
 def check_listening(host, port, timeout=MAX_CONNECT_SECS, msg=""):
     """Checks a socket, then releases"""
     try:
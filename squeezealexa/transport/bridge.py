@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import re
+import threading
+import zlib
+from queue import Queue, Empty
+from typing import Callable, Optional, List
+from urllib.parse import unquote_to_bytes
+
+from paho.mqtt.client import MQTTMessage
+
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.mqtt import correlation_of
+from squeezealexa.utils import print_d, print_w
+
+PLAYER_ID = re.compile(rb'(?:[0-9a-f]{2}(?::|%3a)){5}[0-9a-f]{2}(?=\s)', re.I)
+"""A player ID (MAC address, possibly URL-quoted) starting a command"""
+
+MAX_BATCH = 32
+"""The most requests a worker pipelines in one go"""
+
+Reply = Callable[[MQTTMessage, bytes], None]
+
+
+def player_of(payload: bytes) -> Optional[bytes]:
+    """The ID of the player the (first) command in `payload` is for, if any"""
+    match = PLAYER_ID.match(payload.lstrip())
+    return unquote_to_bytes(match.group(0)).lower() if match else None
+
+
+class CliWorker(threading.Thread):
+    """Relays requests, in order, over its own connection to the LMS CLI.
+    `connect` should return an `LmsCliConnection`"""
+
+    def __init__(self, num: int, connect: Callable, reply: Reply,
+                 cache=None):
+        super().__init__(name="cli-worker-%d" % num, daemon=True)
+        self.connect = connect
+        self.reply = reply
+        self.cache = cache
+        self.cli = None
+        self._queue = Queue()
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, message: MQTTMessage):
+        self._queue.put(message)
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                break
+            try:
+                self.handle(batch)
+            except (OSError, Error) as e:
+                print_w("{name} lost its LMS CLI connection ({err})",
+                        name=self.name, err=e)
+                self._close()
+            except Exception as e:
+                print_w("{name} couldn't handle request ({err!r})",
+                        name=self.name, err=e)
+            if batch[-1] is None:
+                break
+        self._close()
+
+    def _next_batch(self) -> List[Optional[MQTTMessage]]:
+        """Waits for a message, then takes any others already waiting too.
+        Ends with None if the worker should then stop"""
+        batch = [self._queue.get()]
+        while batch[-1] is not None and len(batch) < MAX_BATCH:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch if batch[0] is not None else []
+
+    def handle(self, batch: List[Optional[MQTTMessage]]):
+        """Writes the requests in one go, then reads and splits the replies
+        by line count, so a batch costs a single LMS round trip"""
+        requests = [correlation_of(m) + (m,) for m in batch if m is not None]
+        if self.cli is None:
+            self.cli = self.connect()
+        generation = self.cache.generation if self.cache is not None else None
+        replies = self.cli.request(b'\n'.join(payload.strip()
+                                              for _, payload, _ in requests))
+        for cid, payload, message in requests:
+            num_lines = payload.strip().count(b'\n') + 1
+            lines, replies = replies[:num_lines], replies[num_lines:]
+            if self.cache is not None:
+                self.cache.store(payload, lines, generation)
+            rsp = b'\n'.join(lines)
+            if rsp:
+                self.reply(message, rsp)
+            else:
+                print_w("No reply for {cid}", cid=cid)
+        if len(requests) > 1:
+            print_d("{name} pipelined {num} requests",
+                    name=self.name, num=len(requests))
+
+    def _close(self):
+        """Closes the connection, which reconnects on the next request"""
+        if self.cli is not None:
+            self.cli.close()
+
+
+class Bridge:
+    """Spreads requests over a pool of `CliWorker`s, each with their own
+    LMS CLI connection, so slow queries don't hold up everything else.
+    Commands for the same player always go to the same worker (so stay in
+    order); the rest go to whichever worker is least busy.
+    Given a `ReplyCache`, cached replies are sent straight back"""
+
+    def __init__(self, connect: Callable, reply: Reply, workers=4,
+                 cache=None):
+        if workers < 1:
+            raise ValueError("Need at least one worker")
+        self.reply = reply
+        self.cache = cache
+        self.workers = [CliWorker(i, connect, reply, cache)
+                        for i in range(workers)]
+
+    def start(self) -> 'Bridge':
+        """Connects all the workers (so failures are immediate) and starts
+        them"""
+        for worker in self.workers:
+            worker.cli = worker.connect()
+            worker.start()
+        print_d("Started {num} LMS CLI worker(s)", num=len(self.workers))
+        return self
+
+    def worker_for(self, payload: bytes) -> CliWorker:
+        player = player_of(payload)
+        if player is None:
+            return min(self.workers, key=lambda w: w.backlog)
+        return self.workers[zlib.crc32(player) % len(self.workers)]
+
+    def submit(self, message: MQTTMessage):
+        """Queues a request message. Doesn't block"""
+        _, payload = correlation_of(message)
+        if self.cache is not None:
+            cached = self.cache.reply_for(payload)
+            if cached is not None:
+                self.reply(message, cached)
+                return
+        self.worker_for(payload).submit(message)
+
+    def stop(self, timeout=5):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join(timeout)
+        if self.cache is not None:
+            print_d("Reply cache: {stats}", stats=self.cache)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import socket
+import time
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from typing import List, Optional
+
+from squeezealexa.transport.base import Error, MAX_CONNECT_SECS, Transport
+from squeezealexa.utils import print_d, print_w, timed_out_message
+
+_BUFFER_SIZE = 16 * 1024
+"""Initial size of the read buffer"""
+
+_MAX_KEPT_BUFFER = 1024 * 1024
+"""Buffers grown larger than this are released once empty"""
+
+KEEPALIVE_OPTIONS = {'TCP_KEEPIDLE': 60, 'TCP_KEEPINTVL': 10,
+                     'TCP_KEEPCNT': 3}
+"""TCP keepalive tuning, where the platform supports it"""
+
+
+class LmsCliConnection:
+    """A (plain TCP) connection to the LMS CLI, e.g. from the same LAN.
+
+    Sockets are non-blocking, so every request has a deadline rather than
+    hanging forever. Requests can be pipelined, with the replies read from
+    one reusable buffer. If the connection fails, it's reconnected on the
+    next request, backing off exponentially while that keeps failing.
+    Not thread-safe: use one per thread."""
+
+    MIN_BACKOFF_SECS = 0.5
+
+    def __init__(self, hostname: str, port=9090, user=None, password=None,
+                 timeout=5, max_backoff_secs=60):
+        self.hostname = hostname
+        self.port = port
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.max_backoff_secs = max_backoff_secs
+        self.failures = 0
+        self._retry_at = 0
+        self._sock = None
+        self._selector = None
+        self._buffer = bytearray(_BUFFER_SIZE)
+        self._start = self._scanned = self._end = 0
+        self._unread = 0
+        """Replies still due for requests sent without waiting"""
+
+    @property
+    def is_connected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self) -> 'LmsCliConnection':
+        """Connects (and logs in, if configured),
+        unless still backing off from earlier failures"""
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise Error("Not reconnecting to {cli} for another {secs:.1f}s"
+                        .format(cli=self, secs=self._retry_at - now))
+        try:
+            sock = socket.create_connection((self.hostname, self.port),
+                                            timeout=MAX_CONNECT_SECS)
+        except OSError as e:
+            self._back_off(now)
+            raise Error("Couldn't connect to {cli} ({err})".format(
+                cli=self, err=e), e)
+        self._configure(sock)
+        sock.setblocking(False)
+        self._sock = sock
+        self._selector = DefaultSelector()
+        self._selector.register(sock, EVENT_READ)
+        self._start = self._scanned = self._end = self._unread = 0
+        self.failures = 0
+        self._retry_at = 0
+        if self.user and self.password:
+            self._log_in()
+        print_d("Connected to {cli}", cli=self)
+        return self
+
+    def _configure(self, sock: socket.socket):
+        # Requests are small and latency-bound, so don't let Nagle wait
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # ...and notice dead connections that are otherwise idle
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in KEEPALIVE_OPTIONS.items():
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP,
+                                getattr(socket, option), value)
+
+    def _back_off(self, now: float):
+        self.failures += 1
+        delay = min(self.MIN_BACKOFF_SECS * 2 ** (self.failures - 1),
+                    self.max_backoff_secs)
+        self._retry_at = now + delay
+        print_w("{cli} failed {num} time(s), backing off for {secs:.1f}s",
+                cli=self, num=self.failures, secs=delay)
+
+    def _log_in(self):
+        reply = self.request(("login %s %s" % (self.user, self.password))
+                             .encode('utf-8'))[0]
+        if not reply.endswith(b" ******"):
+            self.close()
+            raise Error("Couldn't log in to {cli}".format(cli=self))
+
+    def request(self, payload: bytes, timeout=None) -> List[bytes]:
+        """Sends one or more (pipelined) request lines,
+        returning the reply line for each within `timeout` seconds.
+        Any failure closes the connection, as replies would be out of step"""
+        data = payload.strip() + b'\n'
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        if not self.is_connected:
+            self.connect()
+        try:
+            self._send(data, deadline)
+            for _ in range(self._unread):
+                if self._read_line(deadline) is None:
+                    break
+                self._unread -= 1
+            replies = []
+            for _ in range(data.count(b'\n')):
+                line = self._read_line(deadline)
+                if line is None:
+                    raise Error(timed_out_message(
+                        "reply from {cli}".format(cli=self), timeout))
+                replies.append(line.rstrip(b'\r\n'))
+            return replies
+        except Error:
+            self.close()
+            raise
+        except OSError as e:
+            self.close()
+            raise Error("Lost connection to {cli} ({err})".format(
+                cli=self, err=e), e)
+
+    def send(self, payload: bytes, timeout=None):
+        """Sends request lines without waiting for their replies,
+        which are skipped before those of the next request"""
+        data = payload.strip() + b'\n'
+        try:
+            self.write(data, timeout)
+        except Error:
+            self.close()
+            raise
+        except OSError as e:
+            self.close()
+            raise Error("Lost connection to {cli} ({err})".format(
+                cli=self, err=e), e)
+        self._unread += data.count(b'\n')
+
+    def write(self, data: bytes, timeout=None):
+        """Sends raw `data`, e.g. to subscribe to notifications"""
+        if not self.is_connected:
+            self.connect()
+        self._send(data, time.monotonic() + (timeout or self.timeout))
+
+    def read_line(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """The next line (e.g. a notification), waiting at most `timeout`
+        seconds (forever, if None). Returns None if nothing came in time"""
+        if not self.is_connected:
+            raise Error("{cli} isn't connected".format(cli=self))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        line = self._read_line(deadline)
+        return None if line is None else line.rstrip(b'\r\n')
+
+    def _send(self, data: bytes, deadline: float):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[self._sock.send(view):]
+            except BlockingIOError:
+                pass
+            if view:
+                self._selector.modify(self._sock, EVENT_WRITE)
+                try:
+                    if not self._wait(deadline):
+                        raise Error("Timed out writing to {cli}".format(
+                            cli=self))
+                finally:
+                    self._selector.modify(self._sock, EVENT_READ)
+
+    def _read_line(self, deadline: Optional[float]) -> Optional[bytes]:
+        while True:
+            end = self._buffer.find(b'\n', self._scanned, self._end)
+            if end >= 0:
+                line = bytes(self._buffer[self._start:end + 1])
+                self._start = self._scanned = end + 1
+                if self._start == self._end:
+                    self._reset_buffer()
+                return line
+            self._scanned = self._end
+            if not self._fill(deadline):
+                return None
+
+    def _fill(self, deadline: Optional[float]) -> bool:
+        """Reads whatever's available into the buffer, making room first.
+        Returns False if nothing came before the deadline"""
+        if self._end == len(self._buffer):
+            if self._start:
+                # Move the unread data back to the start
+                size = self._end - self._start
+                self._buffer[:size] = self._buffer[self._start:self._end]
+                self._scanned -= self._start
+                self._start, self._end = 0, size
+            else:
+                self._buffer.extend(bytes(len(self._buffer)))
+        if not self._wait(deadline):
+            return False
+        try:
+            with memoryview(self._buffer) as view:
+                received = self._sock.recv_into(view[self._end:])
+        except BlockingIOError:
+            return True
+        if not received:
+            self.close()
+            raise Error("{cli} closed the connection".format(cli=self))
+        self._end += received
+        return True
+
+    def _wait(self, deadline: Optional[float]) -> bool:
+        if deadline is None:
+            return bool(self._selector.select())
+        remaining = deadline - time.monotonic()
+        return remaining > 0 and bool(self._selector.select(remaining))
+
+    def _reset_buffer(self):
+        self._start = self._scanned = self._end = 0
+        if len(self._buffer) > _MAX_KEPT_BUFFER:
+            self._buffer = bytearray(_BUFFER_SIZE)
+
+    def close(self):
+        if self._sock:
+            print_d("Closing {cli}", cli=self)
+            self._selector.close()
+            self._sock.close()
+        self._sock = self._selector = None
+        self._unread = 0
+        self._reset_buffer()
+
+    def __str__(self):
+        return "LMS CLI at {host}:{port}".format(host=self.hostname,
+                                                 port=self.port)
+
+
+class CliSocketTransport(Transport):
+    """Plain TCP straight to the LMS CLI, for when squeeze-alexa runs on the
+    same LAN as LMS. There's no TLS, tunnel or MQTT to go through, so only
+    use this on a network you trust.
+    Given a `user` and `password`, every (re)connection logs in"""
+
+    _MAX_FAILURES = 3
+
+    def __init__(self, hostname: str, port=9090, user=None, password=None,
+                 timeout=5):
+        super().__init__()
+        self.hostname = hostname
+        self.port = port
+        self.failures = 0
+        self._cli = LmsCliConnection(hostname, port, user=user,
+                                     password=password, timeout=timeout)
+
+    def start(self) -> 'CliSocketTransport':
+        if not self._cli.is_connected:
+            self._cli.connect()
+        return super().start()
+
+    def communicate(self, raw: str, wait=True) -> Optional[str]:
+        data = raw.encode('utf-8')
+        try:
+            if not wait:
+                self._cli.send(data)
+                return None
+            replies = self._cli.request(data)
+        except Error as e:
+            self.failures += 1
+            self.is_connected = False
+            print_w("Couldn't communicate with {cli} ({err})",
+                    cli=self._cli, err=e)
+            if self.failures >= self._MAX_FAILURES:
+                raise Error("Too many Squeezebox failures. Disconnecting", e)
+            raise
+        self.failures = 0
+        return b''.join(r + b'\n' for r in replies).decode('utf-8')
+
+    @property
+    def details(self):
+        return "{cli} (plain TCP)".format(cli=self._cli)
+
+    def stop(self) -> 'CliSocketTransport':
+        self._cli.close()
+        return super().stop()
@@ -1,5 +1,9 @@
-from squeezealexa.settings import MQTT_SETTINGS, SSL_SETTINGS
+from squeezealexa.settings import MQTT_SETTINGS, SSL_SETTINGS, LMS_SETTINGS
+from squeezealexa.transport.cli import CliSocketTransport
+from squeezealexa.transport.jsonrpc import JsonRpcTransport
 from squeezealexa.transport.mqtt import CustomClient, MqttTransport
+from squeezealexa.transport.pool import TransportPool, PooledTransport, \
+    login_hook
 from squeezealexa.transport.ssl_wrap import SslSocketTransport
 from squeezealexa.utils import print_d
 
@@ -7,9 +11,11 @@ from squeezealexa.utils import print_d
 class TransportFactory:
     """Create Transports on demand. Helps with caching"""
 
-    def __init__(self, ssl_config=SSL_SETTINGS, mqtt_settings=MQTT_SETTINGS):
+    def __init__(self, ssl_config=SSL_SETTINGS, mqtt_settings=MQTT_SETTINGS,
+                 lms_settings=LMS_SETTINGS):
         self.ssl_config = ssl_config
         self.mqtt_settings = mqtt_settings
+        self.lms_settings = lms_settings
 
     def create(self, mqtt_client=None):
         if self.mqtt_settings.configured:
@@ -18,12 +24,39 @@ class TransportFactory:
             client = mqtt_client or CustomClient(s)
             return MqttTransport(client,
                                  req_topic=s.topic_req,
-                                 resp_topic=s.topic_resp)
+                                 resp_topic=s.topic_resp,
+                                 state_topic=s.topic_state or None,
+                                 headers=s.correlation_headers)
+
+        if self.lms_settings.json_rpc_url:
+            s = self.lms_settings
+            print_d("Found LMS JSON-RPC config, so using that.")
+            return JsonRpcTransport(s.json_rpc_url, user=s.username,
+                                    password=s.password)
+
+        if self.lms_settings.direct_hostname:
+            s = self.lms_settings
+            print_d("Found direct LMS config, so using the CLI directly.")
+            return CliSocketTransport(s.direct_hostname, port=s.cli_port,
+                                      user=s.username, password=s.password)
 
         print_d("Defaulting to SSL transport")
+        s = self.ssl_config
+        if s.max_connections > 1:
+            lms = self.lms_settings
+            on_connect = (login_hook(lms.username, lms.password)
+                          if lms.username and lms.password else None)
+            pool = TransportPool(self._create_ssl, max_size=s.max_connections,
+                                 on_connect=on_connect)
+            return PooledTransport(pool)
+        return self._create_ssl()
+
+    def _create_ssl(self):
         s = self.ssl_config
         return SslSocketTransport(hostname=s.server_hostname,
                                   port=s.port,
                                   ca_file=s.ca_file_path,
                                   cert_file=s.cert_file_path,
-                                  verify_hostname=s.verify_server_hostname)
+                                  verify_hostname=s.verify_server_hostname,
+                                  ca_data=s.ca_data,
+                                  cert_data=s.cert_data)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import itertools
+import json
+import threading
+from base64 import b64encode
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, \
+    RemoteDisconnected
+from typing import Dict, Sequence
+from urllib.parse import urlsplit
+
+from squeezealexa.transport.base import Transport, Error
+from squeezealexa.utils import print_d
+
+
+class JsonRpcTransport(Transport):
+    """Sends LMS commands as JSON-RPC over HTTP(S) to `/jsonrpc.js`,
+    getting structured results back rather than CLI text.
+    Connections are persistent (HTTP/1.1 keep-alive), and pooled,
+    so concurrent requests don't queue behind each other.
+    Use with `JsonRpcServer`, rather than `communicate`.
+    The `url` can include a path (e.g. behind a reverse proxy),
+    under which `/jsonrpc.js` is used, unless it ends with that already"""
+
+    PATH = "/jsonrpc.js"
+
+    def __init__(self, url: str, user=None, password=None, max_connections=4,
+                 timeout=5):
+        super().__init__()
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise Error("Need an http(s) URL for JSON-RPC, not {url}"
+                        .format(url=url))
+        self.url = url
+        self.hostname = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 9000)
+        self.path = (parts.path if parts.path.endswith(".js")
+                     else parts.path.rstrip('/') + self.PATH)
+        self.timeout = timeout
+        self._conn_cls = (HTTPSConnection if parts.scheme == 'https'
+                          else HTTPConnection)
+        self._headers = {"Content-Type": "application/json"}
+        if user and password:
+            creds = b64encode(("%s:%s" % (user, password)).encode('utf-8'))
+            self._headers["Authorization"] = "Basic " + creds.decode('ascii')
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._ids = itertools.count(1)
+
+    def start(self) -> 'JsonRpcTransport':
+        version = self.request(["version", "?"]).get("_version")
+        print_d("Connected to LMS {version} at {url}",
+                version=version, url=self.url)
+        return super().start()
+
+    def request(self, command: Sequence, player_id: str = None) -> Dict:
+        """Runs an LMS `command` (a list of its words),
+        returning the structured result"""
+        body = json.dumps({"id": next(self._ids), "method": "slim.request",
+                           "params": [player_id or "", list(command)]})
+        with self._slots:
+            reply = self._post(body.encode('utf-8'))
+        if reply.get("error"):
+            raise Error("LMS JSON-RPC error: {err}".format(
+                err=reply["error"]))
+        return reply.get("result") or {}
+
+    def communicate(self, data: str, wait=True):
+        raise Error("JSON-RPC doesn't take CLI text: use a JsonRpcServer "
+                    "(see `server_class_for`)")
+
+    def _post(self, body: bytes) -> Dict:
+        conn, reused = self._checkout()
+        sent = False
+        try:
+            conn.request("POST", self.path, body, self._headers)
+            sent = True
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, HTTPException) as e:
+            conn.close()
+            if reused and self._closed_while_idle(e, sent):
+                # Commands aren't idempotent (e.g. `mixer volume +5`),
+                # so only resend ones that can't have reached LMS
+                print_d("Stale connection to {url} ({err!r}), retrying",
+                        url=self.url, err=e)
+                return self._post(body)
+            self.is_connected = False
+            raise Error("Couldn't reach LMS at {url} ({err})".format(
+                url=self.url, err=e), e)
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        if response.status != 200:
+            raise Error("HTTP {status} from {url}".format(
+                status=response.status, url=self.url))
+        return json.loads(data.decode('utf-8'))
+
+    @staticmethod
+    def _closed_while_idle(e: Exception, sent: bool) -> bool:
+        """Whether `e` shows the server had closed an idle connection,
+        rather than the request having failed after reaching it"""
+        if isinstance(e, RemoteDisconnected):
+            return True
+        return not sent and isinstance(e, (BrokenPipeError,
+                                           ConnectionResetError))
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._conn_cls(self.hostname, self.port,
+                              timeout=self.timeout), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    @property
+    def details(self):
+        return "JSON-RPC to {url}".format(url=self.url)
+
+    def stop(self) -> 'JsonRpcTransport':
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+        return super().stop()
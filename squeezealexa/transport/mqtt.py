@@ -10,29 +10,123 @@
 #
 #   See LICENSE for full license
 
+import asyncio
+import itertools
+import json
 import os
 import ssl
+import threading
 from _ssl import PROTOCOL_TLSv1_2
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
 from glob import glob
 from os.path import dirname, realpath, join
-from typing import Union
+from typing import Union, Optional, Tuple, Dict
 
 from paho.mqtt.client import Client, MQTT_ERR_SUCCESS, error_string, \
-    MQTT_ERR_INVAL, MQTT_ERR_NO_CONN
+    MQTT_ERR_INVAL, MQTT_ERR_NO_CONN, MQTTv311, MQTTMessage, MQTTMessageInfo
+
+try:
+    from paho.mqtt.client import MQTTv5
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+except ImportError:
+    # Paho < 1.5 doesn't do MQTT v5
+    MQTTv5 = None
 
 from squeezealexa.settings import MqttSettings
-from squeezealexa.transport.base import Transport, Error, check_listening
-from squeezealexa.utils import print_d, wait_for
+from squeezealexa.transport.base import Transport, Error, check_listening, \
+    AsyncTransport
+from squeezealexa.transport.tls import cached_context, load_cert_chain_data
+from squeezealexa.utils import print_d, wait_on, timed_out_message
 
 BASE = realpath(join(dirname(__file__), "..", ".."))
 
+CORRELATION_HEADER = b'#id:'
+"""Starts a payload line carrying the request's correlation ID,
+for when MQTT v5 properties aren't available"""
+
+
+class CorrelationIds:
+    """Iterator of IDs unique enough to tell requests (and transports) apart"""
+
+    def __init__(self):
+        self._prefix = os.urandom(4).hex()
+        self._count = itertools.count(1)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return "%s-%d" % (self._prefix, next(self._count))
+
+
+def using_v5(client: Client) -> bool:
+    return MQTTv5 is not None and getattr(client, 'protocol', None) == MQTTv5
+
+
+def correlation_of(message: MQTTMessage) -> Tuple[Optional[str], bytes]:
+    """The correlation ID (if any) and the rest of the payload of a message.
+    These come from MQTT v5 properties if set, else from a header line"""
+    props = getattr(message, 'properties', None)
+    data = getattr(props, 'CorrelationData', None)
+    if data:
+        return data.decode('ascii'), message.payload
+    payload = message.payload
+    if payload.startswith(CORRELATION_HEADER):
+        header, _, payload = payload.partition(b'\n')
+        return header[len(CORRELATION_HEADER):].decode('ascii'), payload
+    return None, payload
+
+
+def publish_request(client: Client, topic: str, resp_topic: str, cid: str,
+                    payload: bytes, qos=1, header=True) -> MQTTMessageInfo:
+    """Publishes a request, with its correlation ID `cid` as a property
+    (with MQTT v5), else as a header line if `header` is set"""
+    if using_v5(client):
+        props = Properties(PacketTypes.PUBLISH)
+        props.CorrelationData = cid.encode('ascii')
+        props.ResponseTopic = resp_topic
+        return client.publish(topic, payload, qos=qos, properties=props)
+    if header:
+        payload = CORRELATION_HEADER + cid.encode('ascii') + b'\n' + payload
+    return client.publish(topic, payload, qos=qos)
+
+
+def publish_reply(client: Client, request: MQTTMessage, payload: bytes,
+                  default_topic: str, qos=1) -> MQTTMessageInfo:
+    """Publishes the `payload` in reply to `request`,
+    with the same correlation ID as the request had (if any)"""
+    props = getattr(request, 'properties', None)
+    topic = getattr(props, 'ResponseTopic', None) or default_topic
+    data = getattr(props, 'CorrelationData', None)
+    if data:
+        reply_props = Properties(PacketTypes.PUBLISH)
+        reply_props.CorrelationData = data
+        return client.publish(topic, payload, qos=qos,
+                              properties=reply_props)
+    cid, _ = correlation_of(request)
+    if cid:
+        payload = CORRELATION_HEADER + cid.encode('ascii') + b'\n' + payload
+    return client.publish(topic, payload, qos=qos)
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
 
 class CustomClient(Client):
     """Opinionated Client subclass that configures from passed settings,
     and also does some safety checks"""
 
+    _CONF_FILES = {}
+    """Cache of config file glob results"""
+
     def __init__(self, settings: MqttSettings):
-        super().__init__()
+        self.protocol = (MQTTv5 if settings.use_mqtt5 and MQTTv5
+                         else MQTTv311)
+        super().__init__(protocol=self.protocol)
         # self._keepalive = 5
         self.settings = settings
         self._host = settings.hostname
@@ -41,9 +135,32 @@ class CustomClient(Client):
         self.connected = False
 
     def _configure_tls(self):
-        self.tls_set(certfile=self._conf_file_of("*-certificate.pem.crt"),
-                     keyfile=self._conf_file_of("*-private.pem.key"),
-                     tls_version=PROTOCOL_TLSv1_2)
+        s = self.settings
+        # Whichever of the certificate and key isn't in the settings
+        # comes from its file
+        certfile = (None if s.cert_data
+                    else self._conf_file_of("*-certificate.pem.crt"))
+        keyfile = (None if s.key_data
+                   else self._conf_file_of("*-private.pem.key"))
+        key = (type(self).__name__, certfile, keyfile,
+               s.cert_data, s.key_data)
+        self.tls_set_context(cached_context(
+            key, lambda: self._create_context(certfile, keyfile),
+            [certfile, keyfile]))
+
+    def _create_context(self, certfile, keyfile):
+        """Much as `tls_set` would, but only done once per set of certs"""
+        context = ssl.SSLContext(PROTOCOL_TLSv1_2)
+        s = self.settings
+        if s.cert_data or s.key_data:
+            load_cert_chain_data(context, s.cert_data or _read(certfile),
+                                 s.key_data or _read(keyfile))
+        else:
+            context.load_cert_chain(certfile, keyfile)
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.check_hostname = True
+        context.load_default_certs()
+        return context
 
     def connect(self, host=None, port=None, keepalive=30, bind_address=""):
         print_d("Connecting {client}...", client=self)
@@ -78,9 +195,16 @@ class CustomClient(Client):
 
     def _conf_file_of(self, rel_glob: str) -> str:
         full_glob = os.path.join(self.settings.cert_dir, rel_glob)
+        try:
+            path = self._CONF_FILES[full_glob]
+            if os.path.exists(path):
+                return path
+        except KeyError:
+            pass
         results = glob(full_glob)
         try:
-            return results[0]
+            path = self._CONF_FILES[full_glob] = results[0]
+            return path
         except IndexError:
             raise Error("Can't find {glob} within dir {base}".format(
                 base=self.settings.cert_dir, glob=rel_glob))
@@ -95,12 +219,33 @@ class CustomClient(Client):
                                                 port=self._port)
 
 
+class _PendingReply:
+    """Collects the reply lines for one request"""
+
+    def __init__(self, num_lines: int, future=None):
+        self.num_lines = num_lines
+        self.lines = []
+        self.future = future or Future()
+
+
 class MqttTransport(Transport):
-    """Transport over TLS-encrypted MQTT"""
+    """Transport over TLS-encrypted MQTT.
+    Each request carries a correlation ID that mqtt-squeeze echoes back,
+    so any number of requests can be in flight at once. Without MQTT v5 or
+    `headers` (for older mqtt-squeeze), replies are matched up in order.
+    Given a `state_topic`, player states mirrored (as retained messages)
+    by mqtt-squeeze are kept too"""
 
-    def __init__(self, client: CustomClient, req_topic: str, resp_topic: str):
-        def subscribed(client, userdata, mind, granted_qos):
-            self.is_connected = True
+    STATE_WAIT_SECS = 0.5
+    """How long to wait for mirrored player states after connecting,
+    (only) if there's a `state_topic`, so no way of knowing there are none"""
+
+    def __init__(self, client: CustomClient, req_topic: str, resp_topic: str,
+                 state_topic: str = None, headers=True):
+        def subscribed(client, userdata, mind, granted_qos, properties=None):
+            with self._changed:
+                self.is_connected = True
+                self._changed.notify_all()
             print_d("MQTT/TLS transport to {client} initialised. (@QoS {qos})",
                     client=client, qos=granted_qos)
 
@@ -108,20 +253,33 @@ class MqttTransport(Transport):
         self.client = client
         self.req_topic = req_topic
         self.resp_topic = resp_topic
+        self.state_topic = state_topic
+        self.headers = headers
+        self._changed = threading.Condition()
+        """Notified (from Paho's thread) when the connection is ready,
+        or the player states change"""
+        self._pending = OrderedDict()
+        self._player_ids = None
+        self._states = {}
+        self._ids = CorrelationIds()
         self.client.on_subscribe = subscribed
         self.client.on_message = self._on_message
-        self.message = []
         print_d("Created transport: {self!r}", self=self)
 
     def start(self):
-        def connected(client, userdata, flags, rc):
+        def connected(client, userdata, flags, rc, properties=None):
             print_d("Connected to {client}. Subscribing to {topic}",
                     client=self.client, topic=self.resp_topic)
-            result, mid = self.client.subscribe(self.resp_topic, qos=1)
+            if self.state_topic:
+                topics = [(self.resp_topic, 1), (self.state_topic, 1),
+                          (self.state_topic + "/+", 1)]
+                result, mid = self.client.subscribe(topics)
+            else:
+                result, mid = self.client.subscribe(self.resp_topic, qos=1)
             if result != MQTT_ERR_SUCCESS:
                 raise Error("Couldn't subscribe to '{topic}'", self.resp_topic)
 
-        def disconnected(client, userdata, rc):
+        def disconnected(client, userdata, rc, properties=None):
             print_d("Disconnected from {client}", client=self.client)
             self.is_connected = False
 
@@ -133,39 +291,106 @@ class MqttTransport(Transport):
         self.client.on_disconnect = disconnected
         assert self.client.loop_start() != MQTT_ERR_INVAL
         self.client.connect()
-        wait_for(lambda s: s.is_connected, what="connection", context=self)
+        wait_on(self._changed, lambda: self.is_connected, what="connection")
+        if self.state_topic:
+            # Retained messages should be here almost immediately
+            with self._changed:
+                self._changed.wait_for(lambda: self.player_states,
+                                       self.STATE_WAIT_SECS)
         return self
 
+    @property
+    def player_states(self) -> Optional[Dict[str, Dict]]:
+        with self._changed:
+            ids = self._player_ids
+            if ids is None or not all(pid in self._states for pid in ids):
+                return None
+            return {pid: self._states[pid] for pid in ids}
+
+    def _on_state(self, message: MQTTMessage):
+        data = (json.loads(message.payload.decode('utf-8'))
+                if message.payload else None)
+        with self._changed:
+            if message.topic == self.state_topic:
+                self._player_ids = data
+            else:
+                player_id = message.topic[len(self.state_topic) + 1:]
+                if data is None:
+                    self._states.pop(player_id, None)
+                else:
+                    self._states[player_id] = data
+            self._changed.notify_all()
+
+    def _is_state(self, topic: str) -> bool:
+        return (topic == self.state_topic or
+                topic.startswith(self.state_topic + '/'))
+
     def _on_message(self, client, userdata, message):
-        self.response_lines += message.payload.splitlines()
+        if self.state_topic and self._is_state(message.topic):
+            self._on_state(message)
+            return
+        cid, payload = correlation_of(message)
+        with self._changed:
+            pending = self._pending.get(cid)
+            if not pending and cid is None and self._pending:
+                # Uncorrelated (see `headers`), so assume replies are in order
+                cid, pending = next(iter(self._pending.items()))
+            if not pending:
+                print_d("Ignoring unexpected reply (for {cid})", cid=cid)
+                return
+            pending.lines += payload.splitlines()
+            if len(pending.lines) >= pending.num_lines:
+                del self._pending[cid]
+                pending.future.set_result(pending.lines)
 
     @property
     def details(self):
         return "MQTT to {client}".format(client=self.client)
 
-    def communicate(self, raw: str, wait=True, timeout=5) -> Union[str, None]:
+    def submit(self, raw: str, wait=True) -> Optional[Future]:
+        """Sends `raw` without waiting.
+        :return: a Future of the reply lines (as bytes), if `wait`"""
+        return self._submit(raw, wait)[1]
+
+    def _submit(self, raw: str, wait=True):
         data = raw.strip() + '\n'
-        num_lines = data.count('\n')
-        self._clear()
-        ret = self.client.publish(self.req_topic, data.encode('utf-8'),
-                                  qos=1 if wait else 0)
+        cid = next(self._ids)
+        pending = _PendingReply(data.count('\n'))
+        if wait:
+            with self._changed:
+                self._pending[cid] = pending
+        ret = publish_request(self.client, self.req_topic, self.resp_topic,
+                              cid, data.encode('utf-8'), qos=1 if wait else 0,
+                              header=self.headers)
         if not wait:
-            return None
-        ret.wait_for_publish()
+            return cid, None
         if ret.rc != MQTT_ERR_SUCCESS:
+            self._forget(cid)
             msg = "Error publishing message: {err}".format(
                 err=error_string(ret.rc))
             raise Error(msg)
-        print_d("Published to '{topic}' OK. Waiting for {num} line(s).",
-                topic=self.req_topic, num=num_lines)
+        print_d("Published {cid} to '{topic}' OK. Waiting for {num} line(s).",
+                cid=cid, topic=self.req_topic, num=pending.num_lines)
+        return cid, pending.future
 
-        wait_for(lambda s: len(s.response_lines) >= num_lines, context=self,
-                 what="response from mqtt-squeeze", timeout=timeout,
-                 exc_cls=Error)
-        return "\n".join(m.decode('utf-8') for m in self.response_lines)
+    def communicate(self, raw: str, wait=True, timeout=5) -> Union[str, None]:
+        cid, future = self._submit(raw, wait)
+        if not future:
+            return None
+        try:
+            lines = future.result(timeout)
+        except TimeoutError:
+            self._forget(cid)
+            msg = timed_out_message("response from mqtt-squeeze", timeout)
+            raise Error(msg)
+        return "\n".join(m.decode('utf-8') for m in lines)
 
-    def _clear(self):
-        self.response_lines = []
+    def _forget(self, cid: str):
+        """Stop waiting for a reply. Late replies are then ignored"""
+        with self._changed:
+            pending = self._pending.pop(cid, None)
+        if pending:
+            pending.future.cancel()
 
     def stop(self):
         print_d("Killing {what}.", what=self)
@@ -178,3 +403,118 @@ class MqttTransport(Transport):
 
     def __del__(self):
         self.stop()
+
+
+def _resolve(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+class AsyncMqttTransport(AsyncTransport):
+    """Asyncio version of `MqttTransport`.
+    Paho still runs its own network thread,
+    but replies are handed over to the event loop rather than polled for.
+    Requests are correlated, so can be sent concurrently
+    (see `MqttTransport` for `headers`)"""
+
+    def __init__(self, client: CustomClient, req_topic: str, resp_topic: str,
+                 timeout=5, headers=True):
+        super().__init__()
+        self.client = client
+        self.req_topic = req_topic
+        self.resp_topic = resp_topic
+        self.timeout = timeout
+        self.headers = headers
+        self._loop = None
+        self._pending = {}
+        self._ids = CorrelationIds()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        subscribed = self._loop.create_future()
+
+        def connected(client, userdata, flags, rc, properties=None):
+            print_d("Connected to {client}. Subscribing to {topic}",
+                    client=self.client, topic=self.resp_topic)
+            self.client.subscribe(self.resp_topic, qos=1)
+
+        def on_subscribe(client, userdata, mid, granted_qos,
+                         properties=None):
+            self._loop.call_soon_threadsafe(_resolve, subscribed, True)
+
+        def disconnected(client, userdata, rc, properties=None):
+            print_d("Disconnected from {client}", client=self.client)
+            self.is_connected = False
+
+        self.client.on_message = self._on_message
+        self.client.on_subscribe = on_subscribe
+        self.client.on_disconnect = disconnected
+        if self.client.connected:
+            print_d("Already connected, great!")
+            self.is_connected = True
+            return self
+        self.client.on_connect = connected
+        assert self.client.loop_start() != MQTT_ERR_INVAL
+        await self._loop.run_in_executor(None, self.client.connect)
+        try:
+            await asyncio.wait_for(subscribed, self.timeout)
+        except asyncio.TimeoutError:
+            raise Error("Couldn't subscribe to '{topic}' on {client}"
+                        .format(topic=self.resp_topic, client=self.client))
+        self.is_connected = True
+        return self
+
+    def _on_message(self, client, userdata, message):
+        """Called from the Paho thread"""
+        cid, payload = correlation_of(message)
+        self._loop.call_soon_threadsafe(self._received, cid,
+                                        payload.splitlines())
+
+    def _received(self, cid, lines):
+        pending = self._pending.get(cid)
+        if not pending and cid is None:
+            # Uncorrelated, so assume replies are in order
+            pending = next((p for p in self._pending.values()
+                            if not p.future.done()), None)
+        if not pending:
+            print_d("Ignoring unexpected reply (for {cid})", cid=cid)
+            return
+        pending.lines += lines
+        if len(pending.lines) >= pending.num_lines:
+            _resolve(pending.future, pending.lines)
+
+    @property
+    def details(self):
+        return "MQTT to {client} (async)".format(client=self.client)
+
+    async def communicate(self, raw: str, wait=True) -> Optional[str]:
+        data = raw.strip() + '\n'
+        cid = next(self._ids)
+        if not wait:
+            publish_request(self.client, self.req_topic, self.resp_topic,
+                            cid, data.encode('utf-8'), qos=0,
+                            header=self.headers)
+            return None
+        pending = self._pending[cid] = _PendingReply(
+            data.count('\n'), self._loop.create_future())
+        try:
+            ret = publish_request(self.client, self.req_topic,
+                                  self.resp_topic, cid, data.encode('utf-8'),
+                                  header=self.headers)
+            if ret.rc != MQTT_ERR_SUCCESS:
+                raise Error("Error publishing message: {err}".format(
+                    err=error_string(ret.rc)))
+            lines = await asyncio.wait_for(pending.future, self.timeout)
+        except asyncio.TimeoutError:
+            raise Error(timed_out_message("response from mqtt-squeeze",
+                                          self.timeout))
+        finally:
+            del self._pending[cid]
+        return "\n".join(m.decode('utf-8') for m in lines)
+
+    async def stop(self):
+        print_d("Killing {what}.", what=self)
+        self.client.on_message = None
+        self.client.on_subscribe = None
+        self.client.disconnect()
+        return await super().stop()
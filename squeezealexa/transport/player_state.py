@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import json
+import threading
+from typing import Callable, Dict, List, Optional
+
+from squeezealexa.squeezebox.server import DETAILS_TAGS, players_from, \
+    groups_from, track_details_from, split_response, values_from
+from squeezealexa.squeezebox.schema import STATUS
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.bridge import player_of
+from squeezealexa.transport.reply_cache import POLL_SECS
+from squeezealexa.utils import print_d, print_w
+
+SUBSCRIPTIONS = (b"client,power,mixer,playlist,pause,play,stop,mode,sync,"
+                 b"rescan")
+"""LMS notifications that can change a player's state (or the library's)"""
+
+STATUS_KEYS = {'power': 'power', 'mode': 'mode', 'mixer volume': 'volume',
+               'sync_master': 'sync_master', 'sync_slaves': 'sync_slaves',
+               'playlist_timestamp': 'playlist_timestamp',
+               'playlist_cur_index': 'playlist_cur_index'}
+"""Which `status` values are mirrored, and what they're called"""
+
+Publish = Callable[[str, bytes], None]
+
+
+def topic_for(base_topic: str, player_id: str) -> str:
+    return "%s/%s" % (base_topic, player_id)
+
+
+def encode(data) -> bytes:
+    return json.dumps(data, separators=(',', ':'), sort_keys=True).encode()
+
+
+def decode(payload: bytes):
+    return json.loads(payload.decode('utf-8')) if payload else None
+
+
+def state_from(player: Dict, status_response: str) -> Dict:
+    """The compact state of a `player` (from `serverstatus`),
+    updated with its `status` response"""
+    status = next(groups_from(status_response, schema=STATUS), {})
+    state = dict(player)
+    state.update({name: status[key] for key, name in STATUS_KEYS.items()
+                  if key in status})
+    state['track'] = dict(track_details_from(status_response))
+    return state
+
+
+class PlayerStateMirror(threading.Thread):
+    """Keeps a live model of the LMS players (from CLI notifications),
+    publishing each player's state as a retained message on
+    `base_topic/<player id>` with an index of all of them on `base_topic`,
+    so that clients get everything instantly on subscribing.
+    Each state includes the library's `lastscan`, so clients can tell
+    when their cached library is stale.
+    `publish(topic, payload)` must publish retained messages."""
+
+    def __init__(self, connect: Callable, publish: Publish, base_topic: str,
+                 retry_secs=5):
+        super().__init__(name="player-state-mirror", daemon=True)
+        self.connect = connect
+        self.publish = publish
+        self.base_topic = base_topic
+        self.retry_secs = retry_secs
+        self.players = {}
+        self.states = {}
+        self.lastscan = None
+        self._index = None
+        self._cli = self._query_cli = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.listen()
+            except (OSError, Error) as e:
+                if self._stopped.is_set():
+                    break
+                print_w("Lost LMS notifications ({err}). "
+                        "Withdrawing player states for now", err=e)
+            finally:
+                self._close()
+                self._publish_index(None)
+            self._stopped.wait(self.retry_secs)
+
+    def listen(self):
+        self._query_cli = self.connect()
+        self._cli = self.connect()
+        self._cli.request(b"subscribe " + SUBSCRIPTIONS)
+        self.refresh_all()
+        while not self._stopped.is_set():
+            event = self._cli.read_line(timeout=POLL_SECS)
+            if event:
+                self.handle(event.strip())
+
+    def handle(self, event: bytes):
+        player_id = player_of(event)
+        if not player_id:
+            if event.startswith(b"rescan done"):
+                self.refresh_all()
+            return
+        player_id = player_id.decode('utf-8')
+        if event.split()[1] == b'client' or player_id not in self.players:
+            # Players come and go
+            self.refresh_all()
+        else:
+            self.refresh(player_id)
+
+    def refresh_all(self):
+        response = self._query("serverstatus 0 99")
+        self.players = players_from(response)
+        lastscan = values_from(response, 'lastscan')
+        self.lastscan = int(lastscan[0]) if lastscan else None
+        for player_id in set(self.states) - set(self.players):
+            print_d("Player {id} has gone", id=player_id)
+            del self.states[player_id]
+            self.publish(topic_for(self.base_topic, player_id), b'')
+        for player_id in self.players:
+            self.refresh(player_id)
+        self._publish_index(sorted(self.players))
+
+    def refresh(self, player_id: str):
+        status = self._query("%s status - 1 tags:%s"
+                             % (player_id, DETAILS_TAGS))
+        state = state_from(self.players[player_id], status)
+        if self.lastscan is not None:
+            state['lastscan'] = self.lastscan
+        if state != self.states.get(player_id):
+            self.states[player_id] = state
+            self.publish(topic_for(self.base_topic, player_id), encode(state))
+
+    def _query(self, line: str) -> str:
+        response = self._query_cli.request(line.encode('utf-8'))[0]
+        return split_response([line], response.decode('utf-8'), raw=True)[0]
+
+    def _publish_index(self, player_ids: Optional[List[str]]):
+        if player_ids != self._index:
+            self._index = player_ids
+            self.publish(self.base_topic,
+                         encode(player_ids) if player_ids is not None else b'')
+
+    def _close(self):
+        for cli in (self._cli, self._query_cli):
+            if cli:
+                cli.close()
+        self._cli = self._query_cli = None
+
+    def stop(self):
+        self._stopped.set()
+
+    def __str__(self):
+        return "mirror of {num} player(s) on {topic}".format(
+            num=len(self.states), topic=self.base_topic)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from squeezealexa.transport.base import Transport, Error
+from squeezealexa.utils import print_d, print_w
+
+
+class TransportPool:
+    """A bounded pool of started transports, so that independent requests
+    (e.g. from different threads) don't have to queue behind each other.
+    Connections are created lazily, and closed again once idle for too long
+    or no longer healthy. Each new one is passed to `on_connect` (if set)
+    once started, e.g. to log it in (see `login_hook`)"""
+
+    def __init__(self, create: Callable[[], Transport], max_size=4,
+                 max_idle_secs=60, timeout=10,
+                 on_connect: Callable[[Transport], None] = None):
+        if max_size < 1:
+            raise ValueError("Need at least one connection in a pool")
+        self._create = create
+        self._on_connect = on_connect
+        self.max_size = max_size
+        self.max_idle_secs = max_idle_secs
+        self.timeout = timeout
+        self._idle = []  # (transport, time last used), oldest first
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        """How many connections are open (idle or in use)"""
+        return self._size
+
+    @staticmethod
+    def healthy(transport: Transport) -> bool:
+        """Connected, and without any (swallowed) failures"""
+        return (transport.is_connected and
+                not getattr(transport, 'failures', 0))
+
+    def checkout(self) -> Transport:
+        """Gets a free connection, creating one if there's room.
+        Raises `Error` if none become free in time"""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self._evict_idle()
+            while True:
+                while self._idle:
+                    transport, _ = self._idle.pop()
+                    if self.healthy(transport):
+                        return transport
+                    self._discard(transport)
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise Error("No free connection after {secs} seconds "
+                                "({size} in use)".format(secs=self.timeout,
+                                                         size=self._size))
+        transport = None
+        try:
+            transport = self._create()
+            transport.start()
+            if self._on_connect:
+                self._on_connect(transport)
+            print_d("Opened connection #{num} to {transport}",
+                    num=self._size, transport=transport)
+            return transport
+        except Exception:
+            with self._cond:
+                if transport is not None:
+                    self._discard(transport)
+                else:
+                    self._size -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, transport: Transport, ok=True):
+        """Returns a connection to the pool.
+        Ones that failed (`ok` is False) or are unhealthy are closed"""
+        with self._cond:
+            if ok and self.healthy(transport):
+                self._idle.append((transport, time.monotonic()))
+            else:
+                print_w("Dropping unhealthy connection {transport}",
+                        transport=transport)
+                self._discard(transport)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager for a checked-out connection"""
+        transport = self.checkout()
+        ok = False
+        try:
+            yield transport
+            ok = True
+        finally:
+            self.checkin(transport, ok=ok)
+
+    def close(self):
+        """Closes all the idle connections"""
+        with self._cond:
+            while self._idle:
+                transport, _ = self._idle.pop()
+                self._discard(transport)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.max_idle_secs
+        # Oldest are at the start
+        while self._idle and self._idle[0][1] < cutoff:
+            transport, _ = self._idle.pop(0)
+            print_d("Closing idle connection {transport}",
+                    transport=transport)
+            self._discard(transport)
+
+    def _discard(self, transport: Transport):
+        self._size -= 1
+        try:
+            transport.stop()
+        except Exception as e:
+            print_w("Couldn't stop {transport} ({err!r})",
+                    transport=transport, err=e)
+
+
+class PooledTransport(Transport):
+    """A `Transport` that sends each request over a free connection
+    from a `TransportPool`, so it's safe to share between threads"""
+
+    def __init__(self, pool: TransportPool):
+        super().__init__()
+        self.pool = pool
+
+    def start(self) -> 'PooledTransport':
+        # Check we can actually connect, and keep it for later
+        with self.pool.connection():
+            pass
+        return super().start()
+
+    def communicate(self, data: str, wait=True):
+        with self.pool.connection() as transport:
+            return transport.communicate(data, wait=wait)
+
+    @property
+    def details(self):
+        return "pool of up to {num} connection(s)".format(
+            num=self.pool.max_size)
+
+    def stop(self) -> 'PooledTransport':
+        self.pool.close()
+        return super().stop()
+
+
+def login_hook(user: str, password: str) -> Callable[[Transport], None]:
+    """An `on_connect` hook for a `TransportPool` of LMS CLI connections,
+    logging each one in, as LMS authenticates per connection"""
+
+    def log_in(transport: Transport):
+        reply = transport.communicate("login %s %s" % (user, password))
+        if not (reply or "").rstrip().endswith(" ******"):
+            raise Error("Couldn't log in to LMS over {transport}".format(
+                transport=transport))
+
+    return log_in
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Set
+
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.bridge import player_of
+from squeezealexa.utils import print_d, print_w
+
+QUERIES = {b'genres', b'artists', b'albums', b'years', b'playlists',
+           b'favorites', b'serverstatus', b'players', b'version'}
+"""Commands that (mostly) only read, so their replies can be cached"""
+
+MUTATORS = {b'new', b'delete', b'rename', b'edit', b'add', b'addlevel',
+            b'move'}
+"""Subcommands that make an otherwise cacheable command change things"""
+
+PLAYER_STATE = {b'serverstatus', b'players'}
+
+INVALIDATED_BY = {
+    b'rescan': None,
+    b'wipecache': None,
+    b'favorites': {b'favorites'},
+    b'playlists': {b'playlists'},
+    b'client': PLAYER_STATE,
+}
+"""Which cached commands an LMS notification makes stale (None for all)"""
+
+POLL_SECS = 1
+"""How often to check for being stopped, while waiting for notifications"""
+
+SUBSCRIPTIONS = b"rescan,wipecache,favorites,playlists,client,power,playlist"
+
+
+def cacheable(line: bytes) -> bool:
+    words = line.split()
+    return bool(words and words[0] in QUERIES and
+                not (len(words) > 1 and words[1] in MUTATORS))
+
+
+def stale_after(event: bytes) -> Optional[Set[bytes]]:
+    """The commands made stale by an LMS `event` (None meaning all)"""
+    words = event.split()
+    if not words:
+        return set()
+    if player_of(event):
+        # Any player change could be in its serverstatus
+        stale = set(PLAYER_STATE)
+        if words[1:3] in ([b'playlist', b'save'], [b'playlist', b'delete']):
+            stale.add(b'playlists')
+        return stale
+    return INVALIDATED_BY.get(words[0], set())
+
+
+class ReplyCache:
+    """A bounded LRU cache of replies to read-only LMS CLI commands.
+    It's only as fresh as its invalidations, so is disabled
+    until something (i.e. a `CacheInvalidator`) is listening for them"""
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        """Bumped on any invalidation, to spot replies that may be stale"""
+        self.enabled = False
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reply_for(self, payload: bytes) -> Optional[bytes]:
+        """The whole cached reply for `payload`, if every line is cached"""
+        lines = payload.strip().splitlines()
+        if not (self.enabled and lines and all(map(cacheable, lines))):
+            return None
+        with self._lock:
+            replies = [self._entries.get(line.strip()) for line in lines]
+            if None in replies:
+                self.misses += 1
+                return None
+            for line in lines:
+                self._entries.move_to_end(line.strip())
+            self.hits += 1
+        print_d("Cache hit for {cmd!r} ({stats})", cmd=lines[0], stats=self)
+        return b'\n'.join(replies)
+
+    def store(self, payload: bytes, replies: List[bytes], generation: int):
+        """Caches the `replies` to `payload` (as of `generation`)"""
+        lines = payload.strip().splitlines()
+        if len(lines) != len(replies):
+            return
+        with self._lock:
+            if not self.enabled or generation != self.generation:
+                return
+            for line, reply in zip(lines, replies):
+                line = line.strip()
+                if cacheable(line):
+                    self._entries[line] = reply
+                    self._entries.move_to_end(line)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, commands: Optional[Set[bytes]] = None):
+        """Drops replies for `commands` (or all, if None)"""
+        with self._lock:
+            self.generation += 1
+            if commands is None:
+                self._entries.clear()
+                return
+            for line in list(self._entries):
+                if line.split()[0] in commands:
+                    del self._entries[line]
+
+    def __str__(self):
+        return "{hits} hit(s), {misses} miss(es), {size} cached".format(
+            hits=self.hits, misses=self.misses, size=len(self))
+
+
+class CacheInvalidator(threading.Thread):
+    """Subscribes to LMS notifications on a dedicated CLI connection,
+    and invalidates the cache accordingly"""
+
+    def __init__(self, cache: ReplyCache, connect: Callable, retry_secs=5):
+        super().__init__(name="cache-invalidator", daemon=True)
+        self.cache = cache
+        self.connect = connect
+        self.retry_secs = retry_secs
+        self.cli = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.listen()
+            except (OSError, Error) as e:
+                if self._stopped.is_set():
+                    break
+                print_w("Lost LMS notifications ({err}). "
+                        "Disabling cache for now", err=e)
+            finally:
+                self._disable()
+            self._stopped.wait(self.retry_secs)
+
+    def listen(self):
+        self.cli = self.connect()
+        self.cli.request(b"subscribe " + SUBSCRIPTIONS)
+        # Anything fetched before now could have missed an invalidation
+        self.cache.invalidate()
+        self.cache.enabled = True
+        print_d("Listening for LMS notifications to invalidate cache")
+        while not self._stopped.is_set():
+            event = self.cli.read_line(timeout=POLL_SECS)
+            if event:
+                stale = stale_after(event.strip())
+                if stale is None or stale:
+                    self.cache.invalidate(stale)
+
+    def _disable(self):
+        self.cache.enabled = False
+        self.cache.invalidate()
+        if self.cli:
+            self.cli.close()
+            self.cli = None
+
+    def stop(self):
+        self._stopped.set()
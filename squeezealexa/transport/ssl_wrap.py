@@ -10,56 +10,104 @@
 #
 #   See LICENSE for full license
 
+import asyncio
 import socket
 
 import ssl
 import _ssl
 from typing import Optional
 
-from squeezealexa.transport.base import Error, Transport
+from squeezealexa.transport.base import Error, Transport, AsyncTransport
+from squeezealexa.transport.tls import cached_context, load_cert_chain_data, \
+    as_text
 from squeezealexa.utils import print_d, print_w
 
 
 class SslSocketTransport(Transport):
     _MAX_FAILURES = 3
+    _BUFFER_SIZE = 16 * 1024
+    """Initial size of the receive buffer, which grows as needed"""
+    _MAX_KEPT_BUFFER = 1024 * 1024
+    """Larger buffers than this are released after use"""
+
+    _SESSIONS = {}
+    """The last TLS session (and its context) seen for each endpoint,
+    for resumption.
+    These last for the life of the process (e.g. a warm Lambda container)"""
+    _handshakes = 0
+    _resumptions = 0
 
     def __init__(self, hostname, port=9090, ca_file=None, cert_file=None,
-                 verify_hostname=False, timeout=5):
+                 verify_hostname=False, timeout=5, ca_data=None,
+                 cert_data=None):
 
         super().__init__()
         self.hostname = hostname
         self.port = port
         self.timeout = timeout
         self.failures = 0
+        self._buffer = bytearray(self._BUFFER_SIZE)
+        self._context = context = self.context_for(
+            ca_file, cert_file, verify_hostname, ca_data, cert_data)
+
+        sock = socket.socket()
+        sock.settimeout(self.timeout)
+        self._ssl_sock = context.wrap_socket(sock, server_hostname=hostname)
+
+    @classmethod
+    def context_for(cls, ca_file=None, cert_file=None, verify_hostname=False,
+                    ca_data=None, cert_data=None) -> ssl.SSLContext:
+        """The (shared) client SSL context for these certificate settings"""
+        key = (cls.__name__, ca_file, cert_file, verify_hostname,
+               ca_data, cert_data)
+        files = [f for f, data in [(ca_file, ca_data), (cert_file, cert_data)]
+                 if not data]
+        return cached_context(
+            key, lambda: cls._create_context(ca_file, cert_file,
+                                             verify_hostname,
+                                             ca_data, cert_data),
+            files)
+
+    @classmethod
+    def _create_context(cls, ca_file, cert_file, verify_hostname,
+                        ca_data=None, cert_data=None):
         context = ssl.SSLContext(_ssl.PROTOCOL_TLS_CLIENT)
-        self.__harden_context(context)
+        cls.__harden_context(context)
         try:
-            if ca_file:
+            if ca_data:
+                context.load_verify_locations(cadata=as_text(ca_data))
+            elif ca_file:
                 context.load_verify_locations(ca_file)
-            if cert_file:
+            if cert_data or cert_file:
                 context.verify_mode = ssl.CERT_REQUIRED
                 context.check_hostname = verify_hostname
-                context.load_cert_chain(cert_file)
+                if cert_data:
+                    load_cert_chain_data(context, cert_data)
+                else:
+                    context.load_cert_chain(cert_file)
         except ssl.SSLError as e:
-            self._die("Problem with Cert / CA (+key) files ({cert} / {ca}). "
-                      "Does it include the private key? ({reason})",
-                      cert=cert_file, ca=ca_file, reason=e.reason, err=e)
+            cls._die("Problem with Cert / CA (+key) files ({cert} / {ca}). "
+                     "Does it include the private key? ({reason})",
+                     cert=cert_file, ca=ca_file, reason=e.reason, err=e)
         except IOError as e:
             if 'No such file or directory' in e.strerror:
-                self._die("Can't find cert '{cert_file}' or CA '{ca_file}'. "
-                          "Check CERT_FILE / CA_FILE_PATH in settings",
-                          ca_file=ca_file, cert_file=cert_file)
-            self._die("could be mismatched certificate files, "
-                      "or wrong hostname in cert."
-                      "Check CERT_FILE and certs on server too.", e)
-
-        sock = socket.socket()
-        sock.settimeout(self.timeout)
-        self._ssl_sock = context.wrap_socket(sock, server_hostname=hostname)
+                cls._die("Can't find cert '{cert_file}' or CA '{ca_file}'. "
+                         "Check CERT_FILE / CA_FILE_PATH in settings",
+                         ca_file=ca_file, cert_file=cert_file)
+            cls._die("could be mismatched certificate files, "
+                     "or wrong hostname in cert."
+                     "Check CERT_FILE and certs on server too.", e)
+        return context
 
     def start(self):
         print_d("Connecting to port {port} on {hostname}",
                 port=self.port, hostname=self.hostname or '(localhost)')
+        context, session = self._SESSIONS.get(self._endpoint, (None, None))
+        # Sessions can only be resumed by the context that made them
+        if session and context is self._context:
+            self._ssl_sock.session = session
+        else:
+            session = None
         try:
             self._ssl_sock.connect((self.hostname, self.port))
         except socket.gaierror as e:
@@ -104,10 +152,35 @@ class SslSocketTransport(Transport):
             except Exception:
                 data = subject_data
             print_d("Validated cert for {data}", data=data)
+        self._log_resumption(offered=bool(session))
+        self._remember_session()
         self.is_connected = True
         return self
 
-    def _die(self, msg, err=None, **kwargs):
+    @property
+    def _endpoint(self):
+        return self.hostname, self.port
+
+    def _log_resumption(self, offered: bool):
+        cls = type(self)
+        cls._handshakes += 1
+        if self._ssl_sock.session_reused:
+            cls._resumptions += 1
+        print_d("TLS session {state} ({resumed}/{total} resumed so far)",
+                state=("resumed" if self._ssl_sock.session_reused else
+                       "not resumed" if offered else "negotiated"),
+                resumed=cls._resumptions, total=cls._handshakes)
+
+    def _remember_session(self):
+        """Keep the latest session for resuming future connections.
+        TLS 1.3 servers only send session tickets after the handshake,
+        so this is worth repeating after reading"""
+        session = getattr(self._ssl_sock, 'session', None)
+        if session is not None:
+            self._SESSIONS[self._endpoint] = (self._context, session)
+
+    @staticmethod
+    def _die(msg, err=None, **kwargs):
         raise Error(msg.format(**kwargs), err)
 
     @staticmethod
@@ -126,17 +199,14 @@ class SslSocketTransport(Transport):
         context.options |= _ssl.OP_NO_TLSv1
 
     def communicate(self, raw: str, wait=True) -> Optional[str]:
-        eof = False
-        response = ''
         data = raw.strip() + '\n'
         num_lines = data.count('\n')
         try:
             self._ssl_sock.sendall(data.encode('utf-8'))
             if not wait:
                 return None
-            while not eof:
-                response += self._ssl_sock.recv().decode('utf-8')
-                eof = response.count("\n") == num_lines or not response
+            response = self._read_lines(num_lines)
+            self._remember_session()
             return response
         except socket.error as e:
             if 'read operation timed out' in str(e):
@@ -152,6 +222,29 @@ class SslSocketTransport(Transport):
                 raise Error("Too many Squeezebox failures. Disconnecting")
             return None
 
+    def _read_lines(self, num_lines: int) -> str:
+        """Receive until `num_lines` newlines (or EOF) have arrived,
+        reading into a reusable buffer and decoding only once at the end.
+        Only newly received bytes are scanned for newlines."""
+        buf = self._buffer
+        size = 0
+        seen = 0
+        while seen < num_lines:
+            if size == len(buf):
+                # Full: double it, keeping what we've got so far
+                buf.extend(bytes(len(buf)))
+            with memoryview(buf) as view:
+                received = self._ssl_sock.recv_into(view[size:])
+            if not received:
+                break
+            seen += buf.count(b'\n', size, size + received)
+            size += received
+        if len(buf) > self._MAX_KEPT_BUFFER:
+            # Don't hang on to huge replies between requests
+            self._buffer = bytearray(self._BUFFER_SIZE)
+        with memoryview(buf) as view:
+            return str(view[:size], 'utf-8')
+
     @property
     def details(self):
         return "{hostname}:{port} over SSL".format(**self.__dict__)
@@ -160,6 +253,8 @@ class SslSocketTransport(Transport):
         if hasattr(self, '_ssl_sock') and not self._ssl_sock._closed:
             sock = self._ssl_sock
             print_d("Shutting down {who} ({sock})", who=self, sock=sock)
+            if self.is_connected:
+                self._remember_session()
             try:
                 # See https://stackoverflow.com/questions/409783
                 sock.shutdown(socket.SHUT_RDWR)
@@ -170,3 +265,86 @@ class SslSocketTransport(Transport):
 
     def __del__(self):
         self.stop()
+
+
+class AsyncSslSocketTransport(AsyncTransport):
+    """Asyncio streams version of `SslSocketTransport`.
+    Requests on one connection are sent one at a time, but any number of
+    these can be active on the same event loop."""
+
+    _READ_SIZE = 64 * 1024
+
+    def __init__(self, hostname, port=9090, ca_file=None, cert_file=None,
+                 verify_hostname=False, timeout=5, ca_data=None,
+                 cert_data=None):
+        super().__init__()
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self._context = SslSocketTransport.context_for(
+            ca_file, cert_file, verify_hostname, ca_data, cert_data)
+        self._reader = self._writer = None
+        self._lock = None
+
+    async def start(self):
+        print_d("Connecting to port {port} on {hostname}",
+                port=self.port, hostname=self.hostname or '(localhost)')
+        try:
+            connecting = asyncio.open_connection(
+                self.hostname, self.port, ssl=self._context,
+                server_hostname=self.hostname or None)
+            self._reader, self._writer = await asyncio.wait_for(
+                connecting, self.timeout)
+        except asyncio.TimeoutError:
+            raise Error("Couldn't connect to port {port} on {host} - "
+                        "check the server setup and the firewall."
+                        .format(host=self.hostname, port=self.port))
+        except (OSError, ssl.SSLError) as e:
+            raise Error("Couldn't connect to {this} ({type}: {text})"
+                        .format(this=self, type=type(e).__name__, text=e), e)
+        self._lock = asyncio.Lock()
+        self.is_connected = True
+        return self
+
+    async def communicate(self, raw: str, wait=True) -> Optional[str]:
+        data = raw.strip() + '\n'
+        num_lines = data.count('\n')
+        async with self._lock:
+            try:
+                self._writer.write(data.encode('utf-8'))
+                await self._writer.drain()
+                if not wait:
+                    return None
+                return await asyncio.wait_for(self._read_lines(num_lines),
+                                              self.timeout)
+            except asyncio.TimeoutError:
+                raise Error("Timed out waiting for CLI response. "
+                            "Perhaps the tunnel endpoint is incorrect, "
+                            "or the LMS CLI is down?")
+            except OSError as e:
+                await self.stop()
+                raise Error("Couldn't communicate with Squeezebox ({error!r})"
+                            .format(error=e), e)
+
+    async def _read_lines(self, num_lines: int) -> str:
+        chunks = []
+        seen = 0
+        while seen < num_lines:
+            chunk = await self._reader.read(self._READ_SIZE)
+            if not chunk:
+                break
+            seen += chunk.count(b'\n')
+            chunks.append(chunk)
+        return b''.join(chunks).decode('utf-8')
+
+    @property
+    def details(self):
+        return "{host}:{port} over SSL (async)".format(host=self.hostname,
+                                                       port=self.port)
+
+    async def stop(self):
+        if self._writer:
+            print_d("Shutting down {who}", who=self)
+            self._writer.close()
+            self._writer = self._reader = None
+        return await super().stop()
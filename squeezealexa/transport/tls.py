@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import os
+import ssl
+from os.path import join
+from tempfile import TemporaryDirectory
+from typing import Callable, Iterable, Optional, Tuple, Union
+
+from squeezealexa.utils import print_d
+
+PemData = Union[str, bytes]
+
+_CONTEXTS = {}
+"""SSL contexts (and the file stamps they were made with) by their config"""
+
+
+def stamp_of(path: Optional[str]) -> Optional[int]:
+    """The modification stamp of a file, or None if there's no such file"""
+    if not path:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def cached_context(key: Tuple, create: Callable[[], ssl.SSLContext],
+                   files: Iterable[Optional[str]] = ()) -> ssl.SSLContext:
+    """Returns the SSL context for `key`, only calling `create` if there's
+    no context yet, or if any of its `files` have changed since."""
+    stamps = tuple(stamp_of(f) for f in files)
+    cached = _CONTEXTS.get(key)
+    if cached and cached[0] == stamps:
+        return cached[1]
+    context = create()
+    print_d("Created new SSL context ({files})",
+            files=", ".join(f for f in files if f) or "no files")
+    _CONTEXTS[key] = (stamps, context)
+    return context
+
+
+def as_text(data: Optional[PemData]) -> Optional[str]:
+    if isinstance(data, bytes):
+        return data.decode('ascii')
+    return data
+
+
+def load_cert_chain_data(context: ssl.SSLContext, cert_data: PemData,
+                         key_data: PemData = None):
+    """Like `SSLContext.load_cert_chain`, but from PEM data in memory.
+    OpenSSL (via Python) can only load these from files, so they live in a
+    private temporary directory just long enough to be loaded."""
+    with TemporaryDirectory(prefix="squeeze-alexa-") as tmp_dir:
+        cert_path = join(tmp_dir, "cert.pem")
+        with open(cert_path, 'w') as f:
+            f.write(as_text(cert_data))
+        key_path = None
+        if key_data:
+            key_path = join(tmp_dir, "key.pem")
+            with open(key_path, 'w') as f:
+                f.write(as_text(key_data))
+        context.load_cert_chain(cert_path, key_path)
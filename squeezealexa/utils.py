@@ -14,6 +14,7 @@ import random
 import re
 import sys
 import unicodedata
+from threading import Condition
 from time import sleep, perf_counter
 from typing import Dict, Iterable, Union
 
@@ -79,14 +80,15 @@ def with_example(template: str, collection) -> str:
     return msg
 
 
+_BOOL_PREFIXES = ('has', 'is', 'can')
+
+
 def stronger(k: str, v: str, extra_bools=None):
     """Return a stronger-typed version of a value if possible"""
-    prefixes = set(extra_bools or [])
-    prefixes.update({'has', 'is', 'can'})
+    prefixes = _BOOL_PREFIXES + tuple(extra_bools or ())
     try:
-        for prefix in prefixes:
-            if k.startswith(prefix):
-                return bool(int(v))
+        if k.startswith(prefixes):
+            return bool(int(v))
         try:
             return int(v)
         except ValueError:
@@ -95,21 +97,35 @@ def stronger(k: str, v: str, extra_bools=None):
         return None if not v else v
 
 
+def timed_out_message(what, secs: float) -> str:
+    return _("Failed \"{task}\", "
+             "after {secs:.1f} seconds").format(task=what, secs=secs)
+
+
 def wait_for(func, timeout=3, what=None, context=None, exc_cls=Exception):
     nt = t = perf_counter()
     while not func(context):
         sleep(0.05)
         nt = perf_counter()
         if nt - t > timeout:
-            msg = _("Failed \"{task}\", "
-                    "after {secs:.1f} seconds").format(task=what,
-                                                       context=str(context),
-                                                       secs=nt - t)
-            raise exc_cls(msg)
+            raise exc_cls(timed_out_message(what, nt - t))
     print_d("Task \"{task}\" took < {duration:.2f} seconds", task=what,
             duration=nt - t)
 
 
+def wait_on(condition: Condition, func, timeout=3, what=None,
+            exc_cls=Exception):
+    """Like `wait_for`, but woken by `condition` being notified
+    rather than polling.
+    The caller must not already hold the condition's lock."""
+    t = perf_counter()
+    with condition:
+        if not condition.wait_for(func, timeout):
+            raise exc_cls(timed_out_message(what, perf_counter() - t))
+    print_d("Task \"{task}\" took {duration:.3f} seconds", task=what,
+            duration=perf_counter() - t)
+
+
 def first_of(details: Dict, tags: Iterable[str], default=None)\
         -> Union[str, None]:
     """Gets the first non-null value from the list of tags"""
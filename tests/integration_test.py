@@ -171,8 +171,8 @@ class TestNowPlaying(TestCase):
         alexa = SqueezeAlexa(server=server)
         resp = alexa.now_playing([], None)
         speech = speech_in(resp)
-        assert "I Think, I Love" in speech
-        assert "by Jamie Cullum" in speech
+        assert "in A Major, K. 488: Adagio" in speech
+        assert "by Jacques Loussier Trio" in speech
 
     def test_multiple_artists(self):
         fake_output = FakeTransport(fake_status=MULTI_ARTIST_STATUS).start()
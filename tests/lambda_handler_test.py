@@ -1,6 +1,7 @@
 import re
 
 from handler import lambda_handler, _
+from squeezealexa.alexa.intents import Custom
 from tests.alexa.alexa_handlers_test import NO_SESSION
 from tests.integration_test import FakeSqueeze
 
@@ -35,3 +36,24 @@ def test_entrypoint_launch():
     full_response = lambda_handler(request, {}, server=FakeSqueeze())
     resp = full_response['response']
     assert _("Squeezebox is online") in resp['outputSpeech']['text']
+
+
+def test_entrypoint_reuses_now_playing_text():
+    details = {"artist": ["Someone"], "title": ["Something"]}
+
+    class PlayingSqueeze(FakeSqueeze):
+        def prefetch(self, needs, player_id=None):
+            pass
+
+        def get_track_details(self, offset=0, player_id=None):
+            return details
+
+    server = PlayingSqueeze()
+    request = {'request': {'type': 'IntentRequest', 'requestId': 1234,
+                           'intent': {'name': Custom.NOW_PLAYING,
+                                      'slots': {}}},
+               'session': NO_SESSION}
+    first = lambda_handler(request, {}, server=server)['response']
+    details["title"] = ["Changed in place"]
+    second = lambda_handler(request, {}, server=server)['response']
+    assert second['outputSpeech'] == first['outputSpeech']
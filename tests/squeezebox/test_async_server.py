@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import asyncio
+
+import pytest
+
+from squeezealexa.squeezebox.async_server import AsyncServer
+from squeezealexa.squeezebox.library_cache import LibraryCache
+from squeezealexa.squeezebox.server import no_reply_error
+from tests.squeezebox.test_server import PagingTransport
+from tests.transport.fake_transport import FakeAsyncTransport, \
+    FakeTransport, FAKE_LENGTH
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+@pytest.fixture
+def transport():
+    return FakeAsyncTransport()
+
+
+@pytest.fixture
+def server(transport):
+    return run(AsyncServer.create(transport, library=LibraryCache()))
+
+
+class TestAsyncServer:
+    def test_create_finds_players(self, server):
+        assert server.connected
+        assert server.player_names == {'fake'}
+        assert server.cur_player_id == '12:34'
+
+    def test_login(self, transport):
+        server = run(AsyncServer.create(transport, user='admin',
+                                        password='pass'))
+        assert server.user == 'admin'
+
+    def test_milliseconds(self, server):
+        assert run(server.get_milliseconds()) == FAKE_LENGTH * 1000
+
+    def test_change_volume(self, server, transport):
+        run(server.change_volume(3))
+        assert "mixer volume +3" in transport.fake.all_input
+
+    def test_track_details(self, server):
+        details = run(server.get_track_details())
+        assert ["Jacques Loussier Trio"] == details['artist']
+        details = run(server.get_track_details(offset=1))
+        assert ["Jamie Cullum"] == details['artist']
+
+    def test_faves(self, server):
+        assert len(run(server.favorites())) == 2
+
+    def test_concurrent_households(self):
+        async def now_playing(transport):
+            server = await AsyncServer.create(transport)
+            return await server.get_track_details()
+
+        async def all_playing(transports):
+            return await asyncio.gather(*[now_playing(t) for t in transports])
+
+        transports = [FakeAsyncTransport(FakeTransport(fake_id=str(i)))
+                      for i in range(5)]
+        results = run(all_playing(transports))
+        assert len(results) == 5
+        assert all(r['artist'] == ["Jacques Loussier Trio"] for r in results)
+
+    def test_genres_are_paged(self):
+        transport = PagingTransport(num_genres=11)
+        server = run(AsyncServer.create(FakeAsyncTransport(transport),
+                                        page_size=3, library=LibraryCache()))
+        assert run(server.genres()) == transport.genres
+        assert transport.requests[1].splitlines() == [
+            "genres 3 3", "genres 6 3", "genres 9 3"]
+        assert run(server.genres()) == transport.genres
+        assert len(transport.requests) == 2
+
+    def test_library_cached_until_rescanned(self):
+        status = ("serverstatus 0 99 lastscan%3A{scan} player%20count%3A1 "
+                  "playerid%3A12%3A34 connected%3A1 name%3AStudy\n")
+        transport = PagingTransport(num_genres=3)
+        transport._server_status = status.format(scan=1)
+        library = LibraryCache()
+        for _ in range(2):
+            server = run(AsyncServer.create(FakeAsyncTransport(transport),
+                                            library=library))
+            assert run(server.genres()) == transport.genres
+        assert len(transport.requests) == 1
+        transport._server_status = status.format(scan=2)
+        run(server.refresh_status())
+        assert run(server.genres()) == transport.genres
+        assert len(transport.requests) == 2
+
+    def test_no_reply_error_names_command(self):
+        assert "'genres'" in str(no_reply_error("genres 0 255"))
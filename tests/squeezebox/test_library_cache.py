@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import os
+
+from squeezealexa.squeezebox.library_cache import LibraryCache, \
+    NEGATIVE_TTL_SECS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Fetcher:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_caches_until_ttl():
+    clock = FakeClock()
+    cache = LibraryCache({'genres': 100}, clock=clock)
+    fetch = Fetcher(["Jazz"])
+    assert cache.get('genres', fetch) == ["Jazz"]
+    clock.now += 99
+    assert cache.get('genres', fetch) == ["Jazz"]
+    assert fetch.calls == 1
+    clock.now += 2
+    cache.get('genres', fetch)
+    assert fetch.calls == 2
+
+
+def test_caches_empty_results_briefly():
+    clock = FakeClock()
+    cache = LibraryCache({'playlists': 3600}, clock=clock)
+    fetch = Fetcher([])
+    cache.get('playlists', fetch)
+    cache.get('playlists', fetch)
+    assert fetch.calls == 1
+    clock.now += NEGATIVE_TTL_SECS + 1
+    cache.get('playlists', fetch)
+    assert fetch.calls == 2
+
+
+def test_lastscan_change_invalidates():
+    cache = LibraryCache(clock=FakeClock())
+    fetch = Fetcher(["Jazz"])
+    cache.saw_server(1536990512)
+    cache.get('genres', fetch)
+    cache.saw_server(1536990512)
+    cache.saw_server(None)
+    cache.get('genres', fetch)
+    assert fetch.calls == 1
+    cache.saw_server(1536999999)
+    cache.get('genres', fetch)
+    assert fetch.calls == 2
+
+
+def test_snapshot_warms_new_cache(tmp_path):
+    path = str(tmp_path / "library.bin")
+    cache = LibraryCache(snapshot_path=path)
+    cache.saw_server(1536990512, 2)
+    cache.get('genres', Fetcher(["Jazz", "Rock"]))
+    cache.get('favorites', Fetcher({"Chilled": {"isaudio": True}}))
+
+    fetch = Fetcher(["Other"])
+    cold = LibraryCache(snapshot_path=path)
+    cold.saw_server(1536990512, 2)
+    assert cold.get('genres', fetch) == ["Jazz", "Rock"]
+    assert cold.get('favorites', fetch) == {"Chilled": {"isaudio": True}}
+    assert not fetch.calls
+
+
+def test_snapshot_validated_against_server(tmp_path):
+    for lastscan, players in [(1536999999, 2), (1536990512, 3)]:
+        path = str(tmp_path / ("library-%d-%d.bin" % (lastscan, players)))
+        cache = LibraryCache(snapshot_path=path)
+        cache.saw_server(1536990512, 2)
+        cache.get('genres', Fetcher(["Jazz"]))
+
+        cold = LibraryCache(snapshot_path=path)
+        cold.saw_server(lastscan, players)
+        assert cold.get('genres', Fetcher(["Other"])) == ["Other"]
+
+
+def test_snapshot_expires(tmp_path):
+    path = str(tmp_path / "library.bin")
+    LibraryCache({'genres': -1}, snapshot_path=path).get('genres',
+                                                         Fetcher(["Jazz"]))
+    fetch = Fetcher(["Other"])
+    assert LibraryCache(snapshot_path=path).get('genres', fetch) == ["Other"]
+
+
+def test_bad_snapshot_ignored(tmp_path):
+    path = tmp_path / "library.bin"
+    path.write_bytes(b"not a snapshot")
+    fetch = Fetcher(["Jazz"])
+    assert LibraryCache(snapshot_path=str(path)).get('genres', fetch)
+    assert fetch.calls == 1
+
+
+def test_snapshot_dir_created_private(tmp_path):
+    path = tmp_path / "cache" / "library.bin"
+    LibraryCache(snapshot_path=str(path)).get('genres', Fetcher(["Jazz"]))
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+    assert [p.name for p in path.parent.iterdir()] == ["library.bin"]
+
+
+def test_snapshot_writable_by_others_ignored(tmp_path):
+    path = tmp_path / "library.bin"
+    LibraryCache(snapshot_path=str(path)).get('genres', Fetcher(["Jazz"]))
+    os.chmod(str(path), 0o666)
+    fetch = Fetcher(["Other"])
+    assert LibraryCache(snapshot_path=str(path)).get('genres', fetch) == [
+        "Other"]
+
+
+def test_symlinked_snapshot_ignored(tmp_path):
+    real = tmp_path / "real.bin"
+    LibraryCache(snapshot_path=str(real)).get('genres', Fetcher(["Jazz"]))
+    link = tmp_path / "library.bin"
+    link.symlink_to(real)
+    fetch = Fetcher(["Other"])
+    assert LibraryCache(snapshot_path=str(link)).get('genres', fetch) == [
+        "Other"]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+from squeezealexa.squeezebox.player_registry import PlayerRegistry
+
+STUDY = {'playerid': "aa:aa", 'name': "Study", 'connected': True}
+KITCHEN = {'playerid': "bb:bb", 'name': "Kitchen", 'connected': False}
+
+
+def test_update_only_on_change():
+    registry = PlayerRegistry()
+    assert registry.update({"aa:aa": STUDY, "bb:bb": KITCHEN})
+    assert registry.version == 1
+    connected = registry.connected
+    assert list(connected) == ["aa:aa"]
+    assert not registry.update({"aa:aa": dict(STUDY),
+                                "bb:bb": dict(KITCHEN)})
+    assert registry.version == 1
+    assert registry.connected is connected
+
+
+def test_update_applies_delta():
+    registry = PlayerRegistry()
+    registry.update({"aa:aa": STUDY, "bb:bb": KITCHEN})
+    study = registry.all["aa:aa"]
+    assert registry.update({"aa:aa": STUDY,
+                            "bb:bb": dict(KITCHEN, connected=True)})
+    assert registry.all["aa:aa"] is study
+    assert set(registry.connected) == {"aa:aa", "bb:bb"}
+    assert registry.update({"bb:bb": KITCHEN})
+    assert not registry.connected
+    assert registry.version == 3
+
+
+def test_set_connected():
+    registry = PlayerRegistry()
+    registry.update({"aa:aa": STUDY})
+    assert not registry.set_connected("aa:aa", True)
+    assert not registry.set_connected("zz:zz", True)
+    assert registry.set_connected("aa:aa", False)
+    assert not registry.connected
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+from squeezealexa.squeezebox.schema import as_bool, as_int, as_number, \
+    as_str, SERVERSTATUS, STATUS
+from squeezealexa.squeezebox.server import groups_from, favorites_from
+
+
+def test_converters():
+    assert as_bool("1") is True
+    assert as_bool("0") is False
+    assert as_int("42") == 42
+    assert as_number("42") == 42
+    assert as_number("4.5") == 4.5
+    assert as_str("foo") == "foo"
+
+
+def test_empty_is_none():
+    for convert in (as_bool, as_int, as_number, as_str):
+        assert convert("") is None
+
+
+def test_bad_values_stay_strings():
+    assert as_int("v1.9") == "v1.9"
+    assert as_bool("maybe") == "maybe"
+
+
+def test_unknown_keys_stay_strings():
+    player = next(groups_from("playerid%3A00%3A04%3A20%3A17%3A6f%3Ad1 "
+                              "name%3A1999 power%3A1 seq_no%3A3",
+                              schema=SERVERSTATUS))
+    assert player == {'playerid': "00:04:20:17:6f:d1", 'name': "1999",
+                      'power': True, 'seq_no': 3}
+
+
+def test_track_titles_stay_strings():
+    status = next(groups_from("mode%3Aplay time%3A12.5 title%3A1999 "
+                              "playlist%20index%3A0", schema=STATUS))
+    assert status['title'] == "1999"
+    assert status['time'] == 12.5
+    assert status['playlist index'] == 0
+
+
+def test_favorite_ids_stay_strings():
+    faves = favorites_from("name%3A1 id%3A8f7e3a2b.1 isaudio%3A1 hasitems%3A0")
+    assert faves == {'1': {'id': "8f7e3a2b.1", 'name': "1", 'isaudio': True,
+                           'hasitems': False}}
@@ -18,8 +18,12 @@ from unittest import TestCase
 from pytest import raises
 
 from squeezealexa.squeezebox.server import Server, \
-    SqueezeboxPlayerSettings as SPS, SqueezeboxException, ServerFactory
-from squeezealexa.transport.base import Transport
+    SqueezeboxPlayerSettings as SPS, SqueezeboxException, ServerFactory, \
+    split_response, values_from, Needs, status_from, Player, Track, \
+    details_from
+from squeezealexa.squeezebox import server as server_module
+from squeezealexa.squeezebox.library_cache import LibraryCache
+from squeezealexa.transport.base import Transport, Error
 from squeezealexa.transport.factory import TransportFactory
 from squeezealexa.utils import print_d
 from tests.transport.fake_transport import FakeTransport, FAKE_LENGTH, \
@@ -56,7 +60,7 @@ class NoRefreshServer(Server):
         super().__init__(FixedTransportFactory(FakeTransport()).create(),
                          user, password, cur_player_id, False)
 
-    def refresh_status(self):
+    def _players_updated(self, changed: bool):
         self.players = {}
 
 
@@ -79,6 +83,57 @@ class StubbedTransportServer(Server):
         pass
 
 
+class PagingTransport(FakeTransport):
+    """Has lots of genres, replying with at most the requested page"""
+
+    def __init__(self, num_genres: int):
+        super().__init__()
+        self.genres = ["Genre %d" % i for i in range(num_genres)]
+        self.requests = []
+
+    def communicate(self, data, wait=True):
+        if not data.startswith('genres'):
+            return super().communicate(data, wait)
+        self.requests.append(data)
+        replies = []
+        for line in data.splitlines():
+            start, size = map(int, line.split()[1:3])
+            page = self.genres[start:start + size]
+            replies.append(" ".join(
+                [line, "count%%3A%d" % len(self.genres)] +
+                ["genre%%3A%s" % g.replace(' ', '%20') for g in page]))
+        return "\n".join(replies) + "\n"
+
+
+class ProbedTransport(FakeTransport):
+    """Answers cheap player probes, counting full `serverstatus`es"""
+
+    def __init__(self):
+        super().__init__()
+        self.connected = 1
+        self.lastscan = 1
+        self.kitchen = False
+        self.full_refreshes = 0
+
+    def communicate(self, data, wait=True):
+        count = 2 if self.kitchen else 1
+        if data.startswith('serverstatus 0 99'):
+            self.full_refreshes += 1
+            kitchen = (' playerid%3Aaa%3Aaa connected%3A1 name%3AKitchen'
+                       if self.kitchen else '')
+            return ('serverstatus 0 99 lastscan%%3A%d player%%20count%%3A%d '
+                    'playerid%%3A12%%3A34 connected%%3A%d name%%3AStudy%s\n'
+                    % (self.lastscan, count, self.connected, kitchen))
+        if data.startswith('serverstatus 0 0'):
+            lines = data.splitlines()
+            status = ("serverstatus 0 0 lastscan%%3A%d player%%20count%%3A%d"
+                      % (self.lastscan, count))
+            return "\n".join([status] +
+                             ["%s %d" % (line[:-2], self.connected)
+                              for line in lines[1:]]) + "\n"
+        return super().communicate(data, wait)
+
+
 class TestServerNoTransport:
     def test_no_players_raises(self):
         with raises(SqueezeboxException) as e:
@@ -207,6 +262,8 @@ class TestServerWithFakeTransport(TestCase):
 
     def test_track_details(self):
         details = self.server.get_track_details()
+        assert ["Jacques Loussier Trio"] == details['artist']
+        details = self.server.get_track_details(offset=1)
         assert ["Jamie Cullum"] == details['artist']
 
     def test_disconnected_transport_reconnects(self):
@@ -266,3 +323,330 @@ def test_tricky_players_parsing():
     server.refresh_status()
     assert len(server.player_names) == 3, "Should only have found 3 players"
     assert server.player_names == {'Cuisine', 'Chambre', 'Salon'}
+
+
+def test_split_response_skips_quoted_echo():
+    lines = ["favorites items 0 255 want_url:1", "12:34 mixer volume ?"]
+    response = ("favorites items 0 255 want_url%3A1 title%3AFavorites\n"
+                "12%3A34 mixer volume 42\n")
+    assert split_response(lines, response, raw=True) == [
+        "title%3AFavorites", "42"]
+    assert split_response(lines, response)[0] == "title:Favorites"
+
+
+def test_split_response_login():
+    assert split_response(["login admin secret"],
+                          "login admin ******\n") == ["admin ******"]
+
+
+def test_values_from():
+    response = "id%3A1 genre%3ASoul%20Jazz id%3A2 genre%3AFunk%2FSoul"
+    assert values_from(response, 'genre') == ["Soul Jazz", "Funk/Soul"]
+
+
+def test_genres_are_paged():
+    transport = PagingTransport(num_genres=11)
+    server = Server(transport, page_size=3)
+    assert server.genres == transport.genres
+    assert transport.requests[0] == "genres 0 3"
+    assert transport.requests[1].splitlines() == [
+        "genres 3 3", "genres 6 3", "genres 9 3"]
+
+
+def test_paging_can_stop_early():
+    transport = PagingTransport(num_genres=1000)
+    server = Server(transport, page_size=10)
+    genres = server.iter_genres()
+    assert [next(genres) for _ in range(10)] == transport.genres[:10]
+    assert len(transport.requests) == 1
+
+
+def test_library_survives_servers_until_rescanned():
+    status = ("serverstatus 0 99 lastscan%3A{scan} player%20count%3A1 "
+              "playerid%3A12%3A34 connected%3A1 name%3AStudy\n")
+    transport = PagingTransport(num_genres=3)
+    transport._server_status = status.format(scan=1)
+    library = LibraryCache()
+    assert Server(transport, library=library).genres
+    assert Server(transport, library=library).genres
+    assert len(transport.requests) == 1
+    transport._server_status = status.format(scan=2)
+    assert Server(transport, library=library).genres
+    assert len(transport.requests) == 2
+
+
+def test_refresh_status_only_when_players_change():
+    transport = ProbedTransport()
+    server = Server(transport)
+    players = server.players
+    server.refresh_status()
+    assert server.players is players
+    assert server.registry.version == 1
+    assert transport.full_refreshes == 1
+
+    transport.connected = 0
+    server.refresh_status()
+    assert transport.full_refreshes == 1
+    assert not server.players
+    assert server.registry.version == 2
+
+    transport.kitchen = True
+    server.refresh_status()
+    assert transport.full_refreshes == 2
+    assert server.player_names == {"Kitchen"}
+
+
+def test_probe_notices_rescan():
+    transport = ProbedTransport()
+    server = Server(transport)
+    server.library.put('genres', ["Jazz"])
+    transport.lastscan = 2
+    server.refresh_status()
+    assert transport.full_refreshes == 1
+    assert not server.library.cached('genres')
+
+
+class CountingTransport(FakeTransport):
+    def __init__(self, fail=False):
+        super().__init__()
+        self.fail = fail
+        self.sent = []
+
+    def communicate(self, data, wait=True):
+        if not data.startswith('serverstatus'):
+            self.sent.append(data)
+            if self.fail:
+                raise Error("Oops")
+        return super().communicate(data, wait)
+
+
+def test_batch_is_one_round_trip():
+    transport = CountingTransport()
+    server = Server(transport)
+    with server.batch() as batch:
+        for pid in ["aa:aa", "bb:bb"]:
+            server.pause(player_id=pid)
+            server.change_volume(-10, player_id=pid)
+    assert transport.sent == ["aa:aa pause 1\naa:aa mixer volume -10.0\n"
+                              "bb:bb pause 1\nbb:bb mixer volume -10.0"]
+    assert [r.player_id for r in batch.results] == ["aa:aa", "aa:aa",
+                                                    "bb:bb", "bb:bb"]
+    assert all(r.ok for r in batch.results)
+    assert batch.results[-1].reply == "OK"
+
+
+def test_batch_errors_per_command():
+    server = Server(CountingTransport(fail=True))
+    results = server.batch().add("pause 1").add("play", "bb:bb").send()
+    assert len(results) == 2
+    assert not any(r.ok for r in results)
+    assert results[1].player_id == "bb:bb"
+    assert isinstance(results[0].error, Error)
+
+
+def test_batch_refuses_queries():
+    transport = CountingTransport()
+    server = Server(transport)
+    with raises(SqueezeboxException):
+        with server.batch():
+            server.get_track_details()
+    assert not transport.sent
+    assert not server._queues
+    assert server.get_track_details()
+
+
+class LineByLineTransport(CountingTransport):
+    """Replies to each (pipelined) line separately"""
+
+    REPLIES = {'genres': "count%3A2 id%3A1 genre%3AJazz id%3A2 genre%3ARock",
+               'playlists': "count%3A1 id%3A1 playlist%3AMoody",
+               'serverstatus 0 0': "lastscan%3A1 player%20count%3A1",
+               'serverstatus 0 99': "lastscan%3A1 player%20count%3A1 "
+                                    "playerid%3A12%3A34 connected%3A1 "
+                                    "name%3AFake",
+               '12:34 status': A_REAL_STATUS,
+               '12:34 connected': "1"}
+
+    def communicate(self, data, wait=True):
+        self.sent.append(data)
+        replies = []
+        for line in data.splitlines():
+            reply = next(r for prefix, r in self.REPLIES.items()
+                         if line.startswith(prefix))
+            replies.append("%s %s" % (line.rstrip('?').rstrip(), reply))
+        return "\n".join(replies) + "\n"
+
+
+def test_prefetch_is_one_round_trip(monkeypatch):
+    transport = LineByLineTransport()
+    server = Server(transport)
+    transport.sent.clear()
+    monkeypatch.setattr(server_module, 'PLAYERS_FRESH_SECS', 0)
+    server.prefetch([Needs.GENRES, Needs.PLAYLISTS, Needs.PLAYERS,
+                     Needs.STATUS])
+    assert len(transport.sent) == 1
+    assert transport.sent[0].splitlines() == [
+        "serverstatus 0 0", "12:34 connected ?", "genres 0 255",
+        "playlists 0 255", "12:34 status - 3 tags:aAgGl"]
+    assert server.genres == ["Jazz", "Rock"]
+    assert server.playlists == ["Moody"]
+    assert server.get_track_details()['genre'] == ["Jazz"]
+    assert len(transport.sent) == 1
+
+
+def test_new_server_prefetches_with_its_players():
+    transport = LineByLineTransport()
+    needs = [Needs.GENRES, Needs.PLAYLISTS, Needs.STATUS]
+    server = Server(transport, cur_player_id="12:34", prefetch=needs)
+    assert transport.sent[0].splitlines() == [
+        "serverstatus 0 99", "genres 0 255", "playlists 0 255",
+        "12:34 status - 3 tags:aAgGl"]
+    assert server.cur_player_id == "12:34"
+    server.prefetch(needs + [Needs.PLAYERS], player_id="12:34")
+    assert server.get_track_details()['genre'] == ["Jazz"]
+    assert len(transport.sent) == 1
+
+
+def test_prefetch_skips_cached():
+    transport = LineByLineTransport()
+    server = Server(transport)
+    assert server.genres
+    transport.sent.clear()
+    server.prefetch([Needs.GENRES])
+    assert not transport.sent
+
+
+class QueueTransport(CountingTransport):
+    """Has a queue of tracks, with a mutable current index"""
+
+    def __init__(self):
+        super().__init__()
+        self.timestamp = 1000.5
+        self.cur_index = 0
+
+    def communicate(self, data, wait=True):
+        if ' status ' not in data:
+            return super().communicate(data, wait)
+        self.sent.append(data)
+        line = data.rstrip('\n')
+        count = int(line.split()[3])
+        tracks = " ".join(
+            "playlist%%20index%%3A%d id%%3A%d title%%3ATrack%%20%d"
+            % (i, i, i)
+            for i in range(self.cur_index, self.cur_index + count))
+        return ("%s playlist_cur_index%%3A%d playlist_timestamp%%3A%s %s\n"
+                % (line, self.cur_index, self.timestamp, tracks))
+
+
+def test_status_from():
+    status, tracks = status_from(A_REAL_STATUS)
+    assert status['playlist_cur_index'] == 20
+    assert status['mode'] == 'play'
+    assert [t['playlist index'] for t in tracks] == [20, 21]
+    assert tracks[1]['artist'] == "Jamie Cullum"
+
+
+def test_queue_is_one_request():
+    transport = QueueTransport()
+    server = Server(transport)
+    transport.sent.clear()
+    tracks = server.get_queue(0, 3)
+    assert [t['title'] for t in tracks] == [["Track 0"], ["Track 1"],
+                                            ["Track 2"]]
+    assert len(transport.sent) == 1
+    assert server.get_track_details(offset=1)['title'] == ["Track 1"]
+    assert len(transport.sent) == 1
+
+
+def test_queue_cached_until_it_changes(monkeypatch):
+    transport = QueueTransport()
+    server = Server(transport)
+    server.get_queue()
+    monkeypatch.setattr(server_module, 'QUEUE_FRESH_SECS', 0)
+    transport.sent.clear()
+    assert server.get_track_details()['title'] == ["Track 0"]
+    assert transport.sent == ["12:34 status - 0 tags:aAgGl"]
+    transport.cur_index = 1
+    assert server.get_track_details()['title'] == ["Track 1"]
+    assert len(transport.sent) == 3
+
+
+def test_queue_forgotten_after_player_commands():
+    transport = QueueTransport()
+    server = Server(transport)
+    server.get_queue()
+    server.next()
+    transport.cur_index = 1
+    assert server.get_track_details()['title'] == ["Track 1"]
+
+
+def test_batched_commands_forget_queue():
+    transport = QueueTransport()
+    server = Server(transport)
+    server.get_queue()
+    batch = server.batch().add("playlist jump +1")
+    assert not server._queues
+    with raises(SqueezeboxException):
+        batch.add("time ?")
+    batch.send()
+    transport.cur_index = 1
+    assert server.get_track_details()['title'] == ["Track 1"]
+
+
+def test_prefetch_skips_fresh_queue():
+    transport = QueueTransport()
+    server = Server(transport)
+    details = server.get_track_details()
+    transport.sent.clear()
+    server.prefetch([Needs.STATUS])
+    assert not transport.sent
+    assert server.get_track_details() is details
+
+
+def test_queue_keeps_details_while_unchanged(monkeypatch):
+    transport = QueueTransport()
+    server = Server(transport)
+    details = server.get_track_details()
+    monkeypatch.setattr(server_module, 'QUEUE_FRESH_SECS', 0)
+    server.prefetch([Needs.STATUS])
+    assert server.get_track_details() is details
+
+
+def test_prefetch_checks_stale_queue_cheaply(monkeypatch):
+    transport = QueueTransport()
+    server = Server(transport)
+    server.get_queue()
+    monkeypatch.setattr(server_module, 'QUEUE_FRESH_SECS', 0)
+    transport.sent.clear()
+    server.prefetch([Needs.STATUS])
+    assert transport.sent == ["12:34 status - 0 tags:aAgGl"]
+    transport.cur_index = 1
+    server.prefetch([Needs.STATUS])
+    assert not server._queues
+    assert server.get_track_details()['title'] == ["Track 1"]
+    assert transport.sent[-1] == "12:34 status - 3 tags:aAgGl"
+
+
+def test_player_keeps_only_used_fields():
+    data = {'playerid': "aa:bb", 'name': "Study", 'connected': True,
+            'uuid': None, 'ip': "1.2.3.4:5678", 'seq_no': 3}
+    player = Player(data)
+    assert not hasattr(player, '__dict__')
+    assert dict(player) == {'playerid': "aa:bb", 'name': "Study",
+                            'connected': True}
+    assert player.id == "aa:bb"
+    assert player.get('ip') is None
+    assert player == data
+    assert player != dict(data, name="Kitchen")
+    assert str(player) == "Study [aa:bb]"
+
+
+def test_track_details_are_interned():
+    first, second = (details_from([('artist', ", ".join(["Miles", name])),
+                                   ('genres', "Jazz"), ('genre', "Bop")])
+                     for name in ("Coltrane", "Coltrane"))
+    assert first['artist'] == ["Miles", "Coltrane"]
+    assert first['genre'] == ["Jazz"]
+    assert first['artist'][1] is second['artist'][1]
+    assert 'composer' not in first
+    assert not Track()
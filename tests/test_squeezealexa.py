@@ -14,8 +14,9 @@ from unittest.mock import MagicMock
 
 import pytest
 
-from squeezealexa.main import SqueezeAlexa
-from squeezealexa.squeezebox.server import Server
+from squeezealexa.alexa.intents import Custom
+from squeezealexa.main import SqueezeAlexa, needs_of
+from squeezealexa.squeezebox.server import Server, Needs
 from tests.integration_test import speech_in
 
 
@@ -54,3 +55,22 @@ class TestWithStubbedServer:
         speech = speech_in(resp)
         assert "Currently playing: \"Something\", " \
                "by Someone and Someone Else." == speech
+
+    def test_now_playing_reuses_text_for_same_details(self, mock_server,
+                                                      alexa):
+        details = {"artist": ["Someone"], "title": ["Something"]}
+        mock_server.get_track_details = MagicMock(return_value=details)
+        first = speech_in(alexa.now_playing([], None))
+        details["title"] = ["Changed in place"]
+        assert speech_in(alexa.now_playing([], None)) == first
+        mock_server.get_track_details = MagicMock(
+            return_value=dict(details))
+        assert "Changed in place" in speech_in(alexa.now_playing([], None))
+
+
+def test_needs_of_intent():
+    event = {'request': {'type': 'IntentRequest',
+                         'intent': {'name': Custom.NOW_PLAYING}}}
+    assert needs_of(event) == {Needs.STATUS}
+    assert not needs_of({'request': {'type': 'LaunchRequest'}})
+    assert not needs_of(None)
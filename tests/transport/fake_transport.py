@@ -12,7 +12,7 @@
 
 from logging import getLogger
 
-from squeezealexa.transport.base import Transport
+from squeezealexa.transport.base import Transport, AsyncTransport
 
 log = getLogger(__name__)
 
@@ -86,3 +86,18 @@ class FakeTransport(Transport):
     @property
     def details(self):
         return "{hostname}:{port}".format(**self.__dict__)
+
+
+class FakeAsyncTransport(AsyncTransport):
+    """Async wrapper for a `FakeTransport`"""
+
+    def __init__(self, fake: FakeTransport = None):
+        super().__init__()
+        self.fake = fake or FakeTransport()
+
+    async def communicate(self, data, wait=True):
+        return self.fake.communicate(data, wait)
+
+    @property
+    def details(self):
+        return self.fake.details
@@ -24,7 +24,8 @@ from paho.mqtt.client import MQTT_ERR_INVAL, MQTTMessage, Client
 
 from squeezealexa.settings import MqttSettings
 from squeezealexa.transport.factory import TransportFactory
-from squeezealexa.transport.mqtt import CustomClient
+from squeezealexa.transport.mqtt import CustomClient, correlation_of, \
+    publish_reply
 from squeezealexa.utils import wait_for
 from tests.transport.base import CertFiles
 from tests.utils import TEST_DATA_DIR
@@ -153,9 +154,10 @@ class TestLiveMqttTransport:
         self.subscribed = False
 
         def on_message(client: Client, userdata, msg: MQTTMessage):
-            msg = msg.payload.decode('utf-8').strip()
-            client.publish(mqtt_settings.topic_resp,
-                           "GOT: {m}".format(m=msg).encode('utf-8'))
+            cid, payload = correlation_of(msg)
+            text = payload.decode('utf-8').strip()
+            publish_reply(client, msg, "GOT: {m}".format(m=text).encode(),
+                          default_topic=mqtt_settings.topic_resp)
 
         def on_subscribe(client, data, mid, granted_qos):
             self.subscribed = True
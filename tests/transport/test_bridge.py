@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+import threading
+import time
+
+from paho.mqtt.client import MQTTMessage
+
+from squeezealexa.transport.bridge import Bridge, player_of, CliWorker
+from squeezealexa.transport.mqtt import correlation_of, CORRELATION_HEADER
+
+PLAYER = b"00:04:20:12:34:56"
+OTHER = b"00%3A04%3A20%3Aab%3Acd%3Aef"
+
+
+class EchoingCli:
+    """Quacks like an `LmsCliConnection` to an LMS CLI that echoes every
+    line, (with the first player's being slow)"""
+
+    def __init__(self):
+        self.writes = 0
+        self.closed = False
+
+    def request(self, payload: bytes, timeout=None):
+        self.writes += 1
+        lines = payload.strip().splitlines()
+        for line in lines:
+            if line.startswith(PLAYER):
+                time.sleep(0.01)
+        return lines
+
+    def close(self):
+        self.closed = True
+
+
+def request(cid: str, payload: bytes) -> MQTTMessage:
+    msg = MQTTMessage(topic=b"req")
+    msg.payload = CORRELATION_HEADER + cid.encode() + b"\n" + payload
+    return msg
+
+
+class Replies:
+    def __init__(self, expected: int):
+        self.received = []
+        self.expected = expected
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, message: MQTTMessage, rsp: bytes):
+        with self._lock:
+            self.received.append((correlation_of(message)[0], rsp))
+            if len(self.received) == self.expected:
+                self.done.set()
+
+
+class TestBridge:
+    def test_player_of(self):
+        assert player_of(PLAYER + b" mixer volume ?\n") == PLAYER
+        assert player_of(OTHER + b" pause 1\n") == b"00:04:20:ab:cd:ef"
+        assert player_of(b"serverstatus 0 99\n") is None
+        assert player_of(b"login me secret\n") is None
+
+    def test_keeps_player_commands_in_order(self):
+        replies = Replies(20)
+        bridge = Bridge(EchoingCli, replies, workers=3).start()
+        for i in range(10):
+            bridge.submit(request("p-%d" % i, PLAYER + b" time %d\n" % i))
+            bridge.submit(request("s-%d" % i, b"serverstatus %d 1\n" % i))
+        assert replies.done.wait(5)
+        bridge.stop()
+        mine = [cid for cid, _ in replies.received if cid.startswith("p-")]
+        assert mine == ["p-%d" % i for i in range(10)]
+        assert dict(replies.received)["s-3"] == b"serverstatus 3 1"
+
+    def test_slow_player_doesnt_block_others(self):
+        replies = Replies(6)
+        bridge = Bridge(EchoingCli, replies, workers=2).start()
+        for i in range(5):
+            bridge.submit(request("p-%d" % i, PLAYER + b" time ?\n"))
+        bridge.submit(request("fast", b"version ?\n"))
+        assert replies.done.wait(5)
+        bridge.stop()
+        assert replies.received[0][0] == "fast"
+
+    def test_multiline(self):
+        replies = Replies(1)
+        bridge = Bridge(EchoingCli, replies, workers=1).start()
+        bridge.submit(request("x", b"one\ntwo\n"))
+        assert replies.done.wait(5)
+        bridge.stop()
+        assert replies.received == [("x", b"one\ntwo")]
+
+    def test_pipelines_waiting_requests(self):
+        replies = Replies(3)
+        cli = EchoingCli()
+        worker = CliWorker(0, lambda: cli, replies)
+        for cid, payload in [("a", b"one\n"), ("b", b"two\nthree\n"),
+                             ("c", b"four\n")]:
+            worker.submit(request(cid, payload))
+        worker.stop()
+        worker.run()
+        assert cli.writes == 1
+        assert replies.received == [("a", b"one"), ("b", b"two\nthree"),
+                                    ("c", b"four")]
+
+    def test_stop(self):
+        bridge = Bridge(EchoingCli, Replies(0), workers=2).start()
+        clis = [w.cli for w in bridge.workers]
+        bridge.stop()
+        assert all(not w.is_alive() for w in bridge.workers)
+        assert all(cli.closed for cli in clis)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+import socket
+import threading
+
+import pytest
+
+from squeezealexa.settings import LmsSettings, MqttSettings
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.cli import LmsCliConnection, CliSocketTransport
+from squeezealexa.transport.factory import TransportFactory
+
+
+class FakeCliServer(threading.Thread):
+    """Echoes every line back, like the LMS CLI does (mostly)"""
+
+    def __init__(self, reply=lambda line: line):
+        super().__init__(daemon=True)
+        self.reply = reply
+        self.sock = socket.socket()
+        self.sock.bind(('localhost', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.connections = 0
+        self.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.serve, args=(conn,),
+                             daemon=True).start()
+
+    def serve(self, conn):
+        with conn, conn.makefile('rb') as f:
+            for line in f:
+                reply = self.reply(line.rstrip(b'\n'))
+                if reply is None:
+                    continue
+                if reply is False:
+                    return
+                conn.sendall(reply + b'\n')
+
+    def stop(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def server():
+    s = FakeCliServer()
+    yield s
+    s.stop()
+
+
+class TestLmsCliConnection:
+    def test_pipelined_request(self, server):
+        cli = LmsCliConnection('localhost', server.port).connect()
+        assert cli.request(b"one\ntwo\nthree\n") == [b"one", b"two", b"three"]
+        cli.close()
+
+    def test_large_replies(self):
+        server = FakeCliServer(lambda line: line * 50000)
+        cli = LmsCliConnection('localhost', server.port).connect()
+        for _ in range(3):
+            assert cli.request(b"ab\ncd") == [b"ab" * 50000, b"cd" * 50000]
+        cli.close()
+        server.stop()
+
+    def test_timeout_closes(self):
+        server = FakeCliServer(lambda line: None)
+        cli = LmsCliConnection('localhost', server.port, timeout=0.1)
+        with pytest.raises(Error) as e:
+            cli.request(b"hello?")
+        assert "0.1 seconds" in str(e.value)
+        assert not cli.is_connected
+        server.stop()
+
+    def test_reconnects(self):
+        server = FakeCliServer(lambda line: False if line == b"bye" else line)
+        cli = LmsCliConnection('localhost', server.port).connect()
+        with pytest.raises(Error):
+            cli.request(b"bye")
+        assert not cli.is_connected
+        assert cli.request(b"hello") == [b"hello"]
+        assert server.connections == 2
+        cli.close()
+        server.stop()
+
+    def test_backs_off(self):
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        cli = LmsCliConnection('localhost', port)
+        with pytest.raises(Error) as e:
+            cli.connect()
+        assert "Couldn't connect" in str(e.value)
+        with pytest.raises(Error) as e:
+            cli.connect()
+        assert "Not reconnecting" in str(e.value)
+        assert cli.failures == 1
+
+    def test_logs_in(self):
+        def reply(line):
+            if line.startswith(b"login "):
+                return b"login me ******"
+            return line
+
+        server = FakeCliServer(reply)
+        cli = LmsCliConnection('localhost', server.port, user="me",
+                               password="secret").connect()
+        assert cli.is_connected
+        cli.close()
+        server.stop()
+
+    def test_read_line(self, server):
+        cli = LmsCliConnection('localhost', server.port).connect()
+        assert cli.read_line(timeout=0.01) is None
+        cli.write(b"notification\n")
+        assert cli.read_line(timeout=1) == b"notification"
+        cli.close()
+
+
+class TestCliSocketTransport:
+    def test_communicate(self, server):
+        t = CliSocketTransport('localhost', server.port).start()
+        assert t.is_connected
+        assert t.communicate("players 0 1\nserverstatus") == (
+            "players 0 1\nserverstatus\n")
+        t.stop()
+        assert not t.is_connected
+
+    def test_no_wait_replies_skipped(self, server):
+        t = CliSocketTransport('localhost', server.port).start()
+        assert t.communicate("pause 1\npause 0", wait=False) is None
+        assert t.communicate("time ?") == "time ?\n"
+        t.stop()
+
+    def test_nodelay(self, server):
+        t = CliSocketTransport('localhost', server.port).start()
+        sock = t._cli._sock
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        t.stop()
+
+    def test_failure_disconnects(self):
+        server = FakeCliServer(lambda line: False)
+        t = CliSocketTransport('localhost', server.port).start()
+        with pytest.raises(Error):
+            t.communicate("bye")
+        assert not t.is_connected
+        assert t.failures == 1
+        server.stop()
+
+    def test_logs_in_on_reconnecting(self):
+        logins = []
+
+        def reply(line):
+            if line.startswith(b"login "):
+                logins.append(line)
+                return b"login me ******"
+            return False if line == b"bye" else line
+
+        server = FakeCliServer(reply)
+        t = CliSocketTransport('localhost', server.port, user="me",
+                               password="secret").start()
+        with pytest.raises(Error):
+            t.communicate("bye")
+        t.start()
+        assert t.communicate("time ?") == "time ?\n"
+        assert logins == [b"login me secret"] * 2
+        t.stop()
+        server.stop()
+
+    def test_factory(self):
+        lms = LmsSettings()
+        lms.direct_hostname = 'my-nas'
+        lms.username, lms.password = "me", "secret"
+        mqtt = MqttSettings()
+        mqtt.hostname = None
+        t = TransportFactory(mqtt_settings=mqtt, lms_settings=lms).create()
+        assert isinstance(t, CliSocketTransport)
+        assert "my-nas:9090" in str(t)
+        assert t._cli.user == "me" and t._cli.password == "secret"
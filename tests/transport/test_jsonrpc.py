@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+import json
+import threading
+import time
+from http.client import RemoteDisconnected
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from squeezealexa.squeezebox.server import JsonRpcServer, command_from, \
+    text_of, server_class_for
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.jsonrpc import JsonRpcTransport
+
+PLAYER = "00:04:20:12:34:56"
+
+RESULTS = {
+    "version": {"_version": "7.9.1"},
+    "time": {"_time": 23.5},
+    "serverstatus": {"player count": 2, "players_loop": [
+        {"playerid": PLAYER, "name": "Study", "connected": 1, "power": 1},
+        {"playerid": "gone", "name": "Gone", "connected": 0, "power": 0}]},
+    "genres": {"count": 2, "genres_loop": [{"id": 1, "genre": "Jazz"},
+                                           {"id": 2, "genre": "Rock"}]},
+    "favorites": {"count": 2, "loop_loop": [
+        {"id": "a.0", "name": "Chilled Jazz", "type": "audio",
+         "url": "file:///chilled.m3u", "isaudio": 1, "hasitems": 0},
+        {"id": "a.1", "name": "Podcasts", "isaudio": 0, "hasitems": 1}]},
+    "status": {"mode": "play", "playlist_loop": [
+        {"playlist index": 0, "title": "So What",
+         "artist": "Miles Davis, John Coltrane", "genre": "Jazz"}]},
+}
+
+
+class FakeLmsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        player_id, command = body["params"]
+        self.server.received.append((player_id, command))
+        self.server.paths.append(self.path)
+        if command[0] == "slow":
+            time.sleep(0.5)
+        self.server.clients.add(self.client_address)
+        data = json.dumps({"id": body["id"], "method": body["method"],
+                           "params": body["params"],
+                           "result": RESULTS.get(command[0], {})}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def lms():
+    server = ThreadingHTTPServer(('localhost', 0), FakeLmsHandler)
+    server.received = []
+    server.paths = []
+    server.clients = set()
+    threading.Thread(target=server.serve_forever, args=(0.01,),
+                     daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def transport_for(lms) -> JsonRpcTransport:
+    return JsonRpcTransport("http://localhost:%d" % lms.server_port)
+
+
+class TestJsonRpcTransport:
+    def test_bad_url(self):
+        with pytest.raises(Error):
+            JsonRpcTransport("localhost:9000")
+
+    def test_request(self, lms):
+        t = transport_for(lms).start()
+        assert t.is_connected
+        assert t.request(["time", "?"], PLAYER) == {"_time": 23.5}
+        assert lms.received[-1] == (PLAYER, ["time", "?"])
+
+    def test_keeps_connection_alive(self, lms):
+        t = transport_for(lms).start()
+        for _ in range(5):
+            t.request(["version", "?"])
+        assert len(lms.clients) == 1
+        t.stop()
+
+    def test_path_from_url(self, lms):
+        t = JsonRpcTransport("http://localhost:%d/lms/" % lms.server_port)
+        t.request(["version", "?"])
+        assert lms.paths == ["/lms/jsonrpc.js"]
+
+    def test_no_resend_after_sending(self, lms):
+        t = JsonRpcTransport("http://localhost:%d" % lms.server_port,
+                             timeout=0.2)
+        t.request(["version", "?"])
+        with pytest.raises(Error):
+            t.request(["slow", "+5"])
+        assert [c for _pid, c in lms.received].count(["slow", "+5"]) == 1
+
+    def test_resends_only_if_closed_while_idle(self):
+        closed = JsonRpcTransport._closed_while_idle
+        assert closed(RemoteDisconnected(), sent=True)
+        assert closed(BrokenPipeError(), sent=False)
+        assert not closed(BrokenPipeError(), sent=True)
+        assert not closed(TimeoutError(), sent=True)
+
+    def test_unreachable(self, lms):
+        t = JsonRpcTransport("http://localhost:1", timeout=0.5)
+        with pytest.raises(Error):
+            t.request(["version", "?"])
+
+    def test_no_cli_text(self):
+        transport = JsonRpcTransport("http://localhost:1")
+        with pytest.raises(Error) as e:
+            transport.communicate("serverstatus 0 99")
+        assert "JsonRpcServer" in str(e)
+        assert server_class_for(transport) is JsonRpcServer
+
+
+class TestJsonRpcServer:
+    def test_command_from(self):
+        assert command_from("%s mixer volume +5" % PLAYER) == (
+            ["mixer", "volume", "+5"], PLAYER)
+        assert command_from("playlist addalbum Hip%20Hop * *") == (
+            ["playlist", "addalbum", "Hip Hop", "*", "*"], None)
+
+    def test_text_of(self):
+        assert text_of({"_time": 12.5}) == "12.5"
+        assert text_of({}) == ""
+
+    def test_structured_results(self, lms):
+        server = JsonRpcServer(transport_for(lms).start())
+        assert list(server.players) == [PLAYER]
+        assert server.players[PLAYER].power is True
+        assert server.genres == ["Jazz", "Rock"]
+        assert list(server.favorites) == ["Chilled Jazz"]
+        details = server.get_track_details()
+        assert details['artist'] == ["Miles Davis", "John Coltrane"]
+        assert details['title'] == ["So What"]
+        assert server.get_milliseconds() == 23500.0
+
+    def test_commands(self, lms):
+        server = JsonRpcServer(transport_for(lms).start())
+        server.change_volume(+5)
+        assert lms.received[-1] == (PLAYER, ["mixer", "volume", "+5.0"])
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+from paho.mqtt.client import MQTTMessage
+
+from squeezealexa.settings import MqttSettings
+from squeezealexa.squeezebox.library_cache import LibraryCache
+from squeezealexa.squeezebox.server import Server
+from squeezealexa.transport.mqtt import MqttTransport
+from squeezealexa.transport.player_state import PlayerStateMirror, \
+    state_from, decode, encode
+from tests.transport.fake_transport import A_REAL_STATUS, FakeTransport
+from tests.transport.test_mqtt import EchoingFakeClient
+from tests.transport.test_reply_cache import NotifyingCli, wait_until
+
+PLAYER = "00:04:20:12:34:56"
+OTHER = "00:04:20:ab:cd:ef"
+
+
+class FakeLmsCli:
+    """Quacks like an `LmsCliConnection` to an LMS CLI with some players"""
+
+    def __init__(self, players):
+        self.players = players
+        self.volume = 98
+        self.lastscan = 1000
+
+    def request(self, payload: bytes, timeout=None):
+        line = payload.decode('utf-8').strip()
+        if line.startswith("serverstatus"):
+            reply = line + " lastscan:{scan} player%20count:{num}".format(
+                scan=self.lastscan, num=len(self.players))
+            for pid in self.players:
+                reply += " playerid:{pid} name:{pid} connected:1".format(
+                    pid=pid.replace(':', '%3A'))
+        else:
+            status = A_REAL_STATUS.replace("mixer%20volume%3A98",
+                                           "mixer%20volume%3A" +
+                                           str(self.volume))
+            reply = line + status
+        return [reply.encode('utf-8')]
+
+    def close(self):
+        pass
+
+
+class Published(dict):
+    def __call__(self, topic: str, payload: bytes):
+        self[topic] = payload
+
+
+def mirror_of(cli, published) -> PlayerStateMirror:
+    mirror = PlayerStateMirror(lambda: cli, published, "state")
+    mirror._query_cli = cli
+    return mirror
+
+
+class TestPlayerStateMirror:
+    def test_state_from(self):
+        state = state_from({'playerid': PLAYER, 'name': "Study"},
+                           A_REAL_STATUS)
+        assert state['name'] == "Study"
+        assert state['power'] is True
+        assert state['mode'] == 'play'
+        assert state['volume'] == 98
+        assert state['sync_master'] == "00:04:20:17:5c:94"
+        assert state['track']['genre'] == ["Jazz"]
+        assert decode(encode(state)) == state
+
+    def test_publishes_all(self):
+        published = Published()
+        mirror = mirror_of(FakeLmsCli([PLAYER, OTHER]), published)
+        mirror.refresh_all()
+        assert decode(published["state"]) == [PLAYER, OTHER]
+        assert decode(published["state/" + PLAYER])['volume'] == 98
+
+    def test_event_refreshes_player(self):
+        published = Published()
+        cli = FakeLmsCli([PLAYER])
+        mirror = mirror_of(cli, published)
+        mirror.refresh_all()
+        cli.volume = 50
+        mirror.handle(PLAYER.replace(':', '%3A').encode() +
+                      b" mixer volume 50")
+        assert decode(published["state/" + PLAYER])['volume'] == 50
+
+    def test_rescan_republishes_lastscan(self):
+        published = Published()
+        cli = FakeLmsCli([PLAYER])
+        mirror = mirror_of(cli, published)
+        mirror.refresh_all()
+        assert decode(published["state/" + PLAYER])['lastscan'] == 1000
+        cli.lastscan = 2000
+        mirror.handle(b"rescan done")
+        assert decode(published["state/" + PLAYER])['lastscan'] == 2000
+
+    def test_gone_players_withdrawn(self):
+        published = Published()
+        cli = FakeLmsCli([PLAYER, OTHER])
+        mirror = mirror_of(cli, published)
+        mirror.refresh_all()
+        cli.players = [PLAYER]
+        mirror.handle(OTHER.encode() + b" client disconnect")
+        assert published["state/" + OTHER] == b''
+        assert decode(published["state"]) == [PLAYER]
+
+    def test_withdraws_index_on_stop(self):
+        published = Published()
+        query_cli, notify_cli = FakeLmsCli([PLAYER]), NotifyingCli()
+        clis = [query_cli, notify_cli]
+        mirror = PlayerStateMirror(lambda: clis.pop(0), published, "state")
+        mirror.start()
+        wait_until(lambda: published.get("state"))
+        mirror.stop()
+        mirror.join(5)
+        assert published["state"] == b''
+
+
+class StatefulFakeClient(EchoingFakeClient):
+    """Delivers retained player states on subscribing"""
+
+    def subscribe(self, topic, qos=0):
+        ret = super().subscribe(topic, qos)
+        for name, data in [("state/" + PLAYER,
+                            {'playerid': PLAYER, 'name': "Study",
+                             'connected': True}),
+                           ("state", [PLAYER])]:
+            msg = MQTTMessage(topic=name.encode())
+            msg.payload = encode(data)
+            self.on_message(self, None, msg)
+        return ret
+
+
+class TestMirroredStates:
+    def test_transport_collects_states(self):
+        t = MqttTransport(StatefulFakeClient(MqttSettings()),
+                          req_topic="foo", resp_topic="bar",
+                          state_topic="state")
+        t.start()
+        assert t.player_states[PLAYER]['name'] == "Study"
+
+    def test_incomplete_states_ignored(self):
+        t = MqttTransport(EchoingFakeClient(MqttSettings()),
+                          req_topic="foo", resp_topic="bar",
+                          state_topic="state")
+        msg = MQTTMessage(topic=b"state")
+        msg.payload = encode([PLAYER])
+        t._on_message(None, None, msg)
+        assert t.player_states is None
+
+    def test_server_uses_states(self):
+        class StatefulTransport(FakeTransport):
+            player_states = {PLAYER: {'playerid': PLAYER, 'name': "Study",
+                                      'connected': True}}
+
+        transport = StatefulTransport().start()
+        server = Server(transport=transport)
+        assert server.cur_player_id == PLAYER
+        assert 'serverstatus' not in transport.all_input
+
+    def test_server_checks_mirrored_lastscan(self):
+        class StatefulTransport(FakeTransport):
+            player_states = {PLAYER: {'playerid': PLAYER, 'name': "Study",
+                                      'connected': True, 'lastscan': 1000}}
+
+        transport = StatefulTransport().start()
+        library = LibraryCache()
+        library.saw_server(999)
+        library.put('genres', ["Jazz"])
+        Server(transport=transport, library=library)
+        assert library.lastscan == 1000
+        assert not library.cached('genres')
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import threading
+import time
+
+import pytest
+
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.pool import TransportPool, PooledTransport, \
+    login_hook
+from tests.transport.fake_transport import FakeTransport
+
+
+class SlowTransport(FakeTransport):
+    active = 0
+    most_active = 0
+    lock = threading.Lock()
+
+    def communicate(self, data, wait=True):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.most_active = max(cls.most_active, cls.active)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.active -= 1
+        return super().communicate(data, wait)
+
+
+class UnauthorisedTransport(FakeTransport):
+    def communicate(self, data, wait=True):
+        return "login admin\n"
+
+
+class TestTransportPool:
+    def test_reuses_connections(self):
+        pool = TransportPool(FakeTransport, max_size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            assert second is first
+        assert pool.size == 1
+
+    def test_bounded(self):
+        pool = TransportPool(FakeTransport, max_size=1, timeout=0.1)
+        with pool.connection():
+            with pytest.raises(Error) as e:
+                pool.checkout()
+        assert "No free connection" in str(e)
+
+    def test_drops_unhealthy(self):
+        pool = TransportPool(FakeTransport, max_size=2)
+        with pool.connection() as first:
+            first.failures = 1
+        assert pool.size == 0
+        with pool.connection() as second:
+            assert second is not first
+
+    def test_drops_after_exception(self):
+        pool = TransportPool(FakeTransport, max_size=2)
+        with pytest.raises(ValueError):
+            with pool.connection():
+                raise ValueError("Oops")
+        assert pool.size == 0
+
+    def test_idle_eviction(self):
+        pool = TransportPool(FakeTransport, max_size=2, max_idle_secs=0)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            assert second is not first
+        assert not first.is_connected
+
+    def test_logs_in_each_connection(self):
+        pool = TransportPool(FakeTransport, max_size=2,
+                             on_connect=login_hook("admin", "pass"))
+        with pool.connection() as first:
+            with pool.connection() as second:
+                pass
+        for transport in (first, second):
+            assert transport.all_input == "login admin pass"
+
+    def test_drops_connection_failing_login(self):
+        pool = TransportPool(UnauthorisedTransport, max_size=1,
+                             on_connect=login_hook("admin", "wrong"))
+        with pytest.raises(Error):
+            pool.checkout()
+        assert pool.size == 0
+
+
+class TestPooledTransport:
+    def test_parallel_requests(self):
+        transport = PooledTransport(TransportPool(SlowTransport, max_size=3))
+        transport.start()
+        replies = []
+        threads = [threading.Thread(
+            target=lambda: replies.append(transport.communicate("foo")))
+            for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert replies == ["foo OK\n"] * 6
+        assert 1 < SlowTransport.most_active <= 3
+        transport.stop()
+        assert not transport.is_connected
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+import time
+from queue import Queue, Empty
+
+from squeezealexa.transport.base import Error
+from squeezealexa.transport.bridge import Bridge
+from squeezealexa.transport.reply_cache import ReplyCache, cacheable, \
+    stale_after, CacheInvalidator, PLAYER_STATE
+from tests.transport.test_bridge import EchoingCli, Replies, request
+
+PLAYER = b"00:04:20:12:34:56"
+
+
+def enabled_cache(max_size=100) -> ReplyCache:
+    cache = ReplyCache(max_size=max_size)
+    cache.enabled = True
+    return cache
+
+
+class NotifyingCli:
+    """Quacks like an `LmsCliConnection` subscribed to LMS notifications"""
+
+    def __init__(self):
+        self.events = Queue()
+        self.written = []
+
+    def request(self, payload: bytes, timeout=None):
+        self.written.append(payload)
+        return [payload]
+
+    def read_line(self, timeout=None):
+        try:
+            event = self.events.get(timeout=timeout)
+        except Empty:
+            return None
+        if event is None:
+            raise Error("closed")
+        return event
+
+    def close(self):
+        self.events.put(None)
+
+
+class TestReplyCache:
+    def test_cacheable(self):
+        assert cacheable(b"genres 0 255")
+        assert cacheable(b"favorites items 0 255 want_url:1")
+        assert not cacheable(b"favorites add url:foo")
+        assert not cacheable(b"playlists delete playlist_id:3")
+        assert not cacheable(PLAYER + b" mixer volume ?")
+
+    def test_stale_after(self):
+        assert stale_after(b"rescan done") is None
+        assert stale_after(b"favorites changed") == {b"favorites"}
+        assert stale_after(PLAYER + b" power 1") == PLAYER_STATE
+        assert b"playlists" in stale_after(PLAYER + b" playlist save Foo 3")
+        assert not stale_after(b"something else")
+
+    def test_round_trip(self):
+        cache = enabled_cache()
+        req = b"genres 0 255\nserverstatus 0 99\n"
+        assert cache.reply_for(req) is None
+        cache.store(req, [b"genres 0 255 foo", b"serverstatus 0 99 bar"], 0)
+        assert cache.reply_for(req) == (b"genres 0 255 foo\n"
+                                        b"serverstatus 0 99 bar")
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_disabled(self):
+        cache = ReplyCache()
+        cache.store(b"genres 0 255\n", [b"genres 0 255 foo"], 0)
+        assert not len(cache)
+        assert cache.reply_for(b"genres 0 255\n") is None
+
+    def test_uncacheable_lines_skipped(self):
+        cache = enabled_cache()
+        req = b"genres 0 1\n" + PLAYER + b" time ?\n"
+        cache.store(req, [b"genres 0 1 x", PLAYER + b" time 3"], 0)
+        assert len(cache) == 1
+        assert cache.reply_for(req) is None
+        assert cache.reply_for(b"genres 0 1") == b"genres 0 1 x"
+
+    def test_lru_bound(self):
+        cache = enabled_cache(max_size=2)
+        for i in range(3):
+            cache.store(b"genres %d 1" % i, [b"genres %d 1 x" % i], 0)
+        assert len(cache) == 2
+        assert cache.reply_for(b"genres 0 1") is None
+        assert cache.reply_for(b"genres 2 1")
+
+    def test_invalidate_some(self):
+        cache = enabled_cache()
+        cache.store(b"genres 0 1\nfavorites items 0 1",
+                    [b"genres 0 1 x", b"favorites items 0 1 y"], 0)
+        cache.invalidate({b"favorites"})
+        assert cache.reply_for(b"genres 0 1")
+        assert cache.reply_for(b"favorites items 0 1") is None
+
+    def test_stale_generation_not_stored(self):
+        cache = enabled_cache()
+        generation = cache.generation
+        cache.invalidate({b"genres"})
+        cache.store(b"genres 0 1", [b"genres 0 1 x"], generation)
+        assert not len(cache)
+
+
+class TestCacheInvalidator:
+    def test_invalidates_on_event(self):
+        cache = ReplyCache()
+        cli = NotifyingCli()
+        invalidator = CacheInvalidator(cache, lambda: cli)
+        invalidator.start()
+        wait_until(lambda: cache.enabled)
+        assert cli.written[0].startswith(b"subscribe ")
+        cache.store(b"genres 0 1", [b"genres 0 1 x"], cache.generation)
+        assert len(cache)
+        cli.events.put(b"rescan done\n")
+        wait_until(lambda: not len(cache))
+        invalidator.stop()
+        invalidator.join(5)
+        assert not cache.enabled
+
+
+class TestBridgeWithCache:
+    def test_cached_replies_skip_cli(self):
+        cache = enabled_cache()
+        replies = Replies(2)
+        clis = []
+
+        def connect():
+            clis.append(EchoingCli())
+            return clis[-1]
+
+        bridge = Bridge(connect, replies, workers=1, cache=cache).start()
+        bridge.submit(request("one", b"genres 0 255\n"))
+        wait_until(lambda: len(replies.received) == 1)
+        bridge.submit(request("two", b"genres 0 255\n"))
+        assert replies.done.wait(5)
+        bridge.stop()
+        assert replies.received[1] == ("two", b"genres 0 255")
+        assert (cache.hits, cache.misses) == (1, 1)
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.001)
@@ -10,6 +10,7 @@
 #
 #   See LICENSE for full license
 
+import asyncio
 from logging import getLogger
 from socket import error as SocketError
 from socket import socket
@@ -18,7 +19,8 @@ from unittest import TestCase
 import pytest
 
 from squeezealexa.transport.base import Error as TransportError
-from squeezealexa.transport.ssl_wrap import SslSocketTransport
+from squeezealexa.transport.ssl_wrap import SslSocketTransport, \
+    AsyncSslSocketTransport
 from tests.transport.base import ServerResource, TimeoutServer, CertFiles, \
     response_for
 
@@ -40,6 +42,25 @@ class FailingSocket(socket):
         self.was_closed = True
 
 
+class ChunkedSocket:
+    """Replays a canned reply, a few bytes at a time"""
+    _closed = True
+
+    def __init__(self, reply: bytes, chunk_size=7):
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.sent = b''
+
+    def sendall(self, data, flags=None):
+        self.sent += data
+
+    def recv_into(self, buffer, nbytes=0, flags=None):
+        size = min(len(buffer), self.chunk_size, len(self.reply))
+        buffer[:size] = self.reply[:size]
+        self.reply = self.reply[size:]
+        return size
+
+
 class TestSslTransport(TestCase):
 
     def _working_transport(self, server):
@@ -93,6 +114,19 @@ class TestSslTransport(TestCase):
             assert "Too many Squeezebox failures" in str(e)
             assert transport._ssl_sock.was_closed
 
+    def test_session_resumed_on_reconnect(self):
+        with ServerResource() as server:
+            reused = []
+            for i in range(2):
+                t = SslSocketTransport('localhost', port=server.port,
+                                       cert_file=CertFiles.CERT_AND_KEY,
+                                       ca_file=CertFiles.CERT_AND_KEY)
+                t.start()
+                t.communicate("HELLO")
+                reused.append(t._ssl_sock.session_reused)
+                t.stop()
+            assert reused == [False, True]
+
     def test_no_ca(self):
         with ServerResource() as server:
             with pytest.raises(TransportError) as exc:
@@ -148,3 +182,52 @@ class TestSslTransport(TestCase):
                                    ca_file=CertFiles.CERT_AND_KEY,
                                    timeout=1).start()
             assert "check the server setup and the firewall" in str(exc)
+
+
+class TestSslTransportReading(TestCase):
+
+    def _transport(self, reply, **kwargs):
+        transport = SslSocketTransport('localhost', port=0)
+        transport._ssl_sock = ChunkedSocket(reply, **kwargs)
+        return transport
+
+    def test_multiline_chunked(self):
+        transport = self._transport("f\u00f6\u00f6 bar\nbaz\n".encode('utf-8'),
+                                    chunk_size=2)
+        assert transport.communicate("one\ntwo") == "f\u00f6\u00f6 bar\nbaz\n"
+
+    def test_large_reply_grows_buffer(self):
+        line = "genre%3AJazz " * 100000 + "\n"
+        transport = self._transport(line.encode('utf-8'), chunk_size=65536)
+        assert transport.communicate("genres 0 255") == line
+        assert len(transport._buffer) == SslSocketTransport._BUFFER_SIZE
+
+    def test_eof_stops_reading(self):
+        transport = self._transport(b"partial")
+        assert transport.communicate("one\ntwo") == "partial"
+
+
+class TestAsyncSslTransport(TestCase):
+
+    def test_with_real_server(self):
+        async def go(port):
+            t = AsyncSslSocketTransport('localhost', port=port,
+                                        cert_file=CertFiles.CERT_AND_KEY,
+                                        ca_file=CertFiles.CERT_AND_KEY)
+            await t.start()
+            assert t.is_connected
+            response = await t.communicate('HELLO')
+            await t.stop()
+            return response
+
+        with ServerResource() as server:
+            loop = asyncio.new_event_loop()
+            assert loop.run_until_complete(go(server.port)) == \
+                response_for("HELLO")
+
+    def test_bad_port(self):
+        t = AsyncSslSocketTransport('localhost', port=12345,
+                                    cert_file=CertFiles.CERT_AND_KEY)
+        with pytest.raises(TransportError) as exc:
+            asyncio.new_event_loop().run_until_complete(t.start())
+        assert 'localhost:12345' in exc.value.message
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright 2018 Nick Boultbee
+#   This file is part of squeeze-alexa.
+#
+#   squeeze-alexa is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   See LICENSE for full license
+
+import os
+import ssl
+from shutil import copy
+
+from squeezealexa.transport.ssl_wrap import SslSocketTransport
+from squeezealexa.transport.tls import cached_context, stamp_of, \
+    load_cert_chain_data
+from tests.transport.base import CertFiles, ServerResource
+
+
+def fake_create():
+    return ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+
+
+class TestCachedContext:
+    def test_reuses_context(self):
+        first = cached_context(("test", "reuse"), fake_create)
+        assert cached_context(("test", "reuse"), fake_create) is first
+
+    def test_changed_file_creates_new_context(self, tmpdir):
+        path = str(tmpdir.join("cert.pem"))
+        copy(CertFiles.CERT_AND_KEY, path)
+        first = cached_context(("test", path), fake_create, [path])
+        assert cached_context(("test", path), fake_create, [path]) is first
+        stamp = stamp_of(path)
+        os.utime(path, ns=(stamp, stamp + 10 ** 9))
+        assert cached_context(("test", path), fake_create, [path]) is not first
+
+    def test_stamp_of_missing(self):
+        assert stamp_of("not.there") is None
+        assert stamp_of(None) is None
+
+
+def test_load_cert_chain_data():
+    context = fake_create()
+    with open(CertFiles.CERT_AND_KEY) as f:
+        load_cert_chain_data(context, f.read().encode('ascii'))
+
+
+def test_ssl_transport_from_data():
+    with open(CertFiles.CERT_AND_KEY) as f:
+        pem = f.read()
+    with ServerResource() as server:
+        t = SslSocketTransport('localhost', port=server.port,
+                               cert_data=pem, ca_data=pem)
+        t.start()
+        assert t.communicate("HELLO")
+        other = SslSocketTransport('localhost', port=server.port,
+                                   cert_data=pem, ca_data=pem)
+        assert other._context is t._context
+        t.stop()